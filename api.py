@@ -0,0 +1,301 @@
+# api.py
+"""
+Bezgłowe API HTTP (ASGI) obok interfejsu Streamlit.
+
+    uvicorn api:app --host 0.0.0.0 --port 8000
+
+Endpointy (JSON):
+    POST /predict        {"text": "..."} lub {"gender", "age", "time_5km_seconds"}
+    POST /predict/batch  {"records": [{"text": ...} | {"gender", ...}, ...]}
+    POST /extract        {"text": "..."}
+    GET  /health         stan ładowania modelu
+    GET  /metrics        liczniki + latencja etapów (format tekstowy Prometheus)
+
+Odpowiedzi /predict mają ten sam format co eksport JSON w app.py
+(timestamp, input, prediction, user_input_raw). Predyktor i ekstraktor
+(extract_user_data_detailed) są singletonami procesu; praca CPU/LLM idzie
+do puli wątków, więc pętla zdarzeń obsługuje równoległe żądania.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import threading
+from datetime import datetime as dt
+from typing import Any, Dict, List, Optional, Tuple
+
+# Załaduj .env tylko lokalnie (jak w app.py)
+if os.path.exists(".env"):
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except Exception:
+        pass
+
+MAX_BODY_BYTES = int(os.getenv("API_MAX_BODY_BYTES", str(1024 * 1024)))
+MAX_BATCH = int(os.getenv("API_MAX_BATCH", "1000"))
+
+FIELDS = ("gender", "age", "time_5km_seconds")
+
+_lock = threading.Lock()
+_predictor = None
+
+
+def get_predictor():
+    """Jeden HalfMarathonPredictor na proces (+ watcher przy MODEL_WATCH=1)."""
+    global _predictor
+    if _predictor is None:
+        with _lock:
+            if _predictor is None:
+                from utils.model_predictor import HalfMarathonPredictor
+                from utils.model_watcher import maybe_start_watcher
+                from utils.metrics import maybe_start_flusher
+                predictor = HalfMarathonPredictor()
+                maybe_start_watcher(predictor)
+                maybe_start_flusher()
+                _predictor = predictor
+    return _predictor
+
+
+def get_extractor():
+    from utils.llm_extractor import extract_user_data_detailed
+    return extract_user_data_detailed
+
+
+def get_batch_extractor():
+    from utils.llm_extractor import extract_user_data_batch
+    return extract_user_data_batch
+
+
+def preload_telemetry():
+    from utils.langfuse_shim import preload
+    preload()
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# ----------------------------
+# Logika endpointów (synchroniczna, wołana w wątkach)
+# ----------------------------
+
+def _export_payload(
+    extracted: Dict[str, Any], prediction: Dict[str, Any], raw: Optional[str]
+) -> Dict[str, Any]:
+    """Ten sam kształt co export_payload w app.py."""
+    return {
+        "timestamp": dt.now().isoformat(),
+        "input": extracted,
+        "prediction": prediction,
+        "user_input_raw": raw,
+    }
+
+
+def _structured(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Pola wprost z body; złe typy = 400 (zakresy sprawdza predict -> 422).
+    Liczby mogą przyjść jako napis ("30"), ale tylko dający się sparsować.
+    """
+    fields = {f: record.get(f) for f in FIELDS}
+    if fields["gender"] is not None and not isinstance(fields["gender"], str):
+        raise HTTPError(400, "Pole 'gender' musi być napisem (male/female).")
+    for name in ("age", "time_5km_seconds"):
+        value = fields[name]
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise HTTPError(400, f"Pole '{name}' musi być liczbą.")
+        if isinstance(value, str):
+            try:
+                float(value)
+            except ValueError:
+                raise HTTPError(400, f"Pole '{name}' musi być liczbą.") from None
+    return fields
+
+
+def _text_of(record: Dict[str, Any]) -> Optional[str]:
+    text = record.get("text")
+    if text is None:
+        return None
+    if not isinstance(text, str) or not text.strip():
+        raise HTTPError(400, "Pole 'text' musi być niepustym napisem.")
+    return text
+
+
+def handle_extract(body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    text = _text_of(body)
+    if text is None:
+        raise HTTPError(400, "Wymagane pole 'text'.")
+    result = get_extractor()(text)
+    return 200, {
+        "input": result.fields,
+        "complete": result.complete,
+        "sources": result.sources,
+        "timings": result.timings,
+        "user_input_raw": text,
+    }
+
+
+def handle_predict(body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    text = _text_of(body)
+    extracted = get_extractor()(text).fields if text is not None else _structured(body)
+    prediction = get_predictor().predict(extracted)
+    status = 200 if prediction.get("success") else 422
+    return status, _export_payload(extracted, prediction, text)
+
+
+def handle_predict_batch(body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    records = body.get("records")
+    if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+        raise HTTPError(400, "Wymagane pole 'records': lista obiektów.")
+    if len(records) > MAX_BATCH:
+        raise HTTPError(413, f"Za dużo rekordów (max {MAX_BATCH}).")
+
+    texts: List[Optional[str]] = [_text_of(r) for r in records]
+    inputs = [_structured(r) for r in records]
+
+    # Opisy tekstowe: jedna ekstrakcja wsadowa (REGEX + zbiorcze zapytania LLM)
+    with_text = [i for i, t in enumerate(texts) if t is not None]
+    if with_text:
+        extracted = get_batch_extractor()([texts[i] for i in with_text])
+        for i, fields in zip(with_text, extracted):
+            # jawnie podane pola mają pierwszeństwo przed ekstrakcją
+            inputs[i] = {f: inputs[i][f] if inputs[i][f] is not None else fields.get(f) for f in FIELDS}
+
+    predictions = get_predictor().predict_many(inputs)
+    results = [
+        _export_payload(inp, pred, raw)
+        for inp, pred, raw in zip(inputs, predictions, texts)
+    ]
+    return 200, {
+        "count": len(results),
+        "succeeded": sum(1 for p in predictions if p.get("success")),
+        "results": results,
+    }
+
+
+def handle_health(_: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    return 200, {"status": "ok", "model": get_predictor().load_status()}
+
+
+def handle_metrics(_: Dict[str, Any]) -> Tuple[int, str]:
+    from utils import metrics
+    return 200, metrics.render_counters_text() + metrics.render_text()
+
+
+ROUTES = {
+    ("POST", "/predict"): handle_predict,
+    ("POST", "/predict/batch"): handle_predict_batch,
+    ("POST", "/extract"): handle_extract,
+    ("GET", "/health"): handle_health,
+    ("GET", "/metrics"): handle_metrics,
+}
+
+
+# ----------------------------
+# ASGI
+# ----------------------------
+
+def _json_default(value: Any):
+    # typy NumPy (np. int64 z predict_batch) -> typy Pythona
+    if hasattr(value, "item"):
+        return value.item()
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} nie jest serializowalny do JSON")
+
+
+async def _read_body(receive) -> bytes:
+    chunks: List[bytes] = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise HTTPError(400, "Połączenie przerwane.")
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise HTTPError(413, f"Body większe niż {MAX_BODY_BYTES} B.")
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _send_response(send, status: int, payload: Dict[str, Any] | str) -> None:
+    """Odpowiedź JSON (dict) albo text/plain (str, np. /metrics)."""
+    if isinstance(payload, str):
+        body, content_type = payload.encode("utf-8"), b"text/plain; version=0.0.4; charset=utf-8"
+    else:
+        body = json.dumps(payload, ensure_ascii=False, default=_json_default).encode("utf-8")
+        content_type = b"application/json; charset=utf-8"
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", content_type),
+                (b"content-length", str(len(body)).encode("ascii")),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                # langfuse importowany w tle, model ładowany przed pierwszym
+                # żądaniem - żadne z nich nie trafia do latencji żądania
+                preload_telemetry()
+                await asyncio.to_thread(get_predictor)
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    """Aplikacja ASGI (uvicorn/hypercorn) bez zależności od frameworka."""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    method = scope["method"]
+    path = scope["path"].rstrip("/") or "/"
+    handler = ROUTES.get((method, path))
+    try:
+        if handler is None:
+            if any(p == path for _, p in ROUTES):
+                raise HTTPError(405, f"Metoda {method} niedozwolona dla {path}.")
+            raise HTTPError(404, f"Nieznany endpoint: {path}")
+
+        raw = await _read_body(receive)
+        body: Dict[str, Any] = {}
+        if raw.strip():
+            try:
+                body = json.loads(raw)
+            except ValueError:
+                raise HTTPError(400, "Niepoprawny JSON.")
+            if not isinstance(body, dict):
+                raise HTTPError(400, "Oczekiwano obiektu JSON.")
+
+        status, payload = await asyncio.to_thread(handler, body)
+    except HTTPError as e:
+        status, payload = e.status, {"success": False, "error": e.message}
+    except Exception as e:
+        print(f"⚠️ API: błąd obsługi {method} {path}: {e}")
+        status, payload = 500, {"success": False, "error": "Błąd wewnętrzny serwera."}
+
+    await _send_response(send, status, payload)
@@ -36,16 +36,22 @@ import streamlit as st
 @st.cache_resource
 def get_predictor():
     from utils.model_predictor import HalfMarathonPredictor
-    return HalfMarathonPredictor()
+    from utils.model_watcher import maybe_start_watcher
+    from utils.metrics import maybe_start_flusher
+    predictor = HalfMarathonPredictor()
+    maybe_start_watcher(predictor)  # MODEL_WATCH=1: hot reload nowych wersji ze Spaces
+    maybe_start_flusher()  # METRICS_FLUSH_DIR: liczniki procesu do pliku
+    return predictor
 
 @st.cache_resource
 def get_extractor():
-    from utils.llm_extractor import extract_user_data_auto
-    return extract_user_data_auto
+    from utils.llm_extractor import extract_user_data_detailed
+    return extract_user_data_detailed
 
 # Langfuse shim – bezpieczny import
 try:
-    from utils.langfuse_shim import observe, langfuse_context, langfuse
+    from utils.langfuse_shim import observe, langfuse_context, trace, update_observation, preload
+    preload()  # import langfuse w tle, nie przy pierwszym żądaniu
 except Exception:
     def observe(name=None):
         def decorator(func):
@@ -58,7 +64,12 @@ except Exception:
         @staticmethod
         def update_current_observation(**kwargs): pass
     langfuse_context = _DummyContext()
-    langfuse = None
+
+    def trace(**kwargs):
+        return False
+
+    def update_observation(**kwargs):
+        pass
 
 # --- Konfiguracja strony ---
 st.set_page_config(
@@ -73,14 +84,6 @@ if "prediction_history" not in st.session_state:
     st.session_state.prediction_history = []
 if "initialized" not in st.session_state:
     st.session_state.initialized = True
-if "metrics" not in st.session_state:
-    st.session_state.metrics = {
-        "total_predictions": 0,
-        "regex_only": 0,
-        "llm_needed": 0,
-        "ml_mode": 0,
-        "fallback_mode": 0,
-    }
 # Bufory do stabilnych pobrań
 for k in ("export_txt", "export_json", "export_basename"):
     st.session_state.setdefault(k, None)
@@ -125,19 +128,30 @@ with st.sidebar:
     st.metric("Średni błąd bezwzględny", "~4,5 minuty")
     st.metric("Wynik R²", "0,92")
 
-    # Metryki użycia
-    m = st.session_state.metrics
-    if m["total_predictions"] > 0:
+    # Metryki użycia - wspólne dla wszystkich sesji procesu (utils/metrics.py);
+    # przy METRICS_FLUSH_DIR suma z plików wszystkich workerów
+    from utils import metrics
+    m = metrics.aggregate_dir() if os.getenv("METRICS_FLUSH_DIR") else metrics.counters()
+    if m["predictions_total"] > 0:
         st.header("📊 Statystyki")
-        st.metric("Predykcje ogółem", m["total_predictions"])
-        regex_pct = (m["regex_only"] / m["total_predictions"]) * 100
-        st.metric("REGEX only", f"{m['regex_only']} ({regex_pct:.0f}%)")
-        ml_pct = (m["ml_mode"] / m["total_predictions"]) * 100
-        st.metric("Model ML", f"{m['ml_mode']} ({ml_pct:.0f}%)")
+        r = metrics.rates(m)
+        st.metric("Predykcje ogółem", m["predictions_total"])
+        st.metric("REGEX only", f"{m['extractions_regex_only']} ({r['regex_hit_rate'] * 100:.0f}%)")
+        ml_pct = (m["predictions_ml"] / m["predictions_total"]) * 100
+        st.metric("Model ML", f"{m['predictions_ml']} ({ml_pct:.0f}%)")
+
+    if st.checkbox("⏱️ Latencja etapów"):
+        from utils import metrics
+        rows = metrics.stage_table()
+        if rows:
+            st.table(rows)
+        else:
+            st.caption("Brak pomiarów" + ("" if metrics.enabled() else " (PIPELINE_METRICS=0)"))
 
     if st.checkbox("🔧 Info o modelu"):
         predictor = get_predictor()
         st.json(predictor.model_metadata)
+        st.json(predictor.load_status())
 
     if st.session_state.prediction_history:
         st.header("📜 Historia")
@@ -188,7 +202,7 @@ if predict_button:
     else:
         with st.spinner("🤖 Analizuję Twoje dane..."):
             try:
-                extract_user_data_auto = get_extractor()
+                extract_user_data_detailed = get_extractor()
                 predictor = get_predictor()
 
                 @observe(name="user_data_extraction_auto")
@@ -201,18 +215,19 @@ if predict_button:
                             )
                     except Exception:
                         pass
-                    return extract_user_data_auto(text)
+                    result = extract_user_data_detailed(text)
+                    update_observation(
+                        output=result.fields,
+                        metadata={"sources": result.sources, "timings": result.timings},
+                    )
+                    return result
 
-                extracted_data = do_extract(user_input)
+                extraction = do_extract(user_input)
+                extracted_data = extraction.fields
 
-                # Ustal, czy wystarczył regex
-                from utils.llm_extractor import _preparse_quick
-                quick_result = _preparse_quick(user_input)
-                was_regex_only = all(quick_result.values())
-                if was_regex_only:
-                    st.session_state.metrics["regex_only"] += 1
-                else:
-                    st.session_state.metrics["llm_needed"] += 1
+                # Czy wystarczył regex - z wyniku ekstrakcji, bez ponownego parsowania
+                # (liczniki procesu zwiększa sama ekstrakcja)
+                was_regex_only = extraction.regex_only
 
                 # Podgląd rozpoznanych danych
                 with st.expander("🔍 Rozpoznane dane", expanded=False):
@@ -239,6 +254,17 @@ if predict_button:
                     else:
                         st.info("🤖 Użyto LLM do ekstrakcji danych")
 
+                    source_labels = {"regex": "REGEX", "llm": "LLM", "cache": "LLM (cache)", None: "—"}
+                    st.caption(
+                        "Źródła: "
+                        + ", ".join(
+                            f"{name} = {source_labels.get(extraction.sources.get(field), '—')}"
+                            for field, name in (("gender", "płeć"), ("age", "wiek"), ("time_5km_seconds", "czas 5km"))
+                        )
+                        + " · czas: "
+                        + ", ".join(f"{layer} {sec * 1000:.1f} ms" for layer, sec in extraction.timings.items())
+                    )
+
                 # Walidacja kompletu danych
                 if not all(
                     [
@@ -266,26 +292,15 @@ if predict_button:
                     prediction = predictor.predict(extracted_data)
                 except Exception as e:
                     st.error(f"❌ Błąd podczas predykcji: {e}")
-                    if langfuse:
-                        try:
-                            langfuse.trace(
-                                name="halfmarathon_prediction_runtime_error",
-                                input=extracted_data,
-                                output={"error": str(e)},
-                                metadata={"success": False},
-                            )
-                        except Exception:
-                            pass
+                    trace(
+                        name="halfmarathon_prediction_runtime_error",
+                        input=extracted_data,
+                        output={"error": str(e)},
+                        metadata={"success": False},
+                    )
                     st.stop()
 
                 if prediction.get("success"):
-                    # Metryki
-                    st.session_state.metrics["total_predictions"] += 1
-                    if prediction["details"]["mode"] == "ml":
-                        st.session_state.metrics["ml_mode"] += 1
-                    else:
-                        st.session_state.metrics["fallback_mode"] += 1
-
                     # Wynik
                     st.markdown(
                         f"""
@@ -411,22 +426,20 @@ if predict_button:
                     st.session_state.export_json = export_json
                     st.session_state.export_basename = f"predykcja_{dt.now().strftime('%Y%m%d_%H%M')}"
 
-                    # Log do Langfuse (opcjonalnie)
-                    if langfuse:
-                        try:
-                            langfuse.trace(
-                                name="halfmarathon_prediction_auto",
-                                input=extracted_data,
-                                output=prediction,
-                                metadata={
-                                    "mode": "auto",
-                                    "success": True,
-                                    "extraction_method": "regex" if was_regex_only else "llm",
-                                    "prediction_mode": prediction["details"]["mode"],
-                                },
-                            )
-                        except Exception:
-                            pass
+                    # Log do Langfuse (opcjonalnie; kolejka + wątek tła, bez I/O tutaj)
+                    trace(
+                        name="halfmarathon_prediction_auto",
+                        input=extracted_data,
+                        output=prediction,
+                        metadata={
+                            "mode": "auto",
+                            "success": True,
+                            "extraction_method": "regex" if was_regex_only else "llm",
+                            "extraction_sources": extraction.sources,
+                            "extraction_timings": extraction.timings,
+                            "prediction_mode": prediction["details"]["mode"],
+                        },
+                    )
 
                 else:
                     # Błąd predykcji z hints
@@ -449,16 +462,12 @@ if predict_button:
                 import traceback
                 with st.expander("🔍 Szczegóły błędu (dla debugowania)"):
                     st.code(traceback.format_exc())
-                if langfuse:
-                    try:
-                        langfuse.trace(
-                            name="halfmarathon_prediction_error",
-                            input={"user_input": user_input},
-                            output={"error": str(e)},
-                            metadata={"success": False},
-                        )
-                    except Exception:
-                        pass
+                trace(
+                    name="halfmarathon_prediction_error",
+                    input={"user_input": user_input},
+                    output={"error": str(e)},
+                    metadata={"success": False},
+                )
 
 # --- Sekcja pobierania (zawsze renderowana; stabilna) ---
 st.markdown("---")
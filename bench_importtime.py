@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark czasu importu punktów wejścia (python -X importtime).
+
+Każdy moduł importowany jest w świeżym interpreterze. Sprawdzane są:
+  - budżet czasu (cumulative z -X importtime, w ms),
+  - brak ciężkich zależności, które mają być ładowane leniwie.
+
+Użycie:
+    python bench_importtime.py            # tabela + kod wyjścia 1 przy przekroczeniu
+    IMPORT_BUDGET_SCALE=2 python bench_importtime.py   # wolna maszyna CI
+"""
+
+import os
+import subprocess
+import sys
+
+HEAVY = ("pandas", "boto3", "botocore", "openai", "xgboost", "langfuse")
+
+# moduł -> (budżet [ms], zależności zakazane przy imporcie)
+ENTRY_POINTS = {
+    "utils": (50, HEAVY),
+    "utils.extraction_engine": (50, HEAVY),
+    "utils.input_parser": (50, HEAVY),
+    "utils.llm_extractor": (150, HEAVY),
+    "utils.langfuse_shim": (50, HEAVY),
+    "utils.model_predictor": (300, HEAVY),  # numpy jest potrzebny fallbackowi
+    "api": (150, HEAVY),
+}
+
+
+def measure(module):
+    """(cumulative [ms], zbiór zaimportowanych modułów) dla importu w nowym procesie."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} nieudany:\n{proc.stderr[-2000:]}")
+
+    total_us = None
+    imported = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue  # nagłówek
+        imported.add(name.strip())
+        if name.rstrip() == f" {module}":
+            total_us = int(cumulative)
+    return (total_us or 0) / 1000, imported
+
+
+def check(module, budget_ms=None, forbidden=None):
+    """Lista problemów (pusta = OK) oraz zmierzony czas."""
+    default_budget, default_forbidden = ENTRY_POINTS.get(module, (None, HEAVY))
+    budget_ms = budget_ms if budget_ms is not None else default_budget
+    forbidden = forbidden if forbidden is not None else default_forbidden
+    scale = float(os.getenv("IMPORT_BUDGET_SCALE", "1"))
+
+    elapsed, imported = measure(module)
+    problems = []
+    heavy = sorted(
+        root for root in forbidden
+        if any(m == root or m.startswith(root + ".") for m in imported)
+    )
+    if heavy:
+        problems.append(f"importuje: {', '.join(heavy)}")
+    if budget_ms is not None and elapsed > budget_ms * scale:
+        problems.append(f"{elapsed:.1f} ms > budżet {budget_ms * scale:.0f} ms")
+    return problems, elapsed
+
+
+def main():
+    failed = False
+    print(f"{'moduł':<28}{'czas [ms]':>10}{'budżet':>9}  status")
+    for module, (budget, _) in ENTRY_POINTS.items():
+        problems, elapsed = check(module)
+        failed = failed or bool(problems)
+        status = "✅" if not problems else "❌ " + "; ".join(problems)
+        print(f"{module:<28}{elapsed:>10.1f}{budget:>9}  {status}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -162,6 +162,1194 @@ class TestCaching(unittest.TestCase):
         self.assertEqual(cache_info2.hits, cache_info1.hits + 1)
         print(f"✅ Cache hit ratio: {cache_info2.hits}/{cache_info2.hits + cache_info2.misses}")
 
+    def test_disk_cache_ttl_and_eviction(self):
+        """Trwały cache: współdzielenie między instancjami, TTL i limit rozmiaru"""
+        import tempfile
+        import time
+        from utils.llm_cache import LLMDiskCache
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'llm.sqlite3')
+            writer = LLMDiskCache(path, ttl_seconds=60, max_entries=2)
+            reader = LLMDiskCache(path, ttl_seconds=60, max_entries=2)  # "inny worker"
+
+            writer.set('a', '{"age": 1}')
+            self.assertEqual(reader.get('a'), '{"age": 1}')
+
+            time.sleep(0.01)
+            writer.set('b', 'B')
+            time.sleep(0.01)
+            writer.set('c', 'C')
+            self.assertEqual(len(writer), 2)
+            self.assertIsNone(reader.get('a'))  # najdawniej używany wyleciał
+
+            expired = LLMDiskCache(path, ttl_seconds=0, max_entries=2)
+            time.sleep(0.01)
+            self.assertIsNone(expired.get('b'))
+            for cache in (writer, reader, expired):
+                cache.close()
+
+    def test_disk_cache_hits_do_not_write(self):
+        """Trafienie = sam SELECT; eviction nie przy każdym zapisie"""
+        import tempfile
+        from utils.llm_cache import LLMDiskCache
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = LLMDiskCache(os.path.join(tmp, 'llm.sqlite3'), max_entries=1000)
+            cache.set('a', 'A')
+            statements = []
+            cache._conn.set_trace_callback(statements.append)
+            for _ in range(50):
+                self.assertEqual(cache.get('a'), 'A')
+            self.assertFalse([s for s in statements if not s.startswith('SELECT')])
+
+            statements.clear()
+            for i in range(10):
+                cache.set(f'k{i}', 'v')
+            self.assertFalse([s for s in statements if 'COUNT' in s])
+            cache.close()
+
+    def test_disk_cache_hit_skips_api(self):
+        """Trafienie w trwałym cache nie woła OpenAI (np. po restarcie procesu)"""
+        import tempfile
+        from unittest.mock import Mock, patch
+        import utils.llm_extractor as ex
+        from utils.llm_cache import LLMDiskCache
+
+        client = Mock()
+        client.chat.completions.create.return_value.choices = [
+            Mock(message=Mock(content='{"gender": "male", "age": 30, "time_5km_seconds": 1470}'))
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            disk = LLMDiskCache(os.path.join(tmp, 'llm.sqlite3'))
+            with patch.object(ex, '_get_openai_client', return_value=client), \
+                    patch.object(ex, '_get_disk_cache', return_value=disk):
+                ex._cached_llm_call.cache_clear()
+                first = ex._cached_llm_call("Biegacz, 30 lat", "gpt-test")
+                ex._cached_llm_call.cache_clear()  # symulacja restartu procesu
+                second = ex._cached_llm_call("  biegacz,   30 LAT ", "gpt-test")
+            disk.close()
+
+        self.assertEqual(first, second)
+        self.assertEqual(client.chat.completions.create.call_count, 1)
+        ex._cached_llm_call.cache_clear()
+
+
+class TestAsyncExtraction(unittest.TestCase):
+    """Test async ekstrakcji: single-flight i limit równoległości"""
+
+    RESPONSE = '{"gender": "female", "age": 28, "time_5km_seconds": 1620}'
+
+    def _fake_client(self, stats):
+        from unittest.mock import Mock
+        import asyncio
+
+        async def create(**kwargs):
+            stats['calls'] += 1
+            stats['active'] += 1
+            stats['peak'] = max(stats['peak'], stats['active'])
+            await asyncio.sleep(0.02)
+            stats['active'] -= 1
+            return Mock(choices=[Mock(message=Mock(content=self.RESPONSE))])
+
+        client = Mock()
+        client.chat.completions.create = create
+        return client
+
+    def _patched(self, stats, concurrency=8):
+        from unittest.mock import patch
+        from contextlib import ExitStack
+        import utils.llm_extractor as ex
+
+        stack = ExitStack()
+        stack.enter_context(patch.object(ex, '_make_async_client', return_value=self._fake_client(stats)))
+        stack.enter_context(patch.object(ex, '_get_disk_cache', return_value=None))
+        stack.enter_context(patch.object(ex, 'LLM_MAX_CONCURRENCY', concurrency))
+        ex._async_l1.clear()
+        stack.callback(ex._async_l1.clear)
+        stack.callback(ex._async_states.clear)  # stan pętli tła trzyma fałszywego klienta
+        return stack
+
+    def test_identical_requests_share_one_call(self):
+        """Równoległe identyczne teksty -> jedno zapytanie do API"""
+        import asyncio
+        import utils.llm_extractor as ex
+
+        stats = {'calls': 0, 'active': 0, 'peak': 0}
+
+        async def main():
+            texts = ["Kobieta 28 lat, 5k w 27 minut"] * 9 + ["  kobieta 28 LAT, 5k w 27 minut"]
+            return await asyncio.gather(*(ex.extract_user_data_async(t) for t in texts))
+
+        with self._patched(stats):
+            results = asyncio.run(main())
+
+        self.assertEqual(stats['calls'], 1)
+        for r in results:
+            self.assertEqual(r, {'gender': 'female', 'age': 28, 'time_5km_seconds': 1620})
+
+    def test_concurrency_is_bounded(self):
+        """Różne teksty: liczba zapytań w locie nie przekracza limitu"""
+        import asyncio
+        import utils.llm_extractor as ex
+
+        stats = {'calls': 0, 'active': 0, 'peak': 0}
+
+        async def main():
+            return await asyncio.gather(*(ex._async_llm_call(f"biegaczka {i}", "gpt-test") for i in range(12)))
+
+        with self._patched(stats, concurrency=3):
+            asyncio.run(main())
+
+        self.assertEqual(stats['calls'], 12)
+        self.assertLessEqual(stats['peak'], 3)
+
+    def test_sync_wrapper(self):
+        """extract_user_data_sync działa z wielu wątków i też koaleskuje"""
+        from concurrent.futures import ThreadPoolExecutor
+        import utils.llm_extractor as ex
+
+        stats = {'calls': 0, 'active': 0, 'peak': 0}
+        with self._patched(stats):
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                results = list(pool.map(ex.extract_user_data_sync, ["K 28 lat, 27 minut"] * 4))
+
+        self.assertEqual(stats['calls'], 1)  # wszystkie wątki trafiają do jednej pętli
+        self.assertTrue(all(r['age'] == 28 for r in results))
+
+    def test_sync_wrapper_timeout_returns_empty_fields(self):
+        """Zawieszony klient: po timeout puste pola zamiast wyjątku"""
+        import asyncio
+        import time
+        from unittest.mock import Mock, patch
+        import utils.llm_extractor as ex
+
+        async def stalled(**kwargs):
+            await asyncio.sleep(30)
+
+        client = Mock()
+        client.chat.completions.create = stalled
+        with self._patched({'calls': 0, 'active': 0, 'peak': 0}), \
+                patch.object(ex, '_make_async_client', return_value=client):
+            start = time.perf_counter()
+            result = ex.extract_user_data_sync("zawieszony tekst 123", timeout=0.2)
+
+        self.assertLess(time.perf_counter() - start, 2)
+        self.assertEqual(result, {'gender': None, 'age': None, 'time_5km_seconds': None})
+
+
+class TestBatchExtraction(unittest.TestCase):
+    """Test wsadowej ekstrakcji (import arkusza)"""
+
+    def test_batch_packs_unresolved_rows(self):
+        """REGEX najpierw, LLM tylko dla braków, fallback tylko dla zepsutych obiektów"""
+        import json
+        from unittest.mock import Mock, patch
+        import utils.llm_extractor as ex
+
+        answers = {
+            "Biegaczka, 5k w 27 minut, wiek nieznany": '{"gender": "female", "age": null, "time_5km_seconds": 1620}',
+            "Jan, trzydziestka na karku, piątka w 25 minut": '{"gender": "male", "age": 30, "time_5km_seconds": 1500}',
+            "Ola, 41 wiosen, 5 km poniżej pół godziny": '{"gender": "female", "age": 41, "time_5km_seconds": 1790}',
+        }
+        calls = []
+
+        def create(**kwargs):
+            user = kwargs['messages'][1]['content']
+            calls.append(user)
+            if user.startswith('['):
+                items = json.loads(user)
+                # "zgubiony" ostatni obiekt -> fallback per opis
+                out = [dict(json.loads(answers[it['text']]), id=it['id']) for it in items[:-1]]
+                content = json.dumps(out)
+            else:
+                content = answers[user]
+            return Mock(choices=[Mock(message=Mock(content=content))])
+
+        client = Mock()
+        client.chat.completions.create.side_effect = create
+        texts = [
+            "M 30 lat, 5km 24:30",                               # REGEX
+            "Biegaczka, 5k w 27 minut, wiek nieznany",
+            "Jan, trzydziestka na karku, piątka w 25 minut",
+            "  jan, trzydziestka na karku, piatka w 25 minut",  # duplikat po normalizacji
+            "Ola, 41 wiosen, 5 km poniżej pół godziny",
+        ]
+        with patch.object(ex, '_get_openai_client', return_value=client), \
+                patch.object(ex, '_get_disk_cache', return_value=None):
+            ex._cached_llm_call.cache_clear()
+            results = ex.extract_user_data_batch(texts, chunk_size=10)
+            ex._cached_llm_call.cache_clear()
+
+        self.assertEqual(len(calls), 2)  # jeden batch + jeden fallback
+        batch = json.loads(calls[0])
+        self.assertEqual([it['text'] for it in batch], texts[1:3] + texts[4:])
+        self.assertEqual(calls[1], texts[4])
+
+        self.assertEqual(results[0], {'gender': 'male', 'age': 30, 'time_5km_seconds': 1470})
+        self.assertEqual(results[1], {'gender': 'female', 'age': None, 'time_5km_seconds': 1620})
+        self.assertEqual(results[2], {'gender': 'male', 'age': 30, 'time_5km_seconds': 1500})
+        self.assertEqual(results[3], results[2])
+        self.assertEqual(results[4], {'gender': 'female', 'age': 41, 'time_5km_seconds': 1790})
+
+    def test_batch_without_llm_returns_regex(self):
+        """Bez klucza OpenAI wynik = sam REGEX, w kolejności wejścia"""
+        from unittest.mock import patch
+        import utils.llm_extractor as ex
+
+        texts = ["K 28 lat, 5km 27:00", "nic tu nie ma"]
+        with patch.object(ex, '_get_openai_client', return_value=None):
+            results = ex.extract_user_data_batch(texts)
+        self.assertEqual(results, [ex._preparse_quick(t) for t in texts])
+
+
+class TestPartialPrompts(unittest.TestCase):
+    """Test promptów częściowych (LLM pyta tylko o brakujące pola)"""
+
+    def test_auto_asks_only_for_missing_fields(self):
+        """Znane pola idą jako kontekst, prompt i max_tokens tylko dla braków"""
+        import tempfile
+        from unittest.mock import Mock, patch
+        import utils.llm_extractor as ex
+        from utils.llm_cache import LLMDiskCache
+
+        client = Mock()
+        client.chat.completions.create.return_value.choices = [
+            Mock(message=Mock(content='{"age": 30}'))
+        ]
+        text = "Facet, trzydziestka na karku, 5km 24:30"
+        with tempfile.TemporaryDirectory() as tmp:
+            disk = LLMDiskCache(os.path.join(tmp, 'llm.sqlite3'))
+            with patch.object(ex, '_get_openai_client', return_value=client), \
+                    patch.object(ex, '_get_disk_cache', return_value=disk), \
+                    patch.object(ex, '_async_llm_available', return_value=False):
+                ex._cached_llm_call.cache_clear()
+                result = ex.extract_user_data_auto(text)
+                ex._cached_llm_call(text, "gpt-test")  # pełny prompt: osobny klucz
+                entries = len(disk)
+                ex._cached_llm_call.cache_clear()
+            disk.close()
+
+        self.assertEqual(result, {'gender': 'male', 'age': 30, 'time_5km_seconds': 1470})
+        kwargs = client.chat.completions.create.call_args_list[0].kwargs
+        system, user = kwargs['messages'][0]['content'], kwargs['messages'][1]['content']
+        self.assertIn('"age": int|null', system)
+        self.assertNotIn('time_5km_seconds', system)
+        self.assertIn('gender=male, time_5km_seconds=1470', user)
+        self.assertLess(kwargs['max_tokens'], 150)
+        self.assertEqual(entries, 2)
+
+    def test_full_prompt_unchanged(self):
+        """Bez braków w kontekście = dotychczasowy prompt i klucz cache"""
+        import utils.llm_extractor as ex
+
+        req = ex._llm_request(ex._missing_key(None))
+        self.assertEqual(req.system, ex._SYSTEM_PROMPT)
+        self.assertEqual(ex._cache_scope(req, ()), ex._PROMPT_HASH)
+        self.assertEqual(req.max_tokens, 150)
+
+
+class TestDetailedExtraction(unittest.TestCase):
+    """Test wyniku strukturalnego (extract_user_data_detailed)"""
+
+    def test_regex_only_result(self):
+        """Wszystko z REGEX: źródła 'regex', brak warstwy LLM"""
+        from unittest.mock import patch
+        import utils.llm_extractor as ex
+
+        with patch.object(ex, '_get_openai_client', side_effect=AssertionError('LLM niepotrzebny')):
+            result = ex.extract_user_data_detailed("M 30 lat, 5km 24:30")
+        self.assertEqual(result.fields, {'gender': 'male', 'age': 30, 'time_5km_seconds': 1470})
+        self.assertEqual(set(result.sources.values()), {'regex'})
+        self.assertTrue(result.regex_only and result.complete)
+        self.assertFalse(result.llm_used)
+        self.assertEqual(list(result.timings), ['regex'])
+
+    def test_llm_then_cache_sources(self):
+        """Pole z LLM oznaczone 'llm', to samo zapytanie ponownie - 'cache'"""
+        from unittest.mock import Mock, patch
+        import utils.llm_extractor as ex
+
+        client = Mock()
+        client.chat.completions.create.return_value.choices = [
+            Mock(message=Mock(content='{"age": 30}'))
+        ]
+        text = "Facet, trzydziestka na karku, 5km 24:30"
+        with patch.object(ex, '_get_openai_client', return_value=client), \
+                patch.object(ex, '_get_disk_cache', return_value=None), \
+                patch.object(ex, '_async_llm_available', return_value=False):
+            ex._cached_llm_call.cache_clear()
+            first = ex.extract_user_data_detailed(text)
+            second = ex.extract_user_data_detailed(text)
+            ex._cached_llm_call.cache_clear()
+
+        self.assertEqual(first.fields, {'gender': 'male', 'age': 30, 'time_5km_seconds': 1470})
+        self.assertEqual(first.sources, {'gender': 'regex', 'age': 'llm', 'time_5km_seconds': 'regex'})
+        self.assertEqual(second.sources['age'], 'cache')
+        self.assertFalse(first.regex_only)
+        self.assertTrue(first.llm_used)
+        self.assertEqual(client.chat.completions.create.call_count, 1)
+
+    def test_missing_field_has_no_source(self):
+        """Bez LLM brakujące pole ma źródło None"""
+        from unittest.mock import patch
+        import utils.llm_extractor as ex
+
+        with patch.object(ex, '_get_openai_client', return_value=None), \
+                patch.object(ex, '_async_llm_available', return_value=False):
+            result = ex.extract_user_data_detailed("Kobieta, 5km 27:00")
+        self.assertEqual(result.sources['age'], None)
+        self.assertFalse(result.complete)
+        self.assertEqual(result.fields, ex.extract_user_data_auto("Kobieta, 5km 27:00"))
+
+
+SMALL_MODEL_FEATURES = ['Płeć_encoded', 'Wiek', '5 km Czas_seconds', '5 km Tempo',
+                        '10 km Tempo', '15 km Tempo', 'Tempo Stabilność']
+
+
+def _train_small_model(directory, n_estimators=120, seed=7):
+    """Mały XGBRegressor + metadata zapisane jak w model_cache/ (dla testów bez Spaces)"""
+    import pickle
+    import numpy as np
+    import pandas as pd
+    import xgboost as xgb
+
+    rng = np.random.default_rng(seed)
+    n = 3000
+    gender = rng.integers(0, 2, n)
+    age = rng.integers(15, 91, n)
+    t5 = rng.integers(540, 3601, n)
+    pace = t5 / 5
+    X = pd.DataFrame({
+        'Płeć_encoded': gender, 'Wiek': age, '5 km Czas_seconds': t5,
+        '5 km Tempo': pace, '10 km Tempo': pace * 1.05, '15 km Tempo': pace * 1.08,
+        'Tempo Stabilność': rng.normal(0.03, 0.01, n),
+    })[SMALL_MODEL_FEATURES]
+    y = 4.46 * t5 * (1 + 0.003 * np.abs(age - 30)) * np.where(gender == 1, 1.0, 1.03)
+    model = xgb.XGBRegressor(n_estimators=n_estimators, max_depth=5, n_jobs=1).fit(X, y)
+
+    model_path = os.path.join(directory, f'model_{seed}.pkl')
+    with open(model_path, 'wb') as f:
+        pickle.dump(model, f)
+    with open(model_path.replace('.pkl', '_metadata.pkl'), 'wb') as f:
+        pickle.dump({'features': SMALL_MODEL_FEATURES}, f)
+    return model, model_path
+
+
+class TestTreeEngine(unittest.TestCase):
+    """Test skompilowanych drzew XGBoost (utils/tree_engine.py)"""
+
+    @classmethod
+    def setUpClass(cls):
+        import tempfile
+        from unittest.mock import patch
+        from utils.model_predictor import HalfMarathonPredictor
+
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.model, model_path = _train_small_model(cls.tmp.name)
+        with patch.dict(os.environ, {'MODEL_PATH': model_path}):
+            cls.predictor = HalfMarathonPredictor()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_engine_compiled_and_verified(self):
+        """Po załadowaniu modelu XGBoost engine jest aktywny"""
+        self.assertIsNotNone(self.predictor.engine)
+        self.assertEqual(self.predictor.engine.n_trees, 120)
+
+    def test_engine_equals_model_predict(self):
+        """predict i predict_batch przez engine == model.predict (bit w bit)"""
+        import numpy as np
+
+        rng = np.random.default_rng(1)
+        n = 50
+        gender = np.where(rng.integers(0, 2, n) == 1, 'male', 'female')
+        age = rng.integers(15, 91, n)
+        t5 = rng.integers(540, 3601, n)
+
+        frame = self.predictor._feature_frame(t5, age, (gender == 'male').astype(np.int64))
+        expected = np.asarray(self.model.predict(frame), dtype=float)
+
+        batch = self.predictor.predict_batch(gender=gender, age=age, time_5km_seconds=t5)
+        np.testing.assert_array_equal(batch['prediction_seconds'], np.rint(expected).astype(np.int64))
+        self.assertTrue((batch['mode'] == 'ml').all())
+
+        for i in range(5):
+            raw = self.predictor._predict_ml(int(t5[i]), int(age[i]), gender[i])
+            self.assertEqual(raw, expected[i])
+
+    def test_engine_missing_values_and_large_batch(self):
+        """NaN idą w default_left; większe macierze też zgodne z boosterem"""
+        import numpy as np
+        from utils.tree_engine import CompiledTreeEnsemble
+
+        engine = CompiledTreeEnsemble.from_xgboost(self.model)
+        rng = np.random.default_rng(2)
+        X = rng.random((1000, 7)).astype(np.float32) * [1, 90, 3600, 720, 760, 780, 0.06]
+        X[::3, 2] = np.nan
+        X[::5, 0] = np.nan
+        np.testing.assert_array_equal(engine.predict(X), self.model.predict(X))
+
+    def test_patched_model_bypasses_engine(self):
+        """Podmieniony self.model (np. mock w testach) nie jest omijany przez engine"""
+        from unittest.mock import patch
+
+        with patch.object(self.predictor, 'model') as mock_model:
+            mock_model.predict.return_value = [6300]
+            result = self.predictor.predict({'gender': 'male', 'age': 30, 'time_5km_seconds': 1470})
+        self.assertEqual(result['prediction_seconds'], 6300)
+        mock_model.predict.assert_called_once()
+
+
+class TestSharedModel(unittest.TestCase):
+    """Test współdzielonych (mmap) tablic drzew między procesami (MODEL_SHARED=1)"""
+
+    def test_second_process_maps_arrays_instead_of_unpickling(self):
+        """Pierwsza instancja zapisuje tablice, druga je mapuje - wyniki identyczne"""
+        import tempfile
+        import numpy as np
+        from unittest.mock import patch
+        from utils.model_predictor import HalfMarathonPredictor
+
+        with tempfile.TemporaryDirectory() as tmp:
+            _, model_path = _train_small_model(tmp, n_estimators=30)
+            env = {'MODEL_PATH': model_path, 'MODEL_SHARED': '1', 'MODEL_SHARED_DIR': tmp}
+            with patch.dict(os.environ, dict(env, MODEL_SHARED='0')):
+                plain = HalfMarathonPredictor()
+            with patch.dict(os.environ, env):
+                first = HalfMarathonPredictor()
+                second = HalfMarathonPredictor()
+
+            self.assertFalse(first.load_status()['shared'])
+            self.assertTrue(second.load_status()['shared'])
+            self.assertNotIn('unpickle', second.load_timings)
+            self.assertIsInstance(second.engine.threshold, np.memmap)
+            self.assertIsInstance(first.engine.children, np.memmap)
+            self.assertEqual(second.feature_order, plain.feature_order)
+
+            rng = np.random.default_rng(5)
+            gender = np.where(rng.integers(0, 2, 200) == 1, 'male', 'female')
+            age = rng.integers(15, 91, 200)
+            t5 = rng.integers(540, 3601, 200)
+            for i in range(10):
+                data = {'gender': gender[i], 'age': int(age[i]), 'time_5km_seconds': int(t5[i])}
+                self.assertEqual(second.predict(data)['prediction_seconds'],
+                                 plain.predict(data)['prediction_seconds'])
+            np.testing.assert_array_equal(
+                second.predict_batch(gender=gender, age=age, time_5km_seconds=t5)['prediction_seconds'],
+                plain.predict_batch(gender=gender, age=age, time_5km_seconds=t5)['prediction_seconds'],
+            )
+
+    def test_stale_arrays_are_ignored(self):
+        """Katalog z innym SHA-256 modelu nie jest używany"""
+        import tempfile
+        from utils.tree_engine import CompiledTreeEnsemble, compile_model
+
+        with tempfile.TemporaryDirectory() as tmp:
+            model, _ = _train_small_model(tmp, n_estimators=5)
+            directory = os.path.join(tmp, 'shared')
+            compile_model(model).save(directory, 'a' * 64)
+            self.assertIsNotNone(CompiledTreeEnsemble.load(directory, 'a' * 64))
+            self.assertIsNone(CompiledTreeEnsemble.load(directory, 'b' * 64))
+            self.assertEqual([f for f in os.listdir(tmp) if f.endswith('.tmp')], [])
+
+
+class TestPredictionTable(unittest.TestCase):
+    """Test trybu tablicy predykcji (PREDICTION_TABLE=1)"""
+
+    @classmethod
+    def setUpClass(cls):
+        import tempfile
+        from unittest.mock import patch
+        from utils.model_predictor import HalfMarathonPredictor
+
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.model, cls.model_path = _train_small_model(cls.tmp.name, n_estimators=40)
+        cls.env = {
+            'MODEL_PATH': cls.model_path,
+            'PREDICTION_TABLE_DIR': cls.tmp.name,
+        }
+        with patch.dict(os.environ, dict(cls.env, PREDICTION_TABLE='0')):
+            cls.plain = HalfMarathonPredictor()
+        with patch.dict(os.environ, dict(cls.env, PREDICTION_TABLE='1')):
+            cls.predictor = HalfMarathonPredictor()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_table_matches_model(self):
+        """predict/predict_batch z tablicy == bez tablicy"""
+        import numpy as np
+
+        self.assertIsNotNone(self.predictor.table)
+        self.assertIsNone(self.plain.table)
+
+        rng = np.random.default_rng(3)
+        n = 300
+        gender = np.where(rng.integers(0, 2, n) == 1, 'male', 'female')
+        age = np.r_[15, 90, rng.integers(15, 91, n - 2)]
+        t5 = np.r_[540, 3600, rng.integers(540, 3601, n - 2)]
+
+        for i in range(20):
+            data = {'gender': gender[i], 'age': int(age[i]), 'time_5km_seconds': int(t5[i])}
+            self.assertEqual(self.predictor.predict(data), self.plain.predict(data))
+
+        a = self.predictor.predict_batch(gender=gender, age=age, time_5km_seconds=t5)
+        b = self.plain.predict_batch(gender=gender, age=age, time_5km_seconds=t5)
+        for key in ('prediction_seconds', 'mode', 'success'):
+            np.testing.assert_array_equal(a[key], b[key])
+
+    def test_table_is_mmapped_and_keyed_by_sha(self):
+        """Drugi proces czyta plik (mmap); inny model = inny plik"""
+        import numpy as np
+        from unittest.mock import patch
+        from utils.model_predictor import HalfMarathonPredictor
+
+        with patch.dict(os.environ, dict(self.env, PREDICTION_TABLE='1')):
+            second = HalfMarathonPredictor()
+        self.assertEqual(second.table_path, self.predictor.table_path)
+        self.assertIsInstance(second.table, np.memmap)
+
+        _, other_path = _train_small_model(self.tmp.name, n_estimators=10, seed=11)
+        with patch.dict(os.environ, dict(self.env, MODEL_PATH=other_path, PREDICTION_TABLE='1')):
+            other = HalfMarathonPredictor()
+        self.assertNotEqual(other.table_path, self.predictor.table_path)
+
+    def test_old_versions_pruned_after_activation(self):
+        """Tablica i współdzielone drzewa innej wersji (starsze niż PRUNE_GRACE_S) usuwane"""
+        import tempfile
+        import time
+        from unittest.mock import patch
+        from utils import prediction_table as pt
+        from utils import tree_engine
+        from utils.model_predictor import HalfMarathonPredictor
+
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {'MODEL_PATH': self.model_path, 'PREDICTION_TABLE': '1', 'PREDICTION_TABLE_DIR': tmp,
+                   'MODEL_SHARED': '1', 'MODEL_SHARED_DIR': tmp}
+            with patch.dict(os.environ, env):
+                first = HalfMarathonPredictor()
+            key = first._shared_key(first.model_sha256, first.feature_order)
+            old = [pt.table_path(key, tmp), tree_engine.shared_dir(key, tmp)]
+            self.assertTrue(all(os.path.exists(p) for p in old))
+
+            _, other_path = _train_small_model(tmp, n_estimators=10, seed=12)
+            with patch.dict(os.environ, dict(env, MODEL_PATH=other_path)):
+                HalfMarathonPredictor()
+                # świeże pliki starej wersji zostają (inny worker mógł je właśnie zapisać)
+                self.assertTrue(all(os.path.exists(p) for p in old))
+                stale = time.time() - 2 * pt.PRUNE_GRACE_S
+                for p in old:
+                    os.utime(p, (stale, stale))
+                current = HalfMarathonPredictor()
+
+            self.assertFalse(any(os.path.exists(p) for p in old))
+            self.assertTrue(os.path.exists(current.table_path))
+            self.assertIsNotNone(current.predict({'gender': 'male', 'age': 30, 'time_5km_seconds': 1500}))
+
+    def test_fallback_cells_marked_negative(self):
+        """Komórki bez sensownej predykcji ML trzymają -fallback"""
+        import numpy as np
+        from utils import prediction_table as pt
+
+        table = pt.build_table(
+            lambda t5, age, g: np.where(age > 80, np.nan, 6000.0),
+            self.predictor._predict_fallback_array,
+        )
+        self.assertEqual(table.shape, pt.TABLE_SHAPE)
+        self.assertEqual(int(pt.lookup(table, 1, 30, 1470)), 6000)
+        expected = self.predictor._predict_fallback(1470, 85, 'female')
+        self.assertEqual(int(pt.lookup(table, 0, 85, 1470)), -expected)
+
+
+class TestBackgroundLoading(unittest.TestCase):
+    """Test ładowania modelu w tle (MODEL_ASYNC_LOAD / background=True)"""
+
+    @classmethod
+    def setUpClass(cls):
+        import tempfile
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.model, cls.model_path = _train_small_model(cls.tmp.name, n_estimators=20)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_starts_in_fallback_then_swaps_to_ml(self):
+        """Konstruktor nie czeka na model; po załadowaniu predykcje idą przez ML"""
+        import threading
+        from unittest.mock import patch
+        import utils.model_predictor as mp
+
+        release = threading.Event()
+        original = mp._try_load_model
+
+        def slow_load(path):
+            release.wait(5)
+            return original(path)
+
+        data = {'gender': 'female', 'age': 41, 'time_5km_seconds': 1650}
+        with patch.dict(os.environ, {'MODEL_PATH': self.model_path}), \
+                patch.object(mp, '_try_load_model', side_effect=slow_load):
+            predictor = mp.HalfMarathonPredictor(background=True)
+            self.assertEqual(predictor.load_status()['state'], 'loading')
+            self.assertEqual(predictor.predict(data)['details']['mode'], 'fallback')
+
+            release.set()
+            self.assertTrue(predictor.wait_until_loaded(10))
+
+        status = predictor.load_status()
+        self.assertEqual(status['state'], 'ready')
+        self.assertEqual(status['mode'], 'ml')
+        for step in ('unpickle', 'verify', 'compile', 'warmup', 'total', 'background_total'):
+            self.assertIn(step, status['timings'])
+        self.assertEqual(predictor.predict(data)['details']['mode'], 'ml')
+
+    def test_warmup_is_not_counted_as_traffic(self):
+        """Rozgrzewka nie zwiększa liczników predykcji ani spanu predict"""
+        from unittest.mock import patch
+        from utils import metrics
+        import utils.model_predictor as mp
+
+        metrics.reset_counters()
+        metrics.reset()
+        with patch.dict(os.environ, {'MODEL_PATH': self.model_path}):
+            predictor = mp.HalfMarathonPredictor(background=True)
+            self.assertTrue(predictor.wait_until_loaded(10))
+
+        self.assertIn('warmup', predictor.load_status()['timings'])
+        self.assertEqual(metrics.counters()['predictions_total'], 0)
+        self.assertNotIn('predict', metrics.snapshot())
+
+    def test_failed_warmup_keeps_fallback(self):
+        """Model, który nie przechodzi rozgrzewki, nie jest podmieniany"""
+        from unittest.mock import Mock, patch
+        import utils.model_predictor as mp
+
+        broken = Mock()
+        broken.predict.side_effect = RuntimeError("zepsuty model")
+        with patch.dict(os.environ, {'MODEL_PATH': self.model_path}), \
+                patch.object(mp, '_try_load_model', return_value=broken):
+            predictor = mp.HalfMarathonPredictor(background=True)
+            self.assertTrue(predictor.wait_until_loaded(10))
+
+        status = predictor.load_status()
+        self.assertEqual(status['state'], 'failed')
+        self.assertEqual(status['mode'], 'fallback')
+        self.assertIsNone(predictor.model)
+
+
+class FakeSpaces:
+    """Minimalny klient S3 w pamięci: head_object/get_object z ETag i warunkami"""
+
+    def __init__(self):
+        self.objects = {}
+        self.modified = {}
+        self.calls = []
+
+    def put(self, key, path_or_bytes):
+        import hashlib
+        data = path_or_bytes
+        if isinstance(path_or_bytes, str):
+            with open(path_or_bytes, 'rb') as f:
+                data = f.read()
+        self.objects[key] = (data, '"%s"' % hashlib.md5(data).hexdigest())
+
+    def _missing(self, op):
+        from botocore.exceptions import ClientError
+        return ClientError({'Error': {'Code': 'NoSuchKey'},
+                            'ResponseMetadata': {'HTTPStatusCode': 404}}, op)
+
+    def head_object(self, Bucket, Key):
+        self.calls.append(('head', Key))
+        if Key not in self.objects:
+            raise self._missing('HeadObject')
+        data, etag = self.objects[Key]
+        return {'ETag': etag, 'ContentLength': len(data), 'LastModified': None}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, IfMatch=None):
+        import io
+        from botocore.exceptions import ClientError
+        self.calls.append(('get', Key))
+        if Key not in self.objects:
+            raise self._missing('GetObject')
+        data, etag = self.objects[Key]
+        if IfMatch is not None and IfMatch != etag:
+            raise ClientError({'Error': {'Code': 'PreconditionFailed'},
+                               'ResponseMetadata': {'HTTPStatusCode': 412}}, 'GetObject')
+        if IfNoneMatch == etag:
+            raise ClientError({'Error': {'Code': '304'},
+                               'ResponseMetadata': {'HTTPStatusCode': 304}}, 'GetObject')
+        self.calls.append(('transfer', Key))
+        return {'Body': io.BytesIO(data), 'ETag': etag, 'ContentLength': len(data)}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Config=None):
+        self.calls.append(('upload', Key))
+        self.put(Key, Filename)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.calls.append(('put', Key))
+        self.put(Key, Body)
+
+    def copy(self, CopySource, Bucket, Key, ExtraArgs=None, Config=None):
+        self.calls.append(('copy', Key))
+        self.objects[Key] = self.objects[CopySource['Key']]
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None):
+        self.calls.append(('list', Prefix))
+        keys = sorted(k for k in self.objects if k.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + MaxKeys]
+        response = {
+            'KeyCount': len(page),
+            'IsTruncated': start + MaxKeys < len(keys),
+        }
+        if page:
+            response['Contents'] = [
+                {'Key': k, 'Size': len(self.objects[k][0]), 'ETag': self.objects[k][1],
+                 'LastModified': self.modified.get(k)}
+                for k in page
+            ]
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + MaxKeys)
+        return response
+
+
+class TestArtifactCache(unittest.TestCase):
+    """Test cache artefaktów adresowanego treścią (utils/artifact_cache.py)"""
+
+    def test_conditional_fetch_and_content_addressing(self):
+        """Drugi fetch = 304 bez transferu; nowa treść = nowy obiekt + wpis w manifeście"""
+        import hashlib
+        import tempfile
+        from utils.artifact_cache import ArtifactCache
+
+        spaces = FakeSpaces()
+        spaces.put('models/m.pkl', b'model-v1')
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ArtifactCache(spaces, 'bucket', root=tmp)
+            first = cache.fetch('models/m.pkl')
+            self.assertEqual(os.path.basename(first), hashlib.sha256(b'model-v1').hexdigest())
+
+            other_worker = ArtifactCache(spaces, 'bucket', root=tmp)
+            self.assertEqual(other_worker.fetch('models/m.pkl'), first)
+            self.assertEqual(spaces.calls.count(('transfer', 'models/m.pkl')), 1)
+
+            spaces.put('models/m.pkl', b'model-v2')
+            second = cache.fetch('models/m.pkl')
+            self.assertNotEqual(second, first)
+            with open(second, 'rb') as f:
+                self.assertEqual(f.read(), b'model-v2')
+            self.assertEqual(cache.entry('models/m.pkl')['etag'], spaces.objects['models/m.pkl'][1])
+            self.assertEqual([f for f in os.listdir(os.path.join(tmp, 'objects')) if f.startswith('.tmp')], [])
+
+    def test_offline_uses_cached_copy_and_prunes_old_objects(self):
+        """Spaces niedostępne: kopia z cache (poza if_match); stare obiekty usuwane"""
+        import tempfile
+        from unittest.mock import patch
+        from botocore.exceptions import EndpointConnectionError
+        import utils.artifact_cache as ac
+
+        spaces = FakeSpaces()
+        spaces.put('models/m.pkl', b'model-v1')
+        with tempfile.TemporaryDirectory() as tmp, patch.object(ac, 'PRUNE_GRACE_S', 0):
+            cache = ac.ArtifactCache(spaces, 'bucket', root=tmp)
+            v1 = cache.fetch('models/m.pkl')
+            spaces.put('models/m.pkl', b'model-v2')
+            v2 = cache.fetch('models/m.pkl')
+            self.assertFalse(os.path.exists(v1))
+            self.assertEqual(os.listdir(os.path.join(tmp, 'objects')), [os.path.basename(v2)])
+
+            def offline(**kwargs):
+                raise EndpointConnectionError(endpoint_url='https://fra1.digitaloceanspaces.com')
+
+            spaces.get_object = offline
+            self.assertEqual(cache.fetch('models/m.pkl'), v2)
+            self.assertIsNone(cache.fetch('models/m.pkl', if_match=spaces.objects['models/m.pkl'][1]))
+            self.assertIsNone(cache.fetch('models/inny.pkl'))
+
+    def test_fetch_many_parallel_and_missing(self):
+        """fetch_many: wyniki per klucz, brakujący obiekt = None"""
+        import tempfile
+        from utils.artifact_cache import ArtifactCache
+
+        spaces = FakeSpaces()
+        spaces.put('a', b'A')
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = ArtifactCache(spaces, 'bucket', root=tmp).fetch_many(['a', 'missing'])
+        self.assertIsNotNone(paths['a'])
+        self.assertIsNone(paths['missing'])
+
+    def test_predictor_loads_via_artifact_cache(self):
+        """Krok 2 (Spaces) w predyktorze: restart z tym samym modelem nic nie pobiera"""
+        import tempfile
+        from unittest.mock import patch
+        import utils.model_predictor as mp
+
+        with tempfile.TemporaryDirectory() as tmp:
+            _, model_path = _train_small_model(tmp, n_estimators=10)
+            spaces = FakeSpaces()
+            spaces.put(mp.SPACES_MODEL_KEY, model_path)
+            spaces.put(mp.SPACES_METADATA_KEY, model_path.replace('.pkl', '_metadata.pkl'))
+            env = {
+                'MODEL_PATH': os.path.join(tmp, 'nie_ma.pkl'),
+                'ARTIFACT_CACHE_DIR': os.path.join(tmp, 'cache'),
+                'DO_SPACES_BUCKET': 'b', 'DO_SPACES_KEY': 'k', 'DO_SPACES_SECRET': 's',
+            }
+            with patch.dict(os.environ, env), patch.object(mp, '_spaces_client', return_value=spaces):
+                first = mp.HalfMarathonPredictor()
+                second = mp.HalfMarathonPredictor()
+
+        self.assertEqual(first.load_status()['mode'], 'ml')
+        self.assertEqual(second.model_sha256, first.model_sha256)
+        self.assertEqual(len([c for c in spaces.calls if c[0] == 'transfer']), 2)
+
+
+class TestModelWatcher(unittest.TestCase):
+    """Test hot reload modelu ze Spaces (utils/model_watcher.py)"""
+
+    @classmethod
+    def setUpClass(cls):
+        import tempfile
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.model_a, cls.path_a = _train_small_model(cls.tmp.name, n_estimators=20, seed=1)
+        cls.model_b, cls.path_b = _train_small_model(cls.tmp.name, n_estimators=30, seed=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def _publish(self, spaces, path, meta=None):
+        import utils.model_watcher as mw
+        spaces.put(mw.SPACES_MODEL_KEY, path)
+        spaces.put(mw.SPACES_METADATA_KEY, meta or path.replace('.pkl', '_metadata.pkl'))
+
+    def _watcher(self, spaces):
+        from unittest.mock import patch
+        import utils.model_watcher as mw
+
+        with patch.dict(os.environ, {'MODEL_PATH': self.path_a}):
+            predictor = mw.HalfMarathonPredictor()
+        watcher = mw.ModelWatcher(predictor, interval=0.01, client=spaces, bucket='test')
+        cache_dir = os.path.join(self.tmp.name, f'cache_{id(watcher)}')
+        return predictor, watcher, patch.dict(os.environ, {'ARTIFACT_CACHE_DIR': cache_dir})
+
+    def test_new_etag_swaps_model(self):
+        """Zmiana ETag -> pobranie do cache, weryfikacja, podmiana; bez zmian -> nic"""
+        from utils.model_predictor import _sha256_file
+
+        spaces = FakeSpaces()
+        self._publish(spaces, self.path_a)
+        predictor, watcher, env = self._watcher(spaces)
+        with env:
+            self.assertFalse(watcher.check_once())  # wersja startowa
+            self.assertFalse(watcher.check_once())
+
+            self._publish(spaces, self.path_b)
+            self.assertTrue(watcher.check_once())
+
+        self.assertEqual(predictor.model_sha256, _sha256_file(self.path_b))
+        self.assertEqual(predictor.engine.n_trees, 30)
+        self.assertEqual(watcher.reloads, 1)
+
+    def test_version_published_before_first_poll_is_loaded(self):
+        """Obiekt zmieniony między startem a pierwszym sprawdzeniem -> ładowany"""
+        from utils.model_predictor import _sha256_file
+
+        spaces = FakeSpaces()
+        self._publish(spaces, self.path_a)
+        predictor, watcher, env = self._watcher(spaces)
+        self._publish(spaces, self.path_b)
+        with env:
+            self.assertTrue(watcher.check_once())
+            self.assertFalse(watcher.check_once())
+
+        self.assertEqual(predictor.model_sha256, _sha256_file(self.path_b))
+        self.assertEqual(watcher.current_etag.split('|')[0], spaces.objects[watcher.model_key][1])
+
+    def test_checksum_mismatch_keeps_running_model(self):
+        """SHA-256 z metadata nie pasuje -> stary model zostaje"""
+        import pickle
+
+        bad_meta = os.path.join(self.tmp.name, 'bad_meta.pkl')
+        with open(bad_meta, 'wb') as f:
+            pickle.dump({'features': SMALL_MODEL_FEATURES, 'model_sha256': '0' * 64}, f)
+
+        spaces = FakeSpaces()
+        self._publish(spaces, self.path_a)
+        predictor, watcher, env = self._watcher(spaces)
+        old_model = predictor.model
+        with env:
+            watcher.check_once()
+            self._publish(spaces, self.path_b, meta=bad_meta)
+            self.assertFalse(watcher.check_once())
+
+        self.assertIs(predictor.model, old_model)
+        self.assertIn('checksum', watcher.last_error)
+
+    def test_inflight_predictions_never_see_half_loaded_model(self):
+        """Predykcje w innych wątkach podczas podmian zawsze kończą się w trybie ML"""
+        import threading
+
+        spaces = FakeSpaces()
+        self._publish(spaces, self.path_a)
+        predictor, watcher, env = self._watcher(spaces)
+        stop = threading.Event()
+        modes = []
+
+        def hammer():
+            while not stop.is_set():
+                r = predictor.predict({'gender': 'male', 'age': 33, 'time_5km_seconds': 1500})
+                modes.append(r['details']['mode'])
+
+        threads = [threading.Thread(target=hammer) for _ in range(3)]
+        for t in threads:
+            t.start()
+        with env:
+            watcher.check_once()
+            for path in [self.path_b, self.path_a, self.path_b]:
+                self._publish(spaces, path)
+                self.assertTrue(watcher.check_once())
+        stop.set()
+        for t in threads:
+            t.join()
+
+        self.assertGreater(len(modes), 0)
+        self.assertEqual(set(modes), {'ml'})
+
+
+class TestHttpApi(unittest.TestCase):
+    """Test API HTTP (api.py) wołanego bezpośrednio przez interfejs ASGI"""
+
+    @classmethod
+    def setUpClass(cls):
+        import tempfile
+        from unittest.mock import patch
+        import api
+        from utils.model_predictor import HalfMarathonPredictor
+
+        cls.tmp = tempfile.TemporaryDirectory()
+        _, model_path = _train_small_model(cls.tmp.name, n_estimators=20)
+        with patch.dict(os.environ, {'MODEL_PATH': model_path}):
+            cls.predictor = HalfMarathonPredictor()
+        cls._saved = api._predictor
+        api._predictor = cls.predictor
+
+    @classmethod
+    def tearDownClass(cls):
+        import api
+        api._predictor = cls._saved
+        cls.tmp.cleanup()
+
+    def _call(self, method, path, body=None, raw=None):
+        import asyncio
+        import json
+        import api
+
+        payload = raw if raw is not None else json.dumps(body or {}).encode('utf-8')
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': payload, 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path}
+        asyncio.run(api.app(scope, receive, send))
+        return sent[0]['status'], json.loads(sent[1]['body'])
+
+    def test_predict_text_matches_app_export(self):
+        """POST /predict z tekstem: format export_payload z app.py"""
+        status, data = self._call('POST', '/predict', {'text': 'Mężczyzna 30 lat, 5km w 24:30'})
+        self.assertEqual(status, 200)
+        self.assertEqual(set(data), {'timestamp', 'input', 'prediction', 'user_input_raw'})
+        self.assertEqual(data['input'], {'gender': 'male', 'age': 30, 'time_5km_seconds': 1470})
+        self.assertEqual(data['prediction'], self.predictor.predict(data['input']))
+
+    def test_predict_structured_and_invalid(self):
+        """Pola wprost; niepoprawne dane = 422 z komunikatem predict()"""
+        status, data = self._call('POST', '/predict', {'gender': 'female', 'age': 41, 'time_5km_seconds': 1700})
+        self.assertEqual(status, 200)
+        self.assertIsNone(data['user_input_raw'])
+        self.assertTrue(data['prediction']['success'])
+
+        # liczby jako napisy - dopuszczalne, o ile się parsują
+        status, _ = self._call('POST', '/predict', {'gender': 'female', 'age': '41', 'time_5km_seconds': '1700'})
+        self.assertEqual(status, 200)
+
+        status, data = self._call('POST', '/predict', {'gender': 'female', 'age': 12, 'time_5km_seconds': 1700})
+        self.assertEqual(status, 422)
+        self.assertFalse(data['prediction']['success'])
+
+        for body in ({'gender': 1, 'age': 30, 'time_5km_seconds': 1500},
+                     {'gender': 'male', 'age': [30], 'time_5km_seconds': 1500},
+                     {'gender': 'male', 'age': 'abc', 'time_5km_seconds': 1500},
+                     {'gender': 'male', 'age': 30, 'time_5km_seconds': '25 min'}):
+            status, data = self._call('POST', '/predict', body)
+            self.assertEqual(status, 400)
+            self.assertFalse(data['success'])
+        status, _ = self._call('POST', '/predict/batch', {'records': [{'gender': 1, 'age': 30}]})
+        self.assertEqual(status, 400)
+
+    def test_batch_matches_single_predictions(self):
+        """POST /predict/batch == POST /predict wiersz po wierszu"""
+        records = [
+            {'text': 'Kobieta 28 lat, 5km 27:00'},
+            {'gender': 'male', 'age': 50, 'time_5km_seconds': 1500},
+            {'gender': 'male', 'age': 200, 'time_5km_seconds': 1500},
+        ]
+        status, data = self._call('POST', '/predict/batch', {'records': records})
+        self.assertEqual(status, 200)
+        self.assertEqual((data['count'], data['succeeded']), (3, 2))
+        for record, result in zip(records, data['results']):
+            _, single = self._call('POST', '/predict', record)
+            self.assertEqual(result['input'], single['input'])
+            self.assertEqual(result['prediction']['success'], single['prediction']['success'])
+            if single['prediction']['success']:
+                self.assertEqual(result['prediction'], single['prediction'])
+
+    def test_extract_and_errors(self):
+        """/extract, złe JSON-y, nieznane ścieżki i metody"""
+        status, data = self._call('POST', '/extract', {'text': 'M 30 lat, 5 km 24:30'})
+        self.assertEqual(status, 200)
+        self.assertTrue(data['complete'])
+
+        self.assertEqual(self._call('POST', '/predict', raw=b'{nie json')[0], 400)
+        self.assertEqual(self._call('POST', '/predict/batch', {'records': 'x'})[0], 400)
+        self.assertEqual(self._call('GET', '/predict')[0], 405)
+        self.assertEqual(self._call('POST', '/nie-ma')[0], 404)
+        status, data = self._call('GET', '/health')
+        self.assertEqual((status, data['model']['mode']), (200, 'ml'))
+
+    def test_metrics_endpoint_is_plain_text(self):
+        """GET /metrics: format tekstowy Prometheus"""
+        import asyncio
+        import api
+
+        self._call('POST', '/predict', {'gender': 'male', 'age': 30, 'time_5km_seconds': 1470})
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(api.app({'type': 'http', 'method': 'GET', 'path': '/metrics'}, receive, send))
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn(b'text/plain', dict(sent[0]['headers'])[b'content-type'])
+        self.assertIn(b'# TYPE halfmarathon_stage_latency_seconds summary', sent[1]['body'])
+
+    def test_concurrent_requests(self):
+        """Równoległe żądania na jednej pętli zdarzeń"""
+        import asyncio
+        import json
+        import api
+
+        async def one(age):
+            sent = []
+
+            async def receive():
+                body = {'gender': 'male', 'age': age, 'time_5km_seconds': 1500}
+                return {'type': 'http.request', 'body': json.dumps(body).encode(), 'more_body': False}
+
+            async def send(message):
+                sent.append(message)
+
+            await api.app({'type': 'http', 'method': 'POST', 'path': '/predict'}, receive, send)
+            return json.loads(sent[1]['body'])['prediction']['prediction_seconds']
+
+        async def main():
+            return await asyncio.gather(*(one(a) for a in range(20, 60)))
+
+        got = asyncio.run(main())
+        expected = [
+            self.predictor.predict({'gender': 'male', 'age': a, 'time_5km_seconds': 1500})['prediction_seconds']
+            for a in range(20, 60)
+        ]
+        self.assertEqual(got, expected)
+
+
+class TestImportTime(unittest.TestCase):
+    """Test leniwych importów (bench_importtime.py, python -X importtime)"""
+
+    def test_entry_points_within_budget(self):
+        """Punkty wejścia bez pandas/boto3/openai/xgboost/langfuse i w budżecie"""
+        import bench_importtime
+
+        for module in bench_importtime.ENTRY_POINTS:
+            with self.subTest(module=module):
+                problems, _ = bench_importtime.check(module)
+                self.assertEqual(problems, [])
+
+    def test_lazy_exports_still_work(self):
+        """from utils import HalfMarathonPredictor nadal działa (PEP 562)"""
+        import subprocess
+
+        code = (
+            "import sys, utils; assert 'pandas' not in sys.modules; "
+            "from utils import HalfMarathonPredictor, extract_user_data, DataLoader; "
+            "print(HalfMarathonPredictor.__name__, callable(extract_user_data), DataLoader.__name__)"
+        )
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(out.returncode, 0, out.stderr)
+        self.assertEqual(out.stdout.split(), ['HalfMarathonPredictor', 'True', 'DataLoader'])
+
+    def test_observe_never_waits_for_langfuse_import(self):
+        """Import langfuse w tle: wywołania w trakcie bez śledzenia, bez czekania"""
+        import threading
+        from unittest.mock import patch
+        from utils import langfuse_shim as shim
+
+        release = threading.Event()
+        traced = []
+
+        def traced_observe(name=None):
+            def decorator(func):
+                def inner(*args, **kwargs):
+                    traced.append(name)
+                    return func(*args, **kwargs)
+                return inner
+            return decorator
+
+        def slow_resolve():
+            release.wait(5)
+            shim._resolved = (traced_observe, shim._DummyCtx(), shim._NoOpLangfuse())
+            return shim._resolved
+
+        env = {'TELEMETRY_SINK': 'langfuse', 'LANGFUSE_PUBLIC_KEY': 'pk', 'LANGFUSE_SECRET_KEY': 'sk'}
+        with patch.dict(os.environ, env), patch.object(shim, '_resolved', None), \
+                patch.object(shim, '_preload_thread', None), patch.object(shim, '_resolve', slow_resolve):
+            double = shim.observe(name='double')(lambda v: v * 2)
+            self.assertEqual(double(2), 4)
+            self.assertEqual(traced, [])
+
+            release.set()
+            shim._preload_thread.join(5)
+            self.assertEqual(double(3), 6)
+            self.assertEqual(traced, ['double'])
+
+    def test_telemetry_off_never_imports_langfuse(self):
+        """TELEMETRY_SINK=off: dekorator i kontekst bez importu langfuse"""
+        import subprocess
+
+        code = (
+            "import sys; from utils.langfuse_shim import observe, langfuse_context, preload; "
+            "preload(); observe(name='x')(lambda: 1)(); "
+            "langfuse_context.update_current_trace(name='t'); "
+            "print('langfuse' in sys.modules)"
+        )
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)),
+                             env={**os.environ, 'TELEMETRY_SINK': 'off'})
+        self.assertEqual(out.returncode, 0, out.stderr)
+        self.assertEqual(out.stdout.strip(), 'False')
+
 
 class TestErrorHandling(unittest.TestCase):
     """Test obsługi błędów"""
@@ -225,6 +1413,626 @@ class TestErrorHandling(unittest.TestCase):
         })
         self.assertFalse(result['success'])
 
+class TestBatchPrediction(unittest.TestCase):
+    """Test wektorowego predict_batch"""
+
+    ROWS = [
+        {'gender': 'male', 'age': 30, 'time_5km_seconds': 1470},
+        {'gender': 'female', 'age': 52, 'time_5km_seconds': 1800},
+        {'gender': 'unknown', 'age': 30, 'time_5km_seconds': 1470},
+        {'gender': 'male', 'age': 'x', 'time_5km_seconds': 1470},
+        {'gender': 'female', 'age': 95, 'time_5km_seconds': 1470},
+        {'gender': 'male', 'age': 40, 'time_5km_seconds': 400},
+    ]
+
+    def setUp(self):
+        from utils.model_predictor import HalfMarathonPredictor
+        self.predictor = HalfMarathonPredictor()
+        self.predictor.model = None
+
+    def assertMatchesSingle(self, batch):
+        for i, row in enumerate(self.ROWS):
+            single = self.predictor.predict(row)
+            self.assertEqual(bool(batch['success'][i]), single['success'], row)
+            if single['success']:
+                self.assertEqual(batch['prediction_seconds'][i], single['prediction_seconds'])
+                self.assertEqual(batch['mode'][i], single['details']['mode'])
+                self.assertEqual(batch['confidence'][i], single['confidence'])
+                self.assertAlmostEqual(
+                    batch['average_pace_min_per_km'][i], single['average_pace_min_per_km'], places=2
+                )
+            else:
+                self.assertEqual(batch['error'][i], single['error'])
+
+    def test_batch_matches_single_fallback(self):
+        """Batch w trybie fallback == predict() wiersz po wierszu"""
+        self.assertMatchesSingle(self.predictor.predict_batch(self.ROWS))
+
+    def test_batch_input_formats(self):
+        """Lista dictów, DataFrame i tablice NumPy dają ten sam wynik"""
+        import numpy as np
+        import pandas as pd
+
+        valid = self.ROWS[:2]
+        from_rows = self.predictor.predict_batch(valid)
+        from_df = self.predictor.predict_batch(pd.DataFrame(valid))
+        from_arrays = self.predictor.predict_batch(
+            gender=np.array(['male', 'female']),
+            age=np.array([30, 52]),
+            time_5km_seconds=np.array([1470, 1800]),
+        )
+        for other in (from_df, from_arrays):
+            np.testing.assert_array_equal(from_rows['prediction_seconds'], other['prediction_seconds'])
+
+    def test_batch_single_model_call_with_row_fallback(self):
+        """Jedno wywołanie model.predict; wiersz z NaN przechodzi na fallback"""
+        import numpy as np
+        from unittest.mock import Mock
+
+        self.predictor.model = Mock()
+        self.predictor.model.predict.return_value = np.array([6300.4, np.nan])
+
+        result = self.predictor.predict_batch(self.ROWS)
+
+        self.assertEqual(self.predictor.model.predict.call_count, 1)
+        self.assertEqual(list(result['mode'][:2]), ['ml', 'fallback'])
+        self.assertEqual(result['prediction_seconds'][0], 6300)
+        self.assertEqual(
+            result['prediction_seconds'][1],
+            self.predictor._predict_fallback(1800, 52, 'female'),
+        )
+
+    def test_fallback_array_bit_identical(self):
+        """Wektorowy fallback == skalarny na całej dziedzinie wejść"""
+        import numpy as np
+
+        ages = np.arange(15, 91)
+        times = np.arange(9 * 60, 60 * 60 + 1)
+        for gender in ('male', 'female'):
+            a, t = (x.ravel() for x in np.meshgrid(ages, times, indexing='ij'))
+            vec = self.predictor._predict_fallback_array(t, a, np.full(a.size, gender))
+            scalar = [self.predictor._predict_fallback(int(ti), int(ai), gender) for ti, ai in zip(t, a)]
+            np.testing.assert_array_equal(vec, np.array(scalar))
+
+
+class TestExtractionEngine(unittest.TestCase):
+    """Test wspólnego silnika ekstrakcji (input_parser + _preparse_quick)"""
+
+    def test_rule_and_confidence_per_field(self):
+        from utils.extraction_engine import extract_fields
+
+        result = extract_fields("Kobieta, wiek 30, 5km 24:30")
+
+        self.assertEqual(result['gender'].value, 'female')
+        self.assertEqual(result['gender'].rule, 'gender_word')
+        self.assertEqual((result['age'].value, result['age'].rule), (30, 'age_keyword'))
+        self.assertEqual(result['time_5km_seconds'].value, 1470)
+        self.assertEqual(result['time_5km_seconds'].rule, 'time_5k_context')
+        self.assertGreater(result['time_5km_seconds'].confidence, result['age'].confidence)
+
+    def test_entry_points_share_rules_and_ranges(self):
+        from utils.input_parser import parse_free_text
+        from utils.llm_extractor import _preparse_quick
+
+        # zakres 5 km obowiązuje teraz także w input_parser
+        result, missing = parse_free_text("chłopak 30 lat, 5 km 70:00")
+        self.assertEqual(result, {'gender': 'male', 'age': 30})
+        self.assertIn('time_5km_seconds', missing)
+
+        # goła liczba jako wiek tylko w parse_free_text (niska pewność)
+        text = "M, 34, 5km 24:30"
+        self.assertEqual(parse_free_text(text)[0]['age'], 34)
+        self.assertIsNone(_preparse_quick(text)['age'])
+        self.assertEqual(_preparse_quick(text)['time_5km_seconds'], 1470)
+
+    def test_bare_number_sees_leading_number_of_time(self):
+        """Goła liczba jak dawny re.search: pierwsza liczba, także wewnątrz czasu"""
+        from utils.input_parser import parse_free_text
+
+        self.assertEqual(parse_free_text("M, 24:30")[0]['age'], 24)
+        # pierwsza liczba '5' (z '5 km') poza zakresem - bez wieku, nie '30'
+        self.assertNotIn('age', parse_free_text("5 km 24:30, M")[0])
+
+
+class TestStageMetrics(unittest.TestCase):
+    """Test histogramów latencji etapów (utils/metrics.py)"""
+
+    def setUp(self):
+        from utils import metrics
+        metrics.reset()
+        self._was_enabled = metrics.enabled()
+        metrics.set_enabled(True)
+
+    def tearDown(self):
+        from utils import metrics
+        metrics.set_enabled(self._was_enabled)
+        metrics.reset()
+
+    def test_percentiles_within_hdr_precision(self):
+        """p50/p95/p99 z histogramu w granicach ~3% od dokładnych"""
+        import numpy as np
+        from utils import metrics
+
+        values = np.random.default_rng(1).lognormal(mean=7, sigma=1.5, size=20000).astype(int)
+        h = metrics.Histogram()
+        for v in values:
+            h.record_us(int(v))
+        for q in (50, 95, 99):
+            exact = np.percentile(values, q, method='inverted_cdf')
+            self.assertLess(abs(h.percentile(q) - exact), exact * 0.02 + 1)
+        self.assertEqual(h.count, len(values))
+        self.assertEqual(h.max_us, values.max())
+
+    def test_pipeline_records_stages(self):
+        """Ekstrakcja + predykcja zapisują spany; wyłączone = nic"""
+        import tempfile
+        from unittest.mock import patch
+        from utils import metrics
+        from utils.llm_extractor import extract_user_data_detailed
+        from utils.model_predictor import HalfMarathonPredictor
+
+        with tempfile.TemporaryDirectory() as tmp:
+            _, model_path = _train_small_model(tmp, n_estimators=10)
+            with patch.dict(os.environ, {'MODEL_PATH': model_path}):
+                predictor = HalfMarathonPredictor()
+        metrics.reset()
+
+        for _ in range(5):
+            predictor.predict(extract_user_data_detailed("M 30 lat, 5km 24:30").fields)
+        snap = metrics.snapshot()
+        for stage in ('regex', 'extract', 'features', 'inference', 'format', 'predict'):
+            self.assertEqual(snap[stage]['count'], 5, stage)
+        self.assertLessEqual(snap['predict']['p50_ms'], snap['predict']['max_ms'])
+
+        text = metrics.render_text()
+        self.assertIn('stage="inference",quantile="0.99"', text)
+        self.assertIn('halfmarathon_stage_latency_seconds_count{stage="predict"} 5', text)
+
+        metrics.set_enabled(False)
+        metrics.reset()
+        predictor.predict({'gender': 'male', 'age': 30, 'time_5km_seconds': 1470})
+        self.assertEqual(metrics.snapshot(), {})
+
+
+class TestUsageCounters(unittest.TestCase):
+    """Test liczników użycia procesu (utils/metrics.py)"""
+
+    def setUp(self):
+        from utils import metrics
+        metrics.reset_counters()
+
+    def tearDown(self):
+        from utils import metrics
+        metrics.reset_counters()
+
+    def test_counts_from_many_threads(self):
+        """Shardy per wątek sumują się bez utraty inkrementów"""
+        import threading
+        from utils import metrics
+
+        def work():
+            for _ in range(5000):
+                metrics.inc('predictions_total')
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(metrics.counters()['predictions_total'], 40000)
+
+    def test_short_lived_threads_do_not_grow_shards(self):
+        """Shardy zakończonych wątków doliczane do bazy i usuwane"""
+        import gc
+        import threading
+        from utils import metrics
+
+        for _ in range(500):
+            t = threading.Thread(target=metrics.inc, args=('extractions_total',))
+            t.start()
+            t.join()
+        gc.collect()
+        self.assertLess(len(metrics._shards), 10)
+        self.assertEqual(metrics.counters()['extractions_total'], 500)
+
+    def test_pipeline_increments_counters(self):
+        """Ekstrakcja i predykcja liczą się w bibliotece, nie w UI"""
+        from utils import metrics
+        from utils.llm_extractor import extract_user_data_detailed
+        from utils.model_predictor import HalfMarathonPredictor
+
+        predictor = HalfMarathonPredictor()
+        metrics.reset_counters()
+        for _ in range(3):
+            predictor.predict(extract_user_data_detailed("M 30 lat, 5km 24:30").fields)
+
+        c = metrics.counters()
+        self.assertEqual(c['extractions_total'], 3)
+        self.assertEqual(c['extractions_regex_only'], 3)
+        self.assertEqual(c['predictions_total'], 3)
+        self.assertEqual(c['predictions_ml'] + c['predictions_fallback'], 3)
+        self.assertEqual(metrics.rates(c)['regex_hit_rate'], 1.0)
+
+    def test_flush_and_aggregate(self):
+        """Pliki JSON/Prometheus per worker; aggregate_dir sumuje świeże JSON"""
+        import json
+        import socket
+        import tempfile
+        import time
+        from utils import metrics
+
+        metrics.inc('predictions_total', 4)
+        metrics.inc('predictions_fallback')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = metrics.MetricsFlusher(tmp, fmt='json').flush_once()
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(json.load(f)['counters']['predictions_total'], 4)
+            # ten sam pid w innym kontenerze nie nadpisuje pliku
+            self.assertIn(f'_{os.getpid()}.json', path)
+            self.assertIn(socket.gethostname(), os.path.basename(path))
+
+            # martwy worker: plik sprzed wielu interwałów jest pomijany
+            with open(os.path.join(tmp, 'metrics_dead_1.json'), 'w', encoding='utf-8') as f:
+                json.dump({'timestamp': time.time() - 3600, 'counters': {'predictions_total': 100}}, f)
+
+            # drugi worker
+            with open(os.path.join(tmp, 'metrics_99999.json'), 'w', encoding='utf-8') as f:
+                json.dump({'counters': {'predictions_total': 6, 'predictions_fallback': 1}}, f)
+            total = metrics.aggregate_dir(tmp)
+            self.assertEqual(total['predictions_total'], 10)
+            self.assertAlmostEqual(metrics.rates(total)['fallback_rate'], 0.2)
+
+            prom = metrics.MetricsFlusher(tmp, fmt='prometheus').flush_once()
+            with open(prom, encoding='utf-8') as f:
+                text = f.read()
+            self.assertIn('# TYPE halfmarathon_predictions_total counter', text)
+            self.assertRegex(text, r'halfmarathon_predictions_total\{worker="[^"]+"\} 4')
+
+
+class TestTelemetryExporter(unittest.TestCase):
+    """Test buforowanego eksportu telemetrii (utils/langfuse_shim.py)"""
+
+    def tearDown(self):
+        from utils import langfuse_shim
+        langfuse_shim.reset_exporter()
+
+    def test_full_buffer_drops_without_blocking(self):
+        """Wolny sink nie blokuje submit; nadmiar jest liczony jako dropped"""
+        import threading
+        import time
+        from utils.langfuse_shim import TelemetryExporter
+
+        release = threading.Event()
+        received = []
+
+        class SlowSink:
+            def send(self, events):
+                release.wait(5)
+                received.extend(events)
+
+            def close(self):
+                pass
+
+        exporter = TelemetryExporter(SlowSink(), capacity=10, batch_size=5, interval=0.01)
+        start = time.perf_counter()
+        accepted = sum(exporter.submit('trace', {'name': f't{i}'}) for i in range(100))
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertLess(accepted, 100)
+        self.assertEqual(exporter.dropped, 100 - accepted)
+
+        release.set()
+        exporter.close()
+        self.assertEqual(len(received), accepted)
+        self.assertEqual(exporter.stats()['pending'], 0)
+
+    def test_jsonl_sink_receives_traces_and_observations(self):
+        """TELEMETRY_SINK=jsonl: trace() i update_observation() lądują w pliku"""
+        import json
+        import tempfile
+        from unittest.mock import patch
+        from utils import langfuse_shim
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'telemetry.jsonl')
+            langfuse_shim.reset_exporter()
+            with patch.dict(os.environ, {'TELEMETRY_SINK': 'jsonl', 'TELEMETRY_JSONL_PATH': path}):
+                self.assertTrue(langfuse_shim.trace(name='halfmarathon_prediction_auto', input={'age': 30}))
+                langfuse_shim.update_observation(output={'age': 30})
+                langfuse_shim.reset_exporter()  # close = flush
+
+            with open(path, encoding='utf-8') as f:
+                events = [json.loads(line) for line in f]
+        self.assertEqual([e['kind'] for e in events], ['trace', 'observation'])
+        self.assertEqual(events[0]['payload']['name'], 'halfmarathon_prediction_auto')
+
+    def test_sink_off_is_noop(self):
+        """TELEMETRY_SINK=off: trace() nic nie kolejkuje"""
+        from unittest.mock import patch
+        from utils import langfuse_shim
+
+        langfuse_shim.reset_exporter()
+        with patch.dict(os.environ, {'TELEMETRY_SINK': 'off'}):
+            self.assertFalse(langfuse_shim.trace(name='x'))
+            self.assertIsNone(langfuse_shim.get_exporter())
+
+
+RACE_CSV_HEADER = 'Miejsce;Płeć;Rocznik;5 km Czas;10 km Czas;15 km Czas;20 km Czas;Czas\n'
+
+
+def _race_csv(rows, seed=0):
+    """Syntetyczny CSV wyników (separator ';', jak pliki w Spaces)"""
+    import random
+    rng = random.Random(seed)
+    lines = [RACE_CSV_HEADER]
+    for i in range(rows):
+        t5 = rng.randint(1000, 2400)
+        splits = [t5 * k for k in (1, 2, 3, 4)] + [int(t5 * 4.4)]
+        times = ['%d:%02d:%02d' % (t // 3600, t % 3600 // 60, t % 60) for t in splits]
+        if i % 50 == 0:
+            times[-1] = 'DNF'
+        lines.append(f"{i + 1};{rng.choice('KM')};{rng.randint(1950, 2005)};{';'.join(times)}\n")
+    return ''.join(lines).encode('utf-8')
+
+
+def _fake_loader(spaces):
+    from utils.data_loader import DataLoader
+    loader = DataLoader()
+    loader.s3_client = spaces
+    return loader
+
+
+class TestDataLoader(unittest.TestCase):
+    """Test ładowania danych ze Spaces (utils/data_loader.py)"""
+
+    def test_streaming_chunks_without_full_read(self):
+        """Body czytane porcjami; chunki ze stałym schematem i usecols"""
+        spaces = FakeSpaces()
+        spaces.put('data/wyniki.csv', _race_csv(1000))
+        reads = []
+
+        class StreamingBody:
+            def __init__(self, raw):
+                self.raw = raw
+
+            def read(self, size=-1):
+                reads.append(size)
+                return self.raw.read(size)
+
+            def close(self):
+                self.raw.close()
+
+        get_object = spaces.get_object
+
+        def streaming_get_object(**kwargs):
+            obj = get_object(**kwargs)
+            return {**obj, 'Body': StreamingBody(obj['Body'])}
+
+        spaces.get_object = streaming_get_object
+        loader = _fake_loader(spaces)
+
+        chunks = list(loader.iter_csv('wyniki.csv', usecols=['Płeć', 'Rocznik', '5 km Czas', 'Czas'], chunksize=128))
+        self.assertEqual(sum(len(c) for c in chunks), 1000)
+        self.assertTrue(all(size is not None and size > 0 for size in reads))
+        for chunk in chunks:
+            self.assertEqual(list(chunk.columns), ['Płeć', 'Rocznik', '5 km Czas', 'Czas'])
+            self.assertEqual(str(chunk['Płeć'].dtype), 'category')
+            self.assertEqual(str(chunk['Rocznik'].dtype), 'Int16')
+
+        df = loader.load_csv('wyniki.csv')
+        self.assertEqual(len(df), 1000)
+        self.assertEqual((df['Czas'] == 'DNF').sum(), 20)
+        # domyślnie typy jak dotąd (inferencja pandas)
+        self.assertEqual(df['Płeć'].dtype, object)
+        self.assertEqual(df['Rocznik'].dtype, 'int64')
+
+    def test_stray_values_and_late_read_errors(self):
+        """Nieliczbowy Rocznik -> <NA> (plik nie wypada); błąd w dalszym chunku kończy iter_csv"""
+        lines = _race_csv(300).decode('utf-8').splitlines(True)
+        for i, value in ((1, '1985.0'), (2, 'brak')):
+            cells = lines[i].split(';')
+            cells[2] = value
+            lines[i] = ';'.join(cells)
+        spaces = FakeSpaces()
+        spaces.put('data/wyniki.csv', ''.join(lines).encode('utf-8'))
+        spaces.put('data/zepsuty.csv', ''.join(lines[:250] + ['1;K;1990;x;x;x;x;x;x;x\n'] + lines[250:]).encode('utf-8'))
+        loader = _fake_loader(spaces)
+
+        df = loader.load_many(['data/wyniki.csv'])
+        self.assertEqual(len(df), 300)
+        self.assertEqual(str(df['Rocznik'].dtype), 'Int16')
+        self.assertEqual(df['Rocznik'].iloc[0], 1985)
+        self.assertTrue(df['Rocznik'].isna().iloc[1])
+
+        chunks = list(loader.iter_csv('zepsuty.csv', chunksize=100))
+        self.assertEqual(sum(len(c) for c in chunks), 200)
+
+    def test_convert_times_matches_notebook(self):
+        """Wektorowa konwersja HH:MM:SS = convert_time_to_seconds z notebooka"""
+        import pandas as pd
+        from utils.data_loader import DataLoader
+
+        df = pd.DataFrame({'5 km Czas': ['0:25:30', 'DNS', None], 'Czas': ['1:52:10', '', 'DNF']})
+        out = DataLoader.convert_times(df)
+        self.assertEqual(list(out.columns), ['5 km Czas_seconds', 'Czas_seconds'])
+        self.assertEqual(str(out['Czas_seconds'].dtype), 'Int32')
+        self.assertEqual(out['5 km Czas_seconds'].tolist(), [1530, pd.NA, pd.NA])
+        self.assertEqual(out['Czas_seconds'].tolist(), [6730, pd.NA, pd.NA])
+
+    def test_convert_times_edge_inputs_match_notebook(self):
+        """Formaty odrzucane przez notebook (ułamki sekund, MM:SS) -> <NA>, nie wartość"""
+        import pandas as pd
+        from utils.data_loader import DataLoader
+
+        def convert_time_to_seconds(time_str):
+            # kopia z notebooks/training_pipeline.ipynb
+            if pd.isnull(time_str) or time_str in ['DNS', 'DNF', '']:
+                return None
+            try:
+                parts = str(time_str).split(':')
+                if len(parts) == 3:
+                    return int(parts[0]) * 3600 + int(parts[1]) * 60 + int(parts[2])
+                return None
+            except:
+                return None
+
+        edge = ['1:02:03', '1:02:03.5', '1:2:3', '01:02:03', ' 1:02:03 ', '25:30', '1:02:03:04',
+                '1:0a:03', '1::03', '+1:02:03', 'DNS', 'DNF', '', None, '0:00:00', '10:00:00']
+        out = DataLoader.convert_times(pd.DataFrame({'Czas': edge}))
+        expected = [convert_time_to_seconds(v) for v in edge]
+        self.assertEqual([None if pd.isna(v) else v for v in out['Czas_seconds']], expected)
+
+    def test_dataset_cache_keyed_by_etag(self):
+        """Drugi load bez get_object (Arrow mmap); nowy ETag = nowa konwersja"""
+        import importlib.util
+        import tempfile
+        if importlib.util.find_spec('pyarrow') is None:
+            self.skipTest('pyarrow niezainstalowany')
+
+        spaces = FakeSpaces()
+        spaces.put('data/wyniki.csv', _race_csv(300))
+        loader = _fake_loader(spaces)
+        with tempfile.TemporaryDirectory() as tmp:
+            first = loader.load_dataset('wyniki.csv', cache_dir=tmp)
+            self.assertEqual(str(first['Czas_seconds'].dtype), 'Int32')
+            self.assertEqual(str(first['Płeć'].dtype), 'category')
+
+            spaces.calls.clear()
+            cols = loader.load_dataset('wyniki.csv', columns=['Płeć', 'Czas_seconds'], cache_dir=tmp)
+            self.assertNotIn(('get', 'data/wyniki.csv'), spaces.calls)
+            self.assertEqual(list(cols.columns), ['Płeć', 'Czas_seconds'])
+            self.assertTrue(cols['Czas_seconds'].equals(first['Czas_seconds']))
+
+            spaces.put('data/wyniki.csv', _race_csv(200, seed=1))
+            self.assertEqual(len(loader.load_dataset('wyniki.csv', cache_dir=tmp)), 200)
+            self.assertEqual(len(os.listdir(tmp)), 1)
+
+    def test_load_many_parallel_with_aligned_schema(self):
+        """Pliki pobierane równolegle; kolumny wyrównane, kategorie wspólne"""
+        import io
+        import time
+        import pandas as pd
+
+        spaces = FakeSpaces()
+        for year in (2021, 2022, 2023, 2024):
+            spaces.put(f'data/wroclaw_{year}.csv', _race_csv(100, seed=year))
+        # starszy format: bez międzyczasu 20 km
+        old = pd.read_csv(io.BytesIO(_race_csv(50)), sep=';').drop(columns='20 km Czas')
+        spaces.put('data/wroclaw_2020.csv', old.to_csv(sep=';', index=False).encode('utf-8'))
+        spaces.put('data/README.txt', b'nie csv')
+
+        get_object = spaces.get_object
+
+        def slow_get_object(**kwargs):
+            time.sleep(0.2)
+            return get_object(**kwargs)
+
+        spaces.get_object = slow_get_object
+        loader = _fake_loader(spaces)
+
+        start = time.perf_counter()
+        df = loader.load_many(prefix='data')
+        elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, 0.2 * 5 * 0.6)
+
+        self.assertEqual(len(df), 450)
+        self.assertEqual(df['source'].value_counts()['wroclaw_2020.csv'], 50)
+        self.assertEqual(df.loc[df['source'] == 'wroclaw_2020.csv', '20 km Czas'].isna().sum(), 50)
+        self.assertEqual(str(df['Płeć'].dtype), 'category')
+        self.assertEqual(list(df.columns[:2]), ['Miejsce', 'Płeć'])
+
+        two = loader.load_many(['data/wroclaw_2023.csv', 'data/brak.csv'])
+        self.assertEqual(len(two), 100)
+
+    def test_listing_follows_pages_and_filters(self):
+        """Ponad 1000 kluczy: wszystkie strony; filtry suffix/rozmiar/data"""
+        from datetime import datetime, timezone
+
+        spaces = FakeSpaces()
+        for i in range(2500):
+            key = f'results/race_{i:04d}.csv'
+            spaces.put(key, b'x' * (i % 10))
+            spaces.modified[key] = datetime(2024, 1 + i % 12, 1, tzinfo=timezone.utc)
+        spaces.put('results/index.json', b'{}')
+        loader = _fake_loader(spaces)
+
+        self.assertEqual(len(loader.list_files('results')), 2501)
+        self.assertEqual(sum(1 for c in spaces.calls if c[0] == 'list'), 3)
+
+        csv = loader.list_files('results', suffix='.csv', min_size=5, max_size=6,
+                                modified_after=datetime(2024, 6, 1, tzinfo=timezone.utc))
+        self.assertTrue(csv)
+        self.assertTrue(all(int(k[-8:-4]) % 10 in (5, 6) for k in csv))
+        self.assertTrue(all(spaces.modified[k].month >= 6 for k in csv))
+
+        # leniwie: pierwsza strona wystarcza do pierwszego obiektu
+        spaces.calls.clear()
+        first = next(loader.iter_objects('results', page_size=100))
+        self.assertEqual(first['Key'], 'results/index.json')
+        self.assertEqual(len(spaces.calls), 1)
+
+    def test_publish_copies_latest_and_writes_manifest(self):
+        """Jeden upload na plik, latest przez kopię po stronie serwera, manifest SHA-256"""
+        import json
+        import shutil
+        import tempfile
+        from unittest.mock import patch
+        import utils.model_predictor as mp
+
+        spaces = FakeSpaces()
+        loader = _fake_loader(spaces)
+        with tempfile.TemporaryDirectory() as tmp:
+            _, model_path = _train_small_model(tmp, n_estimators=10)
+            version = '20260101_120000'
+            paths = [os.path.join(tmp, f'halfmarathon_model_{version}.pkl'),
+                     os.path.join(tmp, f'model_metadata_{version}.pkl'),
+                     os.path.join(tmp, 'gender_encoder.pkl')]
+            shutil.copy(model_path, paths[0])
+            shutil.copy(model_path.replace('.pkl', '_metadata.pkl'), paths[1])
+            with open(paths[2], 'wb') as f:
+                f.write(b'encoder')
+
+            manifest = loader.publish(paths, version)
+
+            self.assertEqual(sorted(k for op, k in spaces.calls if op == 'upload'),
+                             sorted(f'models/{os.path.basename(p)}' for p in paths))
+            self.assertEqual(sorted(k for op, k in spaces.calls if op == 'copy'),
+                             ['models/halfmarathon_model_latest.pkl', 'models/manifest_latest.json',
+                              'models/model_metadata_latest.pkl'])
+            self.assertEqual(spaces.calls[-1], ('copy', 'models/manifest_latest.json'))
+            self.assertEqual(manifest['files'][mp.SPACES_MODEL_KEY]['sha256'],
+                             mp._sha256_file(paths[0]))
+            stored = json.loads(spaces.objects[mp.SPACES_MANIFEST_KEY][0])
+            self.assertEqual(stored['files'], manifest['files'])
+
+            env = {
+                'MODEL_PATH': os.path.join(tmp, 'nie_ma.pkl'),
+                'ARTIFACT_CACHE_DIR': os.path.join(tmp, 'cache'),
+                'DO_SPACES_BUCKET': 'b', 'DO_SPACES_KEY': 'k', 'DO_SPACES_SECRET': 's',
+            }
+            good = spaces.objects[mp.SPACES_MANIFEST_KEY][0]
+            stored['files'][mp.SPACES_MODEL_KEY]['sha256'] = '0' * 64
+            bad = json.dumps(stored).encode('utf-8')
+            with patch.dict(os.environ, env), patch.object(mp, '_spaces_client', return_value=spaces):
+                self.assertEqual(mp.HalfMarathonPredictor().load_status()['mode'], 'ml')
+
+                # manifest nie pasuje do modelu -> ponowienia, potem model odrzucony
+                spaces.put(mp.SPACES_MANIFEST_KEY, bad)
+                with patch.object(mp.time, 'sleep') as sleep:
+                    self.assertEqual(mp.HalfMarathonPredictor().load_status()['mode'], 'fallback')
+                self.assertEqual(sleep.call_count, len(mp.MANIFEST_RETRY_DELAYS))
+
+                # publikacja w toku: spójny manifest pojawia się przed ponowieniem
+                finish_publish = lambda _: spaces.put(mp.SPACES_MANIFEST_KEY, good)
+                with patch.object(mp.time, 'sleep', side_effect=finish_publish) as sleep:
+                    self.assertEqual(mp.HalfMarathonPredictor().load_status()['mode'], 'ml')
+                self.assertEqual(sleep.call_count, 1)
+
+    def test_missing_file_returns_none(self):
+        """Brak pliku: None (jak dotąd) albo pusty iterator"""
+        loader = _fake_loader(FakeSpaces())
+        self.assertIsNone(loader.load_csv('brak.csv'))
+        self.assertEqual(list(loader.iter_csv('brak.csv')), [])
+
 
 class TestPerformance(unittest.TestCase):
     """Test wydajności"""
@@ -250,7 +2058,7 @@ class TestPerformance(unittest.TestCase):
         print(f"✅ Prediction time: {duration*1000:.2f}ms")
     
     def test_extraction_speed(self):
-        """Test czy ekstrakcja REGEX jest szybka"""
+        """Test czy ekstrakcja REGEX jest szybka (i szybsza od wersji wieloprzebiegowej)"""
         import time
         from utils.llm_extractor import _preparse_quick
         
@@ -263,6 +2071,107 @@ class TestPerformance(unittest.TestCase):
         self.assertLess(duration, 0.1, "REGEX parsing trwa za długo (>100ms)!")
         print(f"✅ REGEX extraction time: {duration*1000:.2f}ms")
 
+        def bench(func, rounds=2000):
+            best = float('inf')
+            for _ in range(3):
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    for inp in QUICK_CORPUS:
+                        func(inp)
+                best = min(best, time.perf_counter() - start)
+            return best / (rounds * len(QUICK_CORPUS))
+
+        legacy = bench(_legacy_preparse_quick)
+        single_pass = bench(_preparse_quick)
+        print(f"✅ _preparse_quick: {single_pass*1e6:.2f}µs vs legacy {legacy*1e6:.2f}µs "
+              f"({legacy / single_pass:.2f}x)")
+        # jeden skan musi pozostać wyraźnie szybszy od 6x re.search
+        self.assertLess(single_pass, legacy * 0.9,
+                        "Jednoprzebiegowy _preparse_quick wolniejszy od wersji wieloprzebiegowej!")
+
+    def test_single_pass_matches_legacy(self):
+        """Wspólny silnik == 6x re.search (przy ujednoliconym zakresie wieku 15–90)"""
+        import random
+        from utils.llm_extractor import _preparse_quick
+
+        fragments = [
+            "M", "K", "men", "male", "female", "Kobieta", "Mężczyzna", "woman",
+            "5km", "5 km", "5k", "15km", "24:30", "1:05:00", "70:30", "8:59", "60:01",
+            "27 minut", "27min", "27 min.", "120 min", "30 lat", "30lat", "30 r.x",
+            "45yo", "99 lat", "12 lat", "123 lat", "rekord na 5km:", "w24:30", "12:00 lat", ",", ":", "ą",
+        ]
+        rng = random.Random(42)
+        cases = []
+        for _ in range(5000):
+            sep = rng.choice(["", " ", ", "])
+            cases.append(sep.join(rng.choice(fragments) for _ in range(rng.randint(1, 8))))
+
+        for text in cases:
+            expected = _legacy_preparse_quick(text)
+            if expected['age'] is not None and not 15 <= expected['age'] <= 90:
+                expected['age'] = None
+            self.assertEqual(_preparse_quick(text), expected, text)
+
+    def test_engine_speed(self):
+        """Benchmark wspólnego silnika (extract_fields) - jeden hot path dla obu parserów"""
+        import time
+        from utils.extraction_engine import extract_fields
+
+        rounds = 2000
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for inp in QUICK_CORPUS:
+                extract_fields(inp)
+        per_call = (time.perf_counter() - start) / (rounds * len(QUICK_CORPUS))
+
+        self.assertLess(per_call, 0.001, "extract_fields trwa za długo (>1ms)!")
+        print(f"✅ extract_fields: {per_call*1e6:.2f}µs/call")
+
+QUICK_CORPUS = [
+    "M 30 lat, 5km 24:30",
+    "Kobieta 28 lat, 5k w 27 minut",
+    "Mężczyzna 45 lat, rekord na 5km: 22:30",
+    "Jestem 28-letnią kobietą, mój najlepszy czas na 5 kilometrów to 27 minut i 15 sekund",
+    "Male runner, 45 years old, 5km time is 22:30",
+    "Female runner, age 35, 5km: 25:15",
+]
+
+
+def _legacy_preparse_quick(text):
+    """Referencja: wcześniejsza implementacja _preparse_quick (osobny re.search na wzorzec)"""
+    import re
+    import unicodedata
+    from utils.llm_extractor import _accept_5k_range, _time_str_to_seconds
+
+    t = unicodedata.normalize("NFKD", (text or "").lower())
+    t = "".join(ch for ch in t if not unicodedata.combining(ch))
+    out = {"gender": None, "age": None, "time_5km_seconds": None}
+
+    if re.search(r"\b(m|mezczyzna|facet|chlopak|male|man|men)\b", t):
+        out["gender"] = "male"
+    elif re.search(r"\b(k|kobieta|female|woman|dziewczyna)\b", t):
+        out["gender"] = "female"
+
+    m = re.search(r"\b(\d{1,2})\s*(?:lat|rok|lata|r\.|years?|yo)\b", t)
+    if m and 10 < int(m.group(1)) < 100:
+        out["age"] = int(m.group(1))
+
+    m = re.search(r"(?:\b5\s*km\b|\b5k\b)\D{0,20}(\d{1,2}:\d{2}(?::\d{2})?)\b", t)
+    if m:
+        out["time_5km_seconds"] = _accept_5k_range(_time_str_to_seconds(m.group(1)))
+    if not out["time_5km_seconds"]:
+        m = re.search(r"(?:\b5\s*km\b|\b5k\b)\D{0,20}\b(\d{1,3})\s*(?:min(?:ut(?:y|a)?)?\.?)\b", t)
+        if m:
+            out["time_5km_seconds"] = _accept_5k_range(int(m.group(1)) * 60)
+    if not out["time_5km_seconds"]:
+        m = re.search(r"\b(\d{1,2}:\d{2}(?::\d{2})?)\b", t)
+        if m:
+            out["time_5km_seconds"] = _accept_5k_range(_time_str_to_seconds(m.group(1)))
+    if not out["time_5km_seconds"]:
+        m = re.search(r"\b(\d{1,3})\s*(?:min(?:ut(?:y|a)?)?\.?)\b", t)
+        if m:
+            out["time_5km_seconds"] = _accept_5k_range(int(m.group(1)) * 60)
+    return out
 
 def run_integration_tests():
     """Uruchom wszystkie testy integracyjne"""
@@ -273,7 +2182,25 @@ def run_integration_tests():
     suite.addTests(loader.loadTestsFromTestCase(TestFullIntegration))
     suite.addTests(loader.loadTestsFromTestCase(TestModelMetadata))
     suite.addTests(loader.loadTestsFromTestCase(TestCaching))
+    suite.addTests(loader.loadTestsFromTestCase(TestAsyncExtraction))
+    suite.addTests(loader.loadTestsFromTestCase(TestBatchExtraction))
+    suite.addTests(loader.loadTestsFromTestCase(TestPartialPrompts))
+    suite.addTests(loader.loadTestsFromTestCase(TestDetailedExtraction))
+    suite.addTests(loader.loadTestsFromTestCase(TestHttpApi))
+    suite.addTests(loader.loadTestsFromTestCase(TestImportTime))
     suite.addTests(loader.loadTestsFromTestCase(TestErrorHandling))
+    suite.addTests(loader.loadTestsFromTestCase(TestBatchPrediction))
+    suite.addTests(loader.loadTestsFromTestCase(TestTreeEngine))
+    suite.addTests(loader.loadTestsFromTestCase(TestSharedModel))
+    suite.addTests(loader.loadTestsFromTestCase(TestPredictionTable))
+    suite.addTests(loader.loadTestsFromTestCase(TestBackgroundLoading))
+    suite.addTests(loader.loadTestsFromTestCase(TestArtifactCache))
+    suite.addTests(loader.loadTestsFromTestCase(TestModelWatcher))
+    suite.addTests(loader.loadTestsFromTestCase(TestExtractionEngine))
+    suite.addTests(loader.loadTestsFromTestCase(TestStageMetrics))
+    suite.addTests(loader.loadTestsFromTestCase(TestUsageCounters))
+    suite.addTests(loader.loadTestsFromTestCase(TestTelemetryExporter))
+    suite.addTests(loader.loadTestsFromTestCase(TestDataLoader))
     suite.addTests(loader.loadTestsFromTestCase(TestPerformance))
     
     runner = unittest.TextTestRunner(verbosity=2)
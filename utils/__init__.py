@@ -1,9 +1,35 @@
 """
 Utilities package for Half Marathon Predictor
+
+Exports are resolved lazily (PEP 562), so importing a single submodule such as
+``utils.llm_extractor`` does not pull in boto3/pandas/openai via this package.
 """
 
-from .data_loader import DataLoader
-from .llm_extractor import extract_user_data
-from .model_predictor import HalfMarathonPredictor
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .data_loader import DataLoader
+    from .llm_extractor import extract_user_data
+    from .model_predictor import HalfMarathonPredictor
+
+_LAZY_EXPORTS = {
+    'DataLoader': '.data_loader',
+    'extract_user_data': '.llm_extractor',
+    'HalfMarathonPredictor': '.model_predictor',
+}
+
+__all__ = ['DataLoader', 'extract_user_data', 'HalfMarathonPredictor']
+
+
+def __getattr__(name):
+    module = _LAZY_EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value  # kolejne odwołania bez __getattr__
+    return value
+
 
-__all__ = ['DataLoader', 'extract_user_data', 'HalfMarathonPredictor']
\ No newline at end of file
+def __dir__():
+    return sorted(list(globals()) + __all__)
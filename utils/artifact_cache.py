@@ -0,0 +1,198 @@
+# utils/artifact_cache.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Optional
+
+try:
+    import fcntl  # blokada manifestu między procesami (Linux/macOS)
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore
+
+# ── Lokalny cache artefaktów ze Spaces (adresowany treścią) ─────────────────
+# model_cache/
+#   objects/<sha256>     - niezmienne pliki, nazwa = SHA-256 treści
+#   manifest.json        - klucz S3 -> {etag, sha256, size, fetched}
+# Ponowne pobranie to GET z If-None-Match: niezmieniony obiekt = 304 bez
+# transferu. Zapisy (obiekty i manifest) są atomowe (tmp + os.replace), a
+# manifest aktualizowany pod blokadą pliku - wiele workerów na jednym
+# wolumenie nie psuje sobie nawzajem plików. Obiekty, do których nie
+# prowadzi już żaden wpis manifestu (stare wersje po hot reload), są usuwane
+# - z wyjątkiem świeżych (PRUNE_GRACE_S), które inny worker mógł właśnie
+# zapisać, ale jeszcze nie wpisać do manifestu.
+
+DEFAULT_ROOT = "model_cache"
+_CHUNK = 1024 * 1024
+PRUNE_GRACE_S = 600.0
+
+
+def _not_modified(error: Exception) -> bool:
+    response = getattr(error, "response", None) or {}
+    status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    code = str(response.get("Error", {}).get("Code", ""))
+    return status == 304 or code in {"304", "NotModified"}
+
+
+def _deleted(error: Exception) -> bool:
+    response = getattr(error, "response", None) or {}
+    status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    code = str(response.get("Error", {}).get("Code", ""))
+    return status == 404 or code in {"404", "NoSuchKey"}
+
+
+class ArtifactCache:
+    """Pobieranie obiektów S3/Spaces do model_cache/objects z manifestem ETag."""
+
+    def __init__(
+        self,
+        client: Any,
+        bucket: str,
+        root: Optional[str] = None,
+    ):
+        self.client = client  # boto3 client jest thread-safe - jeden na wszystkie wątki
+        self.bucket = bucket
+        self.root = root or os.getenv("ARTIFACT_CACHE_DIR", DEFAULT_ROOT)
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.manifest_path = os.path.join(self.root, "manifest.json")
+        self._lock = threading.Lock()
+
+    # ----------------------------
+    # Manifest
+    # ----------------------------
+
+    @contextmanager
+    def _manifest_lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock, open(self.manifest_path + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_manifest(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except Exception:
+            return {}
+
+    def _update_manifest(self, key: str, entry: Dict[str, Any]) -> None:
+        with self._manifest_lock():
+            manifest = self._read_manifest()
+            manifest[key] = entry
+            tmp = f"{self.manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.manifest_path)
+            self._prune(manifest)
+
+    def _prune(self, manifest: Dict[str, Dict[str, Any]]) -> None:
+        """Usuń obiekty bez wpisu w manifeście (wołane pod blokadą manifestu)."""
+        referenced = {e.get("sha256") for e in manifest.values() if isinstance(e, dict)}
+        now = time.time()
+        try:
+            names = os.listdir(self.objects_dir)
+        except OSError:
+            return
+        for name in names:
+            if name in referenced or name.startswith(".tmp-"):
+                continue
+            path = os.path.join(self.objects_dir, name)
+            try:
+                if now - os.path.getmtime(path) > PRUNE_GRACE_S:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def entry(self, key: str) -> Optional[Dict[str, Any]]:
+        """Wpis manifestu dla klucza (etag, sha256, size, fetched) lub None."""
+        return self._read_manifest().get(key)
+
+    def object_path(self, sha256: str) -> str:
+        return os.path.join(self.objects_dir, sha256)
+
+    # ----------------------------
+    # Pobieranie
+    # ----------------------------
+
+    def fetch(self, key: str, if_match: Optional[str] = None) -> Optional[str]:
+        """
+        Ścieżka lokalnej kopii obiektu (None przy błędzie).
+        Gdy w manifeście jest ETag i plik istnieje - warunkowy GET (304 = bez transferu).
+        if_match: pobierz tylko, jeśli obiekt ma dokładnie ten ETag.
+        """
+        cached = self.entry(key)
+        if cached and not os.path.isfile(self.object_path(cached.get("sha256", ""))):
+            cached = None
+
+        params: Dict[str, Any] = {"Bucket": self.bucket, "Key": key}
+        if cached and cached.get("etag"):
+            params["IfNoneMatch"] = cached["etag"]
+        if if_match:
+            params["IfMatch"] = if_match
+
+        try:
+            resp = self.client.get_object(**params)
+        except Exception as e:
+            if cached and _not_modified(e):
+                return self.object_path(cached["sha256"])
+            if cached and not if_match and not _deleted(e):
+                # Spaces niedostępne: ostatnia pobrana wersja zamiast fallbacku
+                # (przy if_match potrzebna dokładnie wskazana wersja - bez tego)
+                print(f"⚠️ Nie udało się pobrać s3://{self.bucket}/{key} ({e}) - używam kopii z cache")
+                return self.object_path(cached["sha256"])
+            print(f"⚠️ Nie udało się pobrać s3://{self.bucket}/{key}: {e}")
+            return None
+
+        try:
+            sha256, size = self._store(resp["Body"])
+        except Exception as e:
+            print(f"⚠️ Błąd zapisu s3://{self.bucket}/{key} do cache: {e}")
+            return None
+
+        self._update_manifest(
+            key,
+            {"etag": resp.get("ETag"), "sha256": sha256, "size": size, "fetched": time.time()},
+        )
+        print(f"✅ Pobrano s3://{self.bucket}/{key} ({size} B)")
+        return self.object_path(sha256)
+
+    def _store(self, body: Any) -> tuple[str, int]:
+        """Strumień -> plik tymczasowy + SHA-256 w locie -> objects/<sha256> atomowo."""
+        os.makedirs(self.objects_dir, exist_ok=True)
+        tmp = os.path.join(
+            self.objects_dir, f".tmp-{os.getpid()}-{threading.get_ident()}"
+        )
+        h = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in iter(lambda: body.read(_CHUNK), b""):
+                    h.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            sha256 = h.hexdigest()
+            # ten sam SHA = ta sama treść: wyścig dwóch workerów jest nieszkodliwy
+            os.replace(tmp, self.object_path(sha256))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return sha256, size
+
+    def fetch_many(self, keys: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Równoległe fetch() na wspólnym kliencie (np. model + metadata)."""
+        keys = list(keys)
+        if not keys:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(keys), thread_name_prefix="artifact") as pool:
+            return dict(zip(keys, pool.map(self.fetch, keys)))
@@ -1,14 +1,87 @@
+import hashlib
+import json
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
 import boto3
+import numpy as np
 import pandas as pd
-from io import StringIO
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from pandas.api.types import union_categoricals
+
+# Split time columns in the race result CSVs (HH:MM:SS strings, or DNS/DNF)
+TIME_COLUMNS = ['5 km Czas', '10 km Czas', '15 km Czas', '20 km Czas', 'Czas']
+
+# Explicit dtypes for the known columns: no per-chunk type inference, and
+# chunks of one file come out with the same schema. Missing columns are ignored.
+# Used for chunked reads (and load_many); plain load_csv keeps pandas inference
+# unless the caller passes dtype=CSV_DTYPES.
+CSV_DTYPES: Dict[str, str] = {
+    'Płeć': 'category',
+    'Rocznik': 'str',
+    **{col: 'str' for col in TIME_COLUMNS},
+}
+
+# Numeric columns read as text and coerced after parsing: a stray value
+# ('1985.0', 'brak') becomes <NA> instead of failing the whole read
+NUMERIC_COLUMNS: Dict[str, str] = {'Rocznik': 'Int16'}
+
+# Exactly three integer parts, as int() accepts them in the notebook's
+# convert_time_to_seconds ('1:02:03.5', '25:30' -> <NA>)
+_HMS_PATTERN = r'^\s*([+-]?\d+)\s*:\s*([+-]?\d+)\s*:\s*([+-]?\d+)\s*$'
+
+DEFAULT_CHUNKSIZE = 100_000
+
+# Local columnar cache of converted CSVs (one Feather file per source ETag)
+DEFAULT_DATA_CACHE = 'data_cache'
+
+# Parallel downloads in load_many; the client's connection pool matches it
+DEFAULT_MAX_WORKERS = 16
+
+# Multipart settings for publish(): parts uploaded concurrently within a file
+MB = 1024 * 1024
+PUBLISH_TRANSFER = dict(
+    multipart_threshold=8 * MB,
+    multipart_chunksize=16 * MB,
+    max_concurrency=4,
+    use_threads=True,
+)
+
+
+def _coerce_numeric(df: pd.DataFrame, dtype: Optional[Dict[str, str]]) -> pd.DataFrame:
+    """Convert NUMERIC_COLUMNS read as text (dtype from CSV_DTYPES) to nullable ints."""
+    for col, target in NUMERIC_COLUMNS.items():
+        if col not in df.columns or not dtype or dtype.get(col) != CSV_DTYPES[col]:
+            continue
+        values = pd.to_numeric(df[col], errors='coerce')
+        bounds = np.iinfo(target.lower())
+        values = values.where((values % 1 == 0) & values.between(bounds.min, bounds.max))
+        df[col] = values.astype(target)
+    return df
+
+
+def _sha256_file(path: str) -> tuple:
+    """(hex digest, size in bytes) of a local file."""
+    h = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(MB), b''):
+            h.update(chunk)
+            size += len(chunk)
+    return h.hexdigest(), size
+
 
 class DataLoader:
     """
     Utility class for loading data from Digital Ocean Spaces.
     """
     
-    def __init__(self):
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or int(os.getenv('DATA_LOADER_WORKERS', DEFAULT_MAX_WORKERS))
         self.do_spaces_key = os.getenv('DO_SPACES_KEY')
         self.do_spaces_secret = os.getenv('DO_SPACES_SECRET')
         self.do_spaces_region = os.getenv('DO_SPACES_REGION', 'fra1')
@@ -18,37 +91,321 @@ class DataLoader:
         self.s3_client = self._initialize_client()
     
     def _initialize_client(self):
-        """Initialize S3 client for Digital Ocean Spaces"""
+        """Initialize S3 client for Digital Ocean Spaces (shared by load_many threads)"""
         return boto3.client(
             's3',
             region_name=self.do_spaces_region,
             endpoint_url=self.do_spaces_endpoint,
             aws_access_key_id=self.do_spaces_key,
-            aws_secret_access_key=self.do_spaces_secret
+            aws_secret_access_key=self.do_spaces_secret,
+            config=Config(max_pool_connections=self.max_workers),
         )
+
+    @staticmethod
+    def _key(filename: str, folder: str) -> str:
+        return f'{folder}/{filename}' if folder else filename
     
-    def load_csv(self, filename: str, folder: str = 'data') -> pd.DataFrame:
+    def load_csv(
+        self,
+        filename: str,
+        folder: str = 'data',
+        usecols: Optional[List[str]] = None,
+        dtype: Optional[Dict[str, str]] = None,
+        chunksize: Optional[int] = None,
+    ) -> Union[pd.DataFrame, Iterator[pd.DataFrame], None]:
         """
         Load CSV file from Digital Ocean Spaces.
         
+        The S3 body is streamed straight into the parser, so the raw file is
+        never held in memory as bytes/str next to the resulting DataFrame.
+        
         Args:
             filename: Name of the CSV file
             folder: Folder in the bucket (default: 'data')
+            usecols: Only parse these columns (default: all)
+            dtype: Column dtypes (e.g. CSV_DTYPES). With chunksize they are
+                merged over CSV_DTYPES, otherwise pandas infers the rest
+            chunksize: If set, return an iterator of DataFrames with at most
+                this many rows instead of one DataFrame (constant memory)
             
         Returns:
-            pandas DataFrame
+            pandas DataFrame, iterator of DataFrames (chunksize) or None on error
         """
+        body = None
         try:
-            key = f'{folder}/{filename}'
-            obj = self.s3_client.get_object(Bucket=self.do_spaces_bucket, Key=key)
-            csv_content = obj['Body'].read().decode('utf-8')
-            df = pd.read_csv(StringIO(csv_content), sep=';')
+            key = self._key(filename, folder)
+            body = self.s3_client.get_object(Bucket=self.do_spaces_bucket, Key=key)['Body']
+            dtype = {**CSV_DTYPES, **(dtype or {})} if chunksize else dtype
+            reader = pd.read_csv(
+                body,
+                sep=';',
+                encoding='utf-8',
+                dtype=dtype,
+                usecols=usecols,
+                chunksize=chunksize,
+            )
+            if chunksize:
+                return self._iter_chunks(reader, body, filename, dtype)
+            body.close()
+            df = _coerce_numeric(reader, dtype)
             print(f"✅ Loaded {filename}: {len(df)} rows")
             return df
         except Exception as e:
+            if body is not None:
+                body.close()
             print(f"❌ Error loading {filename}: {e}")
             return None
+
+    @staticmethod
+    def _iter_chunks(reader, body, filename: str, dtype: Dict[str, str]) -> Iterator[pd.DataFrame]:
+        """Yield chunks from a TextFileReader and close the S3 stream at the end."""
+        rows = 0
+        try:
+            with reader:
+                for chunk in reader:
+                    rows += len(chunk)
+                    yield _coerce_numeric(chunk, dtype)
+        finally:
+            body.close()
+        print(f"✅ Streamed {filename}: {rows} rows")
+
+    def iter_csv(
+        self,
+        filename: str,
+        folder: str = 'data',
+        usecols: Optional[List[str]] = None,
+        chunksize: int = DEFAULT_CHUNKSIZE,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Iterate over a CSV from Spaces in chunks.
+        
+        Errors never reach the caller: a file that cannot be opened gives an
+        empty iterator, and a read error in a later chunk ends the iteration
+        after the chunks parsed so far (the error is printed).
+        
+        Args:
+            filename: Name of the CSV file
+            folder: Folder in the bucket (default: 'data')
+            usecols: Only parse these columns (default: all)
+            chunksize: Rows per chunk
+            
+        Returns:
+            Iterator of DataFrames
+        """
+        chunks = self.load_csv(filename, folder, usecols=usecols, chunksize=chunksize)
+        if chunks is None:
+            return iter(())
+        return self._guard_chunks(chunks, filename)
+
+    @staticmethod
+    def _guard_chunks(chunks: Iterator[pd.DataFrame], filename: str) -> Iterator[pd.DataFrame]:
+        try:
+            yield from chunks
+        except Exception as e:
+            print(f"❌ Error reading {filename}: {e}")
     
+    @staticmethod
+    def convert_times(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Replace HH:MM:SS split columns with int32 seconds ('<column>_seconds').
+        
+        DNS/DNF/empty and anything that is not three integer parts (fractional
+        seconds, MM:SS) become <NA>. Same result as the notebook's
+        convert_time_to_seconds, but vectorized.
+        
+        Args:
+            df: DataFrame with any of TIME_COLUMNS
+            
+        Returns:
+            DataFrame with TIME_COLUMNS replaced by '<column>_seconds'
+        """
+        for col in TIME_COLUMNS:
+            if col not in df.columns:
+                continue
+            hms = df[col].astype('string').str.extract(_HMS_PATTERN)
+            hms = hms.apply(pd.to_numeric).astype('Int64')
+            seconds = hms[0] * 3600 + hms[1] * 60 + hms[2]
+            df[f'{col}_seconds'] = seconds.astype('Int32')
+            df = df.drop(columns=col)
+        return df
+
+    @staticmethod
+    def _cache_stem(key: str) -> str:
+        return re.sub(r'[^\w.-]+', '_', key)
+
+    def _cache_path(self, cache_dir: str, key: str, etag: str) -> str:
+        version = etag.strip('"')
+        return os.path.join(cache_dir, f'{self._cache_stem(key)}.{version}.feather')
+
+    def load_dataset(
+        self,
+        filename: str,
+        folder: str = 'data',
+        columns: Optional[List[str]] = None,
+        cache_dir: Optional[str] = None,
+    ) -> Optional[pd.DataFrame]:
+        """
+        Load a race result CSV through a local columnar (Arrow/Feather) cache.
+        
+        The first load for a given source ETag parses the CSV in chunks,
+        converts split times to int32 seconds (convert_times) and writes an
+        uncompressed Feather file. Later loads only do a HEAD request and a
+        memory-mapped read of the requested columns. Without pyarrow it falls
+        back to parsing the CSV on every call (same resulting frame).
+        
+        Args:
+            filename: Name of the CSV file
+            folder: Folder in the bucket (default: 'data')
+            columns: Only return these columns (time columns as '<column>_seconds')
+            cache_dir: Cache directory (default: DATA_CACHE_DIR env or 'data_cache')
+            
+        Returns:
+            pandas DataFrame or None on error
+        """
+        key = self._key(filename, folder)
+        try:
+            import pyarrow as pa
+            import pyarrow.feather as feather
+        except ImportError:
+            print("⚠️ pyarrow not installed - loading without columnar cache")
+            try:
+                # not iter_csv: a read error must not return a truncated frame
+                chunks = self.load_csv(filename, folder, chunksize=DEFAULT_CHUNKSIZE)
+                frames = [self.convert_times(chunk) for chunk in chunks or ()]
+            except Exception as e:
+                print(f"❌ Error loading {filename}: {e}")
+                return None
+            if not frames:
+                return None
+            df = pd.concat(frames, ignore_index=True)
+            return df[columns] if columns else df
+
+        try:
+            cache_dir = cache_dir or os.getenv('DATA_CACHE_DIR', DEFAULT_DATA_CACHE)
+            etag = self.s3_client.head_object(Bucket=self.do_spaces_bucket, Key=key)['ETag']
+            path = self._cache_path(cache_dir, key, etag)
+
+            if not os.path.exists(path):
+                tables = [
+                    pa.Table.from_pandas(self.convert_times(chunk), preserve_index=False)
+                    for chunk in self.load_csv(filename, folder, chunksize=DEFAULT_CHUNKSIZE)
+                ]
+                table = pa.concat_tables(tables, promote_options='permissive').unify_dictionaries()
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp = f'{path}.{os.getpid()}.tmp'
+                # uncompressed = readable via memory map without decoding
+                feather.write_feather(table.combine_chunks(), tmp, compression='uncompressed')
+                os.replace(tmp, path)
+                self._drop_stale(cache_dir, key, keep=path)
+                print(f"✅ Cached {filename} as Arrow: {table.num_rows} rows")
+
+            table = feather.read_table(path, columns=columns, memory_map=True)
+            return table.to_pandas()
+        except Exception as e:
+            print(f"❌ Error loading {filename}: {e}")
+            return None
+
+    def _drop_stale(self, cache_dir: str, key: str, keep: str) -> None:
+        """Remove cache files of older versions (ETags) of the same key."""
+        prefix = self._cache_stem(key) + '.'
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            if name.startswith(prefix) and name.endswith('.feather') and path != keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def load_many(
+        self,
+        keys: Optional[Iterable[Union[str, Dict[str, Any]]]] = None,
+        prefix: Optional[str] = None,
+        columns: Optional[List[str]] = None,
+        cached: bool = False,
+        source_column: Optional[str] = 'source',
+        **filters,
+    ) -> Optional[pd.DataFrame]:
+        """
+        Download and parse many CSVs concurrently and concatenate them.
+        
+        Files are fetched on a thread pool sharing one S3 client, so wall
+        time grows with the slowest files rather than their number. Columns
+        are aligned by name (missing ones become NA) and categorical columns
+        keep a common set of categories.
+        
+        Args:
+            keys: Full object keys, e.g. 'data/halfmarathon_wroclaw_2023__final.csv',
+                or object dicts from iter_objects
+            prefix: Alternatively, load every .csv under this folder
+            columns: Only parse these columns (with cached=True: cached names)
+            cached: Go through the columnar cache (load_dataset)
+            source_column: Column with the source file name (None = skip)
+            **filters: iter_objects filters for prefix (size, LastModified)
+            
+        Returns:
+            pandas DataFrame, or None if no file could be loaded
+        """
+        if keys is None:
+            if prefix is None:
+                raise ValueError('load_many needs keys or prefix')
+            filters.setdefault('suffix', '.csv')
+            keys = self.iter_objects(prefix.rstrip('/'), **filters)
+        try:
+            keys = [k['Key'] if isinstance(k, dict) else k for k in keys]
+        except Exception as e:
+            print(f"❌ Error listing files: {e}")
+            return None
+        if not keys:
+            print("⚠️ No files to load")
+            return None
+
+        def load(key: str) -> Optional[pd.DataFrame]:
+            folder, _, filename = key.rpartition('/')
+            if cached:
+                df = self.load_dataset(filename, folder, columns=columns)
+            else:
+                df = self.load_csv(filename, folder, usecols=columns, dtype=CSV_DTYPES)
+            if df is not None and source_column:
+                df[source_column] = filename
+            return df
+
+        workers = min(self.max_workers, len(keys))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='data-loader') as pool:
+            frames = [df for df in pool.map(load, keys) if df is not None]
+
+        if not frames:
+            return None
+        if len(frames) < len(keys):
+            print(f"⚠️ Loaded {len(frames)}/{len(keys)} files")
+        df = self._concat_aligned(frames)
+        if source_column:
+            df[source_column] = df[source_column].astype('category')
+        print(f"✅ Loaded {len(frames)} files: {len(df)} rows")
+        return df
+
+    @staticmethod
+    def _concat_aligned(frames: List[pd.DataFrame]) -> pd.DataFrame:
+        """pd.concat by column name, with union categories for categorical columns."""
+        columns: List[str] = []
+        for frame in frames:
+            columns.extend(c for c in frame.columns if c not in columns)
+
+        for col in columns:
+            present = [f[col] for f in frames if col in f.columns]
+            if not any(isinstance(s.dtype, pd.CategoricalDtype) for s in present):
+                continue
+            categories = union_categoricals(
+                [s.astype('category') for s in present], ignore_order=True
+            ).categories
+            dtype = pd.CategoricalDtype(categories)
+            for frame in frames:
+                if col in frame.columns:
+                    frame[col] = frame[col].astype(dtype)
+                else:
+                    frame[col] = pd.Series(pd.NA, index=frame.index, dtype=dtype)
+
+        return pd.concat(frames, ignore_index=True, join='outer')[columns]
+
     def upload_file(self, local_path: str, spaces_key: str, folder: str = 'models'):
         """
         Upload file to Digital Ocean Spaces.
@@ -70,26 +427,158 @@ class DataLoader:
         except Exception as e:
             print(f"❌ Upload error: {e}")
     
-    def list_files(self, folder: str = 'data') -> list:
+    def iter_objects(
+        self,
+        folder: str = 'data',
+        suffix: Optional[str] = None,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        modified_after: Optional[datetime] = None,
+        modified_before: Optional[datetime] = None,
+        page_size: int = 1000,
+    ) -> Iterator[Dict[str, Any]]:
         """
-        List all files in a specific folder.
+        Lazily iterate over objects in a folder, following continuation tokens.
+        
+        Only one page of results is held in memory at a time. Filters are
+        applied client-side (S3 only filters by prefix).
         
         Args:
-            folder: Folder to list
+            folder: Folder to list ('' = whole bucket)
+            suffix: Only keys ending with this, e.g. '.csv'
+            min_size: Minimum object size in bytes
+            max_size: Maximum object size in bytes
+            modified_after: Only objects with LastModified >= this
+            modified_before: Only objects with LastModified < this
+            page_size: Keys per list_objects_v2 request (max 1000)
             
         Returns:
-            List of file keys
+            Iterator of object dicts (Key, Size, LastModified, ETag)
         """
+        request = {
+            'Bucket': self.do_spaces_bucket,
+            'Prefix': f'{folder}/' if folder else '',
+            'MaxKeys': page_size,
+        }
+        while True:
+            response = self.s3_client.list_objects_v2(**request)
+            for obj in response.get('Contents', []):
+                if suffix is not None and not obj['Key'].endswith(suffix):
+                    continue
+                if min_size is not None and obj['Size'] < min_size:
+                    continue
+                if max_size is not None and obj['Size'] > max_size:
+                    continue
+                modified = obj.get('LastModified')
+                if modified_after is not None and (modified is None or modified < modified_after):
+                    continue
+                if modified_before is not None and (modified is None or modified >= modified_before):
+                    continue
+                yield obj
+            if not response.get('IsTruncated'):
+                return
+            request['ContinuationToken'] = response['NextContinuationToken']
+
+    def publish(
+        self,
+        paths: List[str],
+        version: str,
+        folder: str = 'models',
+        latest_tag: str = 'latest',
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Publish a set of artifacts (model, metadata, encoder) as one version.
+        
+        1. All files are uploaded in parallel (multipart, PUBLISH_TRANSFER).
+        2. Only when every upload succeeded, files whose name contains
+           `version` are server-side copied to the same name with `latest_tag`
+           (e.g. halfmarathon_model_latest.pkl), with no second upload.
+        3. A manifest with SHA-256 and size of every key is written as
+           manifest_<version>.json and copied to manifest_<latest_tag>.json.
+        
+        Args:
+            paths: Local artifact paths
+            version: Version string contained in the versioned file names
+            folder: Folder in the bucket (default: 'models')
+            latest_tag: Replaces `version` in the alias names
+            
+        Returns:
+            The manifest dict, or None if publishing failed
+        """
+        bucket = self.do_spaces_bucket
+        transfer = TransferConfig(**PUBLISH_TRANSFER)
+        workers = min(self.max_workers, max(len(paths), 1))
+
+        def upload(path: str) -> Dict[str, Any]:
+            name = os.path.basename(path)
+            sha256, size = _sha256_file(path)
+            key = self._key(name, folder)
+            self.s3_client.upload_file(
+                path, bucket, key,
+                ExtraArgs={'ACL': 'private', 'Metadata': {'sha256': sha256}},
+                Config=transfer,
+            )
+            print(f"✅ Uploaded {name} to {folder}/")
+            latest = name.replace(version, latest_tag) if version in name else None
+            return {'key': key, 'latest': latest and self._key(latest, folder),
+                    'sha256': sha256, 'size': size}
+
+        def copy(source: str, target: str) -> None:
+            self.s3_client.copy(
+                {'Bucket': bucket, 'Key': source}, bucket, target,
+                ExtraArgs={'ACL': 'private', 'MetadataDirective': 'COPY'},
+                Config=transfer,
+            )
+            print(f"✅ Copied {source} -> {target}")
+
         try:
-            response = self.s3_client.list_objects_v2(
-                Bucket=self.do_spaces_bucket,
-                Prefix=f'{folder}/'
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='publish') as pool:
+                uploaded = list(pool.map(upload, paths))
+                aliases = [u for u in uploaded if u['latest']]
+                list(pool.map(copy, [u['key'] for u in aliases], [u['latest'] for u in aliases]))
+
+            files: Dict[str, Dict[str, Any]] = {}
+            for u in uploaded:
+                entry = {'sha256': u['sha256'], 'size': u['size'], 'source': u['key']}
+                files[u['key']] = entry
+                if u['latest']:
+                    files[u['latest']] = entry
+            manifest = {
+                'version': version,
+                'created': datetime.now().isoformat(),
+                'files': files,
+            }
+
+            # manifest last: readers of manifest_latest see only complete versions
+            manifest_key = self._key(f'manifest_{version}.json', folder)
+            self.s3_client.put_object(
+                Bucket=bucket,
+                Key=manifest_key,
+                Body=json.dumps(manifest, indent=2).encode('utf-8'),
+                ContentType='application/json',
+                ACL='private',
             )
+            copy(manifest_key, self._key(f'manifest_{latest_tag}.json', folder))
+            print(f"✅ Published version {version}: {len(uploaded)} files")
+            return manifest
+        except Exception as e:
+            print(f"❌ Publish error: {e}")
+            return None
+
+    def list_files(self, folder: str = 'data', **filters) -> list:
+        """
+        List all files in a specific folder (all pages, not just the first 1000).
+        
+        Args:
+            folder: Folder to list
+            **filters: suffix, min_size, max_size, modified_after, modified_before
+                (see iter_objects)
             
-            if 'Contents' in response:
-                files = [obj['Key'] for obj in response['Contents']]
-                return files
-            return []
+        Returns:
+            List of file keys
+        """
+        try:
+            return [obj['Key'] for obj in self.iter_objects(folder, **filters)]
         except Exception as e:
             print(f"❌ Error listing files: {e}")
             return []
\ No newline at end of file
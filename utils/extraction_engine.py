@@ -0,0 +1,236 @@
+# utils/extraction_engine.py
+from __future__ import annotations
+
+import re
+import unicodedata
+from typing import NamedTuple, Optional, Dict
+
+# ── Wspólny silnik regexowej ekstrakcji ──────────────────────────────────────
+# Jedno źródło reguł dla llm_extractor._preparse_quick (warstwa 1 przed LLM)
+# i input_parser.parse_free_text. Każde pole dostaje wartość, nazwę reguły,
+# która zadziałała, oraz pewność tej reguły.
+
+FIELDS = ("gender", "age", "time_5km_seconds")
+
+# Zakresy zgodne z walidacją HalfMarathonPredictor.predict
+AGE_RANGE = (15, 90)
+TIME_5K_RANGE = (9 * 60, 60 * 60)
+
+# Minimalna pewność reguł dla _preparse_quick (bez "ostatniej deski ratunku")
+QUICK_MIN_CONFIDENCE = 0.7
+
+
+class FieldMatch(NamedTuple):
+    value: int | str
+    rule: str
+    confidence: float
+
+
+# ----------------------------
+# Normalizacja
+# ----------------------------
+
+class _StripCombining(dict):
+    """Tablica dla str.translate: usuwa znaki łączące (ogonki po NFKD), cache per znak."""
+
+    def __missing__(self, cp: int) -> Optional[int]:
+        value = None if unicodedata.combining(chr(cp)) else cp
+        self[cp] = value
+        return value
+
+
+# 'ł' nie rozkłada się w NFKD - mapujemy ręcznie (chłopak == chlopak)
+_STRIP_COMBINING = _StripCombining({ord("ł"): "l"})
+
+
+def _norm(s: str) -> str:
+    """Lowercase + usunięcie ogonków (mężczyzna == mezczyzna)."""
+    s = (s or "").lower()
+    if s.isascii():  # NFKD nic nie zmienia dla ASCII
+        return s
+    return unicodedata.normalize("NFKD", s).translate(_STRIP_COMBINING)
+
+
+def _time_str_to_seconds(ts: str) -> Optional[int]:
+    """Konwersja 'MM:SS' lub 'H:MM:SS' na sekundy."""
+    try:
+        parts = [int(p) for p in ts.split(":")]
+        if len(parts) == 2:
+            mm, ss = parts
+            return mm * 60 + ss
+        if len(parts) == 3:
+            hh, mm, ss = parts
+            return hh * 3600 + mm * 60 + ss
+    except Exception:
+        return None
+    return None
+
+
+def _accept_5k_range(sec: Optional[int]) -> Optional[int]:
+    """Akceptuj tylko sensowne czasy 5 km (9–60 minut)."""
+    if sec is None:
+        return None
+    return sec if TIME_5K_RANGE[0] <= sec <= TIME_5K_RANGE[1] else None
+
+
+def _accept_age(age: int) -> Optional[int]:
+    return age if AGE_RANGE[0] <= age <= AGE_RANGE[1] else None
+
+
+# ----------------------------
+# Skaner (jeden przebieg po tekście)
+# ----------------------------
+
+_TIME_PAT = r"\d{1,2}:\d{2}(?::\d{2})?"
+_MIN_SUFFIX = r"\s*(?:min(?:ut(?:y|a)?)?\.?)\b"
+
+# Słowa płci są konsumowane; pozostałe tokeny siedzą w lookahead, więc mogą
+# się nakładać (np. '5km 24:30' daje ctx_time, a '70:30 min' także min).
+# Na danej pozycji pasuje co najwyżej jedna alternatywa, dlatego pierwszy
+# token danego rodzaju == wynik osobnego re.search dla tego wzorca.
+_TOKEN_RE = re.compile(
+    r"\b(?=[acdfkmw\d])(?:"  # szybkie odrzucenie pozycji, od których nic się nie zaczyna
+    r"(?P<male_letter>m)\b"
+    r"|(?P<male_word>mezczyzna|facet|chlopak|male|man|men)\b"
+    r"|(?P<female_letter>k)\b"
+    r"|(?P<female_word>kobieta|female|woman|dziewczyna)\b"
+    r"|(?=(?:wiek|age)\s*[:=]?\s*(?P<age_keyword>\d{1,2})\b)"
+    r"|(?=mam\s*[:=]?\s*(?P<age_mam>\d{1,2})\b)"
+    r"|(?=\d)(?="
+    r"(?P<age_suffix>\d{1,2})\s*(?:lat|rok|lata|r\.|years?|yo)\b"
+    r"|(?P<age_short>\d{1,2})\s*l\b"
+    r"|(?:5\s*km\b|5k\b)\D{0,20}"
+    r"(?:(?P<ctx_time>" + _TIME_PAT + r")\b|\b(?P<ctx_min>\d{1,3})" + _MIN_SUFFIX + r")"
+    r"|(?P<time>" + _TIME_PAT + r")\b"
+    r"|(?P<min>\d{1,3})" + _MIN_SUFFIX +
+    r"))"
+)
+
+# Goła liczba nakłada się z czasem i '5 km' ('M, 24:30' -> 24), więc nie
+# mieści się w skanerze - osobny search, tylko gdy reguła może wygrać
+_NUMBER_RE = re.compile(r"\b(\d{1,2})\b")
+
+# Reguły w kolejności priorytetu: (token, nazwa reguły, pewność[, minuty?])
+_GENDER_RULES = {
+    "male_word": ("male", "gender_word", 0.9),
+    "male_letter": ("male", "gender_letter", 0.75),
+    "female_word": ("female", "gender_word", 0.9),
+    "female_letter": ("female", "gender_letter", 0.75),
+}
+
+_AGE_RULES = (
+    ("age_suffix", "age_suffix", 0.95),        # '30 lat', '45 years', '45yo'
+    ("age_keyword", "age_keyword", 0.85),      # 'wiek 30', 'age: 35'
+    ("age_short", "age_short_suffix", 0.6),    # '30l'
+    ("age_mam", "age_mam", 0.5),               # 'mam 30'
+)
+_AGE_BARE_NUMBER = ("age_bare_number", 0.3)    # ostatnia deska ratunku
+
+_TIME_RULES = (
+    ("ctx_time", "time_5k_context", 0.95, False),   # '5km 24:30'
+    ("ctx_min", "minutes_5k_context", 0.9, True),   # '5k w 27 minut'
+    ("time", "time_any", 0.8, False),               # '24:30'
+    ("min", "minutes_any", 0.7, True),              # '27 minut'
+)
+
+_DECISIVE = frozenset(("age_suffix", "ctx_time", "male_word", "male_letter"))
+
+
+def _scan(t: str) -> Dict[str, str]:
+    """Pierwszy token każdego rodzaju (kolejność wstawiania == kolejność w tekście)."""
+    first: Dict[str, str] = {}
+    for m in _TOKEN_RE.finditer(t):
+        kind = m.lastgroup
+        if kind in first:
+            continue
+        first[kind] = m[kind]  # type: ignore[index]
+        # wszystko rozstrzygnięte regułami o najwyższym priorytecie - dalej nie trzeba
+        if (
+            kind in _DECISIVE
+            and "age_suffix" in first
+            and "ctx_time" in first
+            and ("male_word" in first or "male_letter" in first)
+            and _accept_age(int(first["age_suffix"]))
+            and _accept_5k_range(_time_str_to_seconds(first["ctx_time"]))
+        ):
+            break
+    return first
+
+
+def _resolve(text: str, min_confidence: float) -> Dict[str, Optional[tuple]]:
+    """Jak extract_fields, ale krotki (wartość, reguła, pewność) - ścieżka gorąca."""
+    normalized = _norm(text)
+    first = _scan(normalized)
+    out: Dict[str, Optional[tuple]] = {
+        "gender": None,
+        "age": None,
+        "time_5km_seconds": None,
+    }
+
+    # --- GENDER (męskie słowa mają pierwszeństwo, jak dotąd) ---
+    for kind in first:
+        rule = _GENDER_RULES.get(kind)
+        if rule and rule[2] >= min_confidence:
+            if rule[0] == "male":
+                out["gender"] = rule
+                break
+            if out["gender"] is None:
+                out["gender"] = rule
+
+    # --- AGE ---
+    for kind, name, conf in _AGE_RULES:
+        if conf >= min_confidence and kind in first:
+            age = _accept_age(int(first[kind]))
+            if age is not None:
+                out["age"] = (age, name, conf)
+                break
+    else:
+        name, conf = _AGE_BARE_NUMBER
+        if conf >= min_confidence:
+            m = _NUMBER_RE.search(normalized)
+            age = _accept_age(int(m[1])) if m else None
+            if age is not None:
+                out["age"] = (age, name, conf)
+
+    # --- TIME 5 KM ---
+    for kind, name, conf, minutes in _TIME_RULES:
+        if conf >= min_confidence and kind in first:
+            if minutes:
+                sec = _accept_5k_range(int(first[kind]) * 60)
+            else:
+                sec = _accept_5k_range(_time_str_to_seconds(first[kind]))
+            if sec is not None:
+                out["time_5km_seconds"] = (sec, name, conf)
+                break
+
+    return out
+
+
+def extract_fields(
+    text: str, min_confidence: float = 0.0
+) -> Dict[str, Optional[FieldMatch]]:
+    """
+    Ekstrakcja płci, wieku i czasu 5 km jednym skanem tekstu.
+
+    Zwraca {'gender'|'age'|'time_5km_seconds': FieldMatch | None}.
+    Reguły poniżej min_confidence są pomijane. Dla każdego pola wygrywa
+    pierwsza (wg priorytetu) reguła, której wartość mieści się w zakresie:
+      - płeć: dowolne słowo męskie przed żeńskim
+      - wiek: 15–90 lat
+      - czas 5 km: 9–60 minut, kontekst '5 km' przed ogólnym, MM:SS przed minutami
+    """
+    return {
+        field: (FieldMatch._make(match) if match else None)
+        for field, match in _resolve(text, min_confidence).items()
+    }
+
+
+def extract_values(
+    text: str, min_confidence: float = 0.0
+) -> Dict[str, Optional[int | str]]:
+    """Jak extract_fields, ale same wartości (None dla braków)."""
+    return {
+        field: (match[0] if match else None)
+        for field, match in _resolve(text, min_confidence).items()
+    }
+
@@ -1,6 +1,15 @@
 # utils/langfuse_shim.py
 from __future__ import annotations
-from typing import Optional, Any
+
+import atexit
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
 
 # ── No-op implementacje (działa zawsze) ──────────────────────────────────────
 class _NoOpObservation:
@@ -53,39 +62,339 @@ class _DummyCtx:
         pass
 
 
-# Domyślne (działają zawsze)
-langfuse: Any = _NoOpLangfuse()
-langfuse_context: Any = _DummyCtx()
+# ── Leniwe rozwiązywanie prawdziwego API ────────────────────────────────────
+# Import langfuse (pydantic, httpx, ...) kosztuje setki ms, więc nie następuje
+# przy imporcie modułu ani na ścieżce żądania: preload() (hook startowy
+# aplikacji) importuje go w wątku tła. Dopóki import trwa, dekorator,
+# kontekst i klient działają jak no-op (te wywołania nie są śledzone). Bez
+# kluczy LANGFUSE_* albo przy TELEMETRY_SINK=off langfuse nie jest importowany.
 
-def observe(name: Optional[str] = None):
-    """Dekorator zgodny interfejsem – no-op gdy brak pakietu/nowego API."""
+_resolved: Optional[tuple] = None
+_resolve_lock = threading.Lock()
+_preload_thread: Optional[threading.Thread] = None
+
+
+def _noop_observe(name: Optional[str] = None):
     def _decorator(func):
         return func
     return _decorator
 
 
-# ── Próby podmiany na prawdziwe API, jeśli dostępne ─────────────────────────
-try:
-    # Najpierw sprawdźmy, czy mamy nowy moduł dekoratorów (>=2.22.0)
-    try:
-        from langfuse.decorators import observe as _obs, langfuse_context as _ctx  # type: ignore
-        observe = _obs          # type: ignore[assignment]
-        langfuse_context = _ctx # type: ignore[assignment]
-    except Exception:
-        # zostajemy przy no-opach dla dekoratorów/kontekstu
+_NOOPS: tuple = (_noop_observe, _DummyCtx(), _NoOpLangfuse())
+
+
+def _langfuse_wanted() -> bool:
+    """Czy w ogóle jest po co importować langfuse (sink i klucze)."""
+    if os.getenv("TELEMETRY_SINK", "langfuse").lower() in {"off", "0", "none", ""}:
+        return False
+    return bool(os.getenv("LANGFUSE_PUBLIC_KEY") and os.getenv("LANGFUSE_SECRET_KEY"))
+
+
+def _resolve() -> tuple:
+    """(observe, langfuse_context, langfuse) - prawdziwe albo no-op (blokuje na imporcie)."""
+    global _resolved
+    if _resolved is not None:
+        return _resolved
+    with _resolve_lock:
+        if _resolved is not None:
+            return _resolved
+        if not _langfuse_wanted():
+            _resolved = _NOOPS
+            return _resolved
+        obs: Any = _noop_observe
+        ctx: Any = _DummyCtx()
+        client: Any = _NoOpLangfuse()
+        try:
+            # Najpierw sprawdźmy, czy mamy nowy moduł dekoratorów (>=2.22.0)
+            try:
+                from langfuse.decorators import observe as _obs, langfuse_context as _ctx  # type: ignore
+                obs, ctx = _obs, _ctx
+            except Exception:
+                # zostajemy przy no-opach dla dekoratorów/kontekstu
+                pass
+
+            # Teraz spróbuj zainicjalizować klienta i zobaczyć, czy ma .trace()
+            try:
+                from langfuse import Langfuse as _Langfuse  # type: ignore
+                _client = _Langfuse()
+                # Jeżeli klient ma metody trace/span/event/generation – używamy prawdziwego
+                if all(hasattr(_client, m) for m in ("trace", "span", "event")):
+                    client = _client
+                # W niektórych wersjach mogą istnieć inne nazwy/metody – wówczas zachowaj no-op
+            except Exception:
+                pass
+        except Exception:
+            # Całkowity fallback – zostają no-opy zadeklarowane powyżej
+            pass
+        _resolved = (obs, ctx, client)
+        return _resolved
+
+
+def preload() -> None:
+    """Import langfuse w wątku tła (hook startowy aplikacji); wywołania powtórne = no-op."""
+    global _preload_thread
+    if _resolved is not None or _preload_thread is not None:
+        return
+    with _resolve_lock:
+        if _preload_thread is not None:
+            return
+        _preload_thread = threading.Thread(target=_resolve, name="langfuse-import", daemon=True)
+        _preload_thread.start()
+
+
+def _current() -> tuple:
+    """Rozwiązane API albo no-opy, gdy import jeszcze trwa - nigdy nie blokuje."""
+    if _resolved is not None:
+        return _resolved
+    if not _langfuse_wanted():
+        return _resolve()
+    preload()
+    return _NOOPS
+
+
+class _LazyProxy:
+    """Obiekt zastępczy: atrybuty prawdziwego obiektu, gdy langfuse jest już załadowany."""
+
+    def __init__(self, index: int) -> None:
+        self._index = index
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(_current()[self._index], name)
+
+    def __bool__(self) -> bool:
+        return True
+
+
+langfuse: Any = _LazyProxy(2)
+langfuse_context: Any = _LazyProxy(1)
+
+
+def observe(name: Optional[str] = None):
+    """Dekorator zgodny interfejsem – śledzi wywołania, gdy langfuse jest już załadowany."""
+    def _decorator(func):
+        wrapped: Any = None
+
+        def _target():
+            nonlocal wrapped
+            if wrapped is None:
+                resolved = _current()
+                if resolved is _NOOPS and _resolved is None:
+                    return func  # import trwa w tle - to wywołanie bez śledzenia
+                wrapped = resolved[0](name=name)(func)
+            return wrapped
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def _async_call(*args: Any, **kwargs: Any) -> Any:
+                return await _target()(*args, **kwargs)
+            return _async_call
+
+        @functools.wraps(func)
+        def _call(*args: Any, **kwargs: Any) -> Any:
+            return _target()(*args, **kwargs)
+        return _call
+    return _decorator
+
+
+# ── Buforowany eksport telemetrii ───────────────────────────────────────────
+# trace()/update_observation() nie wykonują I/O na ścieżce żądania: zdarzenia
+# trafiają do ograniczonego bufora, a wątek tła wysyła je paczkami do sinka
+# (Langfuse albo lokalny plik JSONL). Pełny bufor = zdarzenie odrzucone i
+# policzone, nigdy blokada predykcji.
+
+class JsonlSink:
+    """Lokalny sink offline: jedno zdarzenie JSON na linię (append)."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def send(self, events: List[Dict[str, Any]]) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lines = "".join(json.dumps(e, ensure_ascii=False, default=str) + "\n" for e in events)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    def close(self) -> None:
         pass
 
-    # Teraz spróbuj zainicjalizować klienta i zobaczyć, czy ma .trace()
+
+class LangfuseSink:
+    """Sink Langfuse: trace'y wysyłane z wątku tła (import langfuse też tam)."""
+
+    def send(self, events: List[Dict[str, Any]]) -> None:
+        client = _resolve()[2]
+        for event in events:
+            # aktualizacje obserwacji są już zastosowane w kontekście wywołania
+            if event.get("kind") == "trace":
+                client.trace(**event["payload"])
+
+    def close(self) -> None:
+        if _resolved is not None and hasattr(_resolved[2], "flush"):
+            try:
+                _resolved[2].flush()
+            except Exception:
+                pass
+
+
+class TelemetryExporter:
+    """Ograniczony bufor zdarzeń + wątek tła wysyłający je paczkami."""
+
+    def __init__(
+        self,
+        sink: Any,
+        capacity: int = 1000,
+        batch_size: int = 50,
+        interval: float = 2.0,
+    ) -> None:
+        self.sink = sink
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self._buffer: Deque[Dict[str, Any]] = deque()
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, kind: str, payload: Dict[str, Any]) -> bool:
+        """Dodaj zdarzenie; False = bufor pełny (zdarzenie odrzucone)."""
+        event = {"ts": time.time(), "kind": kind, "payload": payload}
+        with self._lock:
+            if len(self._buffer) >= self.capacity:
+                self.dropped += 1
+                full = True
+            else:
+                self._buffer.append(event)
+                full = False
+                pending = len(self._buffer)
+        if full:
+            from . import metrics
+            metrics.inc("telemetry_dropped")
+            return False
+        if self._thread is None:
+            self._start()
+        if pending >= self.batch_size:
+            self._wake.set()
+        return True
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="telemetry-export", daemon=True)
+            self._thread.start()
+
+    def _take(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            n = min(self.batch_size, len(self._buffer))
+            return [self._buffer.popleft() for _ in range(n)]
+
+    def flush(self) -> int:
+        """Wyślij wszystko, co jest w buforze (w bieżącym wątku). Zwraca liczbę zdarzeń."""
+        total = 0
+        with self._send_lock:
+            while True:
+                batch = self._take()
+                if not batch:
+                    return total
+                try:
+                    self.sink.send(batch)
+                    self.sent += len(batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    print(f"⚠️ Eksport telemetrii nieudany ({len(batch)} zdarzeń): {e}")
+                total += len(batch)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+        self.sink.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            pending = len(self._buffer)
+        return {"pending": pending, "sent": self.sent, "dropped": self.dropped, "failed": self.failed}
+
+
+_exporter: Optional[TelemetryExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter() -> Optional[TelemetryExporter]:
+    """Exporter procesu wg TELEMETRY_SINK (langfuse | jsonl | off); None = wyłączony."""
+    global _exporter
+    if _exporter is not None:
+        return _exporter
+    kind = os.getenv("TELEMETRY_SINK", "langfuse").lower()
+    if kind in {"off", "0", "none", ""}:
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            if kind == "jsonl":
+                sink: Any = JsonlSink(os.getenv("TELEMETRY_JSONL_PATH", "telemetry.jsonl"))
+            else:
+                sink = LangfuseSink()
+            _exporter = TelemetryExporter(
+                sink,
+                capacity=int(os.getenv("TELEMETRY_BUFFER", "1000")),
+                batch_size=int(os.getenv("TELEMETRY_BATCH", "50")),
+                interval=float(os.getenv("TELEMETRY_FLUSH_INTERVAL", "2")),
+            )
+            atexit.register(_exporter.close)
+    return _exporter
+
+
+def reset_exporter() -> None:
+    """Zamknij exporter (z flush); kolejne get_exporter() czyta env od nowa."""
+    global _exporter
+    with _exporter_lock:
+        exporter, _exporter = _exporter, None
+    if exporter is not None:
+        atexit.unregister(exporter.close)
+        exporter.close()
+
+
+def trace(**kwargs: Any) -> bool:
+    """Zamiennik langfuse.trace(...) - kolejkuje trace, bez I/O w wywołującym wątku."""
     try:
-        from langfuse import Langfuse as _Langfuse  # type: ignore
-        _client = _Langfuse()
-        # Jeżeli klient ma metody trace/span/event/generation – używamy prawdziwego
-        if all(hasattr(_client, m) for m in ("trace", "span", "event")):
-            langfuse = _client  # type: ignore[assignment]
-        # W niektórych wersjach mogą istnieć inne nazwy/metody – wówczas zachowaj no-op
-    except Exception:
-        pass
+        exporter = get_exporter()
+        return exporter.submit("trace", kwargs) if exporter is not None else False
+    except Exception as e:
+        print(f"⚠️ Telemetria: trace pominięty: {e}")
+        return False
 
-except Exception:
-    # Całkowity fallback – zostają no-opy zadeklarowane powyżej
-    pass
+
+def update_observation(**kwargs: Any) -> None:
+    """Zamiennik langfuse_context.update_current_observation(...).
+
+    Aktualizacja kontekstu Langfuse jest operacją w pamięci, ale wymaga
+    zaimportowanego langfuse - robimy ją tylko, gdy dekorator już go załadował
+    (wewnątrz @observe), więc nigdy nie importujemy go na ścieżce żądania.
+    Sink JSONL dostaje kopię zdarzenia.
+    """
+    if _resolved is not None:
+        try:
+            _resolved[1].update_current_observation(**kwargs)
+        except Exception:
+            pass
+    try:
+        exporter = get_exporter()
+        if exporter is not None and not isinstance(exporter.sink, LangfuseSink):
+            exporter.submit("observation", kwargs)
+    except Exception as e:
+        print(f"⚠️ Telemetria: obserwacja pominięta: {e}")
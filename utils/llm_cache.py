@@ -0,0 +1,179 @@
+# utils/llm_cache.py
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+# ── Trwały cache odpowiedzi LLM (SQLite w trybie WAL) ────────────────────────
+# Współdzielony przez wszystkie procesy/workery na tym samym wolumenie
+# i przeżywa restart aplikacji. Błędy dysku nigdy nie psują ekstrakcji -
+# cache po prostu się wyłącza.
+# Odczyt jest zwykle tylko SELECT-em: znacznik `accessed` (dla LRU) jest
+# odświeżany najwyżej raz na TOUCH_INTERVAL_SECONDS, więc trafienia nie
+# kolejkują workerów na blokadzie zapisu SQLite. Eviction (COUNT + DELETE)
+# działa, gdy przybliżony licznik wpisów przekroczy limit, i co EVICT_EVERY
+# zapisów (TTL, zapisy innych workerów).
+
+DEFAULT_PATH = "model_cache/llm_cache.sqlite3"
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 10_000
+TOUCH_INTERVAL_SECONDS = 3600.0
+EVICT_EVERY = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key      TEXT PRIMARY KEY,
+    value    TEXT NOT NULL,
+    created  REAL NOT NULL,
+    accessed REAL NOT NULL
+)
+"""
+
+
+def make_key(text: str, model: str, prompt_hash: str) -> str:
+    """Klucz cache: znormalizowany tekst + model + hash promptu."""
+    raw = "\x1f".join((text, model, prompt_hash))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMDiskCache:
+    """
+    Cache klucz -> odpowiedź LLM w pliku SQLite.
+    - TTL: wpisy starsze niż ttl_seconds są ignorowane i usuwane
+    - eviction: powyżej max_entries usuwane są najdawniej używane wpisy
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ):
+        self.path = path or os.getenv("LLM_CACHE_PATH", DEFAULT_PATH)
+        self.ttl_seconds = float(
+            ttl_seconds if ttl_seconds is not None
+            else os.getenv("LLM_CACHE_TTL", DEFAULT_TTL_SECONDS)
+        )
+        self.max_entries = int(
+            max_entries if max_entries is not None
+            else os.getenv("LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+        )
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disabled = False
+        self._approx_count: Optional[int] = None  # z ostatniego COUNT(*) + własne zapisy
+        self._writes = 0
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        """Leniwe otwarcie bazy (plik powstaje dopiero przy pierwszym użyciu)."""
+        if self._conn is not None or self._disabled:
+            return self._conn
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(_SCHEMA)
+            conn.commit()
+            self._conn = conn
+        except Exception as e:
+            print(f"⚠️ LLM disk cache wyłączony ({self.path}): {e}")
+            self._disabled = True
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return None
+            try:
+                now = time.time()
+                row = conn.execute(
+                    "SELECT value, created, accessed FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                value, created, accessed = row
+                if now - created > self.ttl_seconds:
+                    return None  # usunie go eviction przy zapisie
+                if now - accessed > TOUCH_INTERVAL_SECONDS:
+                    conn.execute(
+                        "UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key)
+                    )
+                    conn.commit()
+                return value
+            except Exception as e:
+                print(f"⚠️ LLM disk cache read error: {e}")
+                return None
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                now = time.time()
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, created, accessed) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                self._writes += 1
+                if self._approx_count is not None:
+                    self._approx_count += 1
+                if (
+                    self._approx_count is None
+                    or self._approx_count > self.max_entries
+                    or self._writes % EVICT_EVERY == 0
+                ):
+                    self._evict(conn, now)
+                conn.commit()
+            except Exception as e:
+                print(f"⚠️ LLM disk cache write error: {e}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """Usuń przeterminowane wpisy i nadmiar ponad max_entries (LRU)."""
+        conn.execute(
+            "DELETE FROM llm_cache WHERE created < ?", (now - self.ttl_seconds,)
+        )
+        (count,) = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY accessed ASC LIMIT ?)",
+                (overflow,),
+            )
+        self._approx_count = min(count, self.max_entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                conn.execute("DELETE FROM llm_cache")
+                conn.commit()
+                self._approx_count = 0
+            except Exception as e:
+                print(f"⚠️ LLM disk cache clear error: {e}")
+
+    def __len__(self) -> int:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return 0
+            (count,) = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+            return int(count)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
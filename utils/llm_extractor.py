@@ -3,68 +3,43 @@ from __future__ import annotations
 import os
 import re
 import json
-import unicodedata
+import asyncio
+import hashlib
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from functools import lru_cache
-from typing import Optional, Dict, Any
-
-# OpenAI SDK (opcjonalnie – używane tylko gdy jest OPENAI_API_KEY)
-try:
-    from openai import OpenAI  # type: ignore
-except Exception:  # brak SDK nie powinien psuć regexowego fallbacku
-    OpenAI = None  # type: ignore
-
-# Langfuse (opcjonalny)
-try:
-    from langfuse.decorators import observe, langfuse_context  # type: ignore
-except Exception:
-    def observe(name: Optional[str] = None):
-        def _decorator(func):
-            return func
-        return _decorator
-
-    class _DummyCtx:
-        @staticmethod
-        def update_current_observation(**kwargs):  # no-op
-            pass
-
-        @staticmethod
-        def update_current_trace(**kwargs):  # no-op
-            pass
-
-    langfuse_context = _DummyCtx()  # type: ignore
+from typing import NamedTuple, Optional, Dict, Any, Iterable, List, Tuple
 
-# ----------------------------
-# Helpers
-# ----------------------------
+from .extraction_engine import (
+    FIELDS,
+    QUICK_MIN_CONFIDENCE,
+    _accept_5k_range,
+    _accept_age,
+    _norm,
+    _time_str_to_seconds,
+    extract_values,
+)
+from .llm_cache import LLMDiskCache, make_key
+from . import metrics
 
-def _norm(s: str) -> str:
-    """Lowercase + usunięcie ogonków (mężczyzna == mezczyzna)."""
-    s = (s or "").lower()
-    s = unicodedata.normalize("NFKD", s)
-    return "".join(ch for ch in s if not unicodedata.combining(ch))
+# Langfuse (opcjonalny, importowany leniwie przy pierwszym wywołaniu LLM)
+from .langfuse_shim import observe, update_observation
 
 
-def _time_str_to_seconds(ts: str) -> Optional[int]:
-    """Konwersja 'MM:SS' lub 'H:MM:SS' na sekundy."""
+def _openai_class(name: str):
+    """
+    Klasa z SDK OpenAI (OpenAI/AsyncOpenAI) importowana dopiero przy
+    pierwszym użyciu - ścieżka REGEX nie płaci za import SDK.
+    None, gdy brak SDK (lub stare SDK bez klienta async).
+    """
     try:
-        parts = [int(p) for p in ts.split(":")]
-        if len(parts) == 2:
-            mm, ss = parts
-            return mm * 60 + ss
-        if len(parts) == 3:
-            hh, mm, ss = parts
-            return hh * 3600 + mm * 60 + ss
-    except Exception:
-        return None
-    return None
-
-
-def _accept_5k_range(sec: Optional[int]) -> Optional[int]:
-    """Akceptuj tylko sensowne czasy 5 km (9–60 minut)."""
-    if sec is None:
+        import openai  # type: ignore
+    except Exception:  # brak SDK nie powinien psuć regexowego fallbacku
         return None
-    return sec if (9 * 60) <= sec <= (60 * 60) else None
-
+    return getattr(openai, name, None)
 
 # ----------------------------
 # Regexowy fallback (szybki i darmowy)
@@ -75,62 +50,20 @@ def _preparse_quick(text: str) -> Dict[str, Optional[int | str]]:
     Szybka ekstrakcja bez LLM.
     Rozpoznaje:
       - płeć (PL/EN: mężczyzna/kobieta, m/k, male/female, man/men/woman)
-      - wiek (np. '32 lata')
+      - wiek (np. '32 lata', 'wiek 30')
       - czas 5km: 'MM:SS', 'H:MM:SS', '27 minut', także w kontekście '5km ...'
-    Odrzuca czasy poza zakresem 9–60 min.
-    """
-    t = _norm(text)
-    out: Dict[str, Optional[int | str]] = {
-        "gender": None,
-        "age": None,
-        "time_5km_seconds": None,
-    }
-
-    # --- GENDER ---
-    # uwzględniamy 'men' (częsty skrót), 'm', 'k', itp.
-    if re.search(r"\b(m|mezczyzna|facet|chlopak|male|man|men)\b", t):
-        out["gender"] = "male"
-    elif re.search(r"\b(k|kobieta|female|woman|dziewczyna)\b", t):
-        out["gender"] = "female"
+    Odrzuca wiek poza 15–90 i czasy poza zakresem 9–60 min.
 
-    # --- AGE ---
-    m = re.search(r"\b(\d{1,2})\s*(?:lat|rok|lata|r\.|years?|yo)\b", t)
-    if m:
-        age = int(m.group(1))
-        if 10 < age < 100:
-            out["age"] = age
-
-    # --- TIME preferencyjnie w kontekście 5 km ---
-    # 5km ... 22:30
-    m = re.search(r"(?:\b5\s*km\b|\b5k\b)\D{0,20}(\d{1,2}:\d{2}(?::\d{2})?)\b", t)
-    if m:
-        out["time_5km_seconds"] = _accept_5k_range(_time_str_to_seconds(m.group(1)))
-
-    # 5km ... 27 minut
-    if not out["time_5km_seconds"]:
-        m = re.search(r"(?:\b5\s*km\b|\b5k\b)\D{0,20}\b(\d{1,3})\s*(?:min(?:ut(?:y|a)?)?\.?)\b", t)
-        if m:
-            out["time_5km_seconds"] = _accept_5k_range(int(m.group(1)) * 60)
-
-    # --- TIME – ogólny fallback (poza kontekstem 5 km) ---
-    if not out["time_5km_seconds"]:
-        m = re.search(r"\b(\d{1,2}:\d{2}(?::\d{2})?)\b", t)
-        if m:
-            out["time_5km_seconds"] = _accept_5k_range(_time_str_to_seconds(m.group(1)))
-
-    if not out["time_5km_seconds"]:
-        m = re.search(r"\b(\d{1,3})\s*(?:min(?:ut(?:y|a)?)?\.?)\b", t)
-        if m:
-            out["time_5km_seconds"] = _accept_5k_range(int(m.group(1)) * 60)
-
-    return out
+    Deleguje do extraction_engine (tylko reguły o wysokiej pewności).
+    """
+    return extract_values(text, QUICK_MIN_CONFIDENCE)
 
 
 # ----------------------------
 # LLM (opcjonalnie; z cache; bezpieczne gdy brak klucza)
 # ----------------------------
 
-_client: Optional["OpenAI"] = None  # type: ignore
+_client: Any = None
 
 
 def _get_openai_client():
@@ -140,7 +73,8 @@ def _get_openai_client():
         return _client
 
     api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key or OpenAI is None:
+    OpenAI = _openai_class("OpenAI") if api_key else None
+    if OpenAI is None:
         return None
 
     try:
@@ -154,51 +88,217 @@ def _get_openai_client():
     return _client
 
 
-# Cache dla LLM
+_SYSTEM_PROMPT = (
+    "Jesteś asystentem do ekstrakcji danych dla predyktora czasu półmaratonu.\n\n"
+    "Wydobądź następujące informacje z tekstu użytkownika:\n"
+    "- gender: \"male\" lub \"female\" (wymagane)\n"
+    "- age: liczba całkowita, wiek w latach (wymagane)\n"
+    "- time_5km_seconds: czas na 5km w SEKUNDACH jako liczba całkowita (wymagane)\n\n"
+    "Zwróć TYLKO poprawny JSON:\n"
+    "{\"gender\": \"male\"|\"female\"|null, \"age\": int|null, \"time_5km_seconds\": int|null}\n\n"
+    "Przykłady:\n"
+    "Input: \"M 30 lat, 5km 24:30\"\n"
+    "Output: {\"gender\": \"male\", \"age\": 30, \"time_5km_seconds\": 1470}\n\n"
+    "Input: \"Kobieta 28 lat, 5k w 27 minut\"\n"
+    "Output: {\"gender\": \"female\", \"age\": 28, \"time_5km_seconds\": 1620}"
+)
+
+# Zmiana promptu unieważnia wpisy w trwałym cache
+_PROMPT_HASH = hashlib.sha256(_SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:16]
+
+# ── Prompty częściowe: pytamy tylko o pola, których REGEX nie znalazł ───────
+# Znane pola idą jako kontekst w treści zapytania. Pełny prompt (wszystkie
+# pola brakujące) zostaje bez zmian, więc jego wpisy w cache są nadal ważne.
+
+_FIELD_SPECS = {
+    "gender": ("\"male\" lub \"female\"", "\"male\"|\"female\"|null"),
+    "age": ("liczba całkowita, wiek w latach", "int|null"),
+    "time_5km_seconds": ("czas na 5km w SEKUNDACH jako liczba całkowita", "int|null"),
+}
+_FULL_MAX_TOKENS = 150
+_PARTIAL_TOKENS_PER_FIELD = 20
+
+# ((pole, wartość), ...) – hashowalne, bo trafia do lru_cache
+Known = Tuple[Tuple[str, Any], ...]
+
+
+class _LLMRequest(NamedTuple):
+    system: str
+    prompt_hash: str
+    max_tokens: int
+
+
+def _missing_key(missing: Optional[Iterable[str]]) -> Tuple[str, ...]:
+    """Brakujące pola w stałej kolejności FIELDS (None = wszystkie)."""
+    if missing is None:
+        return FIELDS
+    wanted = set(missing)
+    return tuple(f for f in FIELDS if f in wanted)
+
+
+def _known_key(known: Optional[Dict[str, Any]]) -> Known:
+    if not known:
+        return ()
+    return tuple((f, known[f]) for f in FIELDS if known.get(f) is not None)
+
+
+@lru_cache(maxsize=None)
+def _llm_request(missing: Tuple[str, ...]) -> _LLMRequest:
+    """Prompt systemowy i max_tokens zależne od zestawu brakujących pól."""
+    if missing == FIELDS:
+        return _LLMRequest(_SYSTEM_PROMPT, _PROMPT_HASH, _FULL_MAX_TOKENS)
+
+    wanted = "".join(f"- {f}: {_FIELD_SPECS[f][0]}\n" for f in missing)
+    shape = ", ".join(f"\"{f}\": {_FIELD_SPECS[f][1]}" for f in missing)
+    system = (
+        "Jesteś asystentem do ekstrakcji danych dla predyktora czasu półmaratonu.\n\n"
+        "Część danych jest już znana (podana pod tekstem). "
+        "Wydobądź z tekstu użytkownika TYLKO:\n"
+        f"{wanted}\n"
+        "Zwróć TYLKO poprawny JSON:\n"
+        f"{{{shape}}}"
+    )
+    prompt_hash = hashlib.sha256(system.encode("utf-8")).hexdigest()[:16]
+    return _LLMRequest(system, prompt_hash, _PARTIAL_TOKENS_PER_FIELD * len(missing) + 10)
+
+
+def _cache_scope(req: _LLMRequest, known: Known) -> str:
+    """Część klucza cache poza tekstem: prompt (== zestaw braków) + kontekst."""
+    if not known:
+        return req.prompt_hash
+    return req.prompt_hash + "|" + json.dumps(known, ensure_ascii=False)
+
+
+_disk_cache: Optional[LLMDiskCache] = None
+
+
+def _get_disk_cache() -> Optional[LLMDiskCache]:
+    """Trwały cache (SQLite) współdzielony między procesami. LLM_DISK_CACHE=0 wyłącza."""
+    global _disk_cache
+    if os.getenv("LLM_DISK_CACHE", "1") == "0":
+        return None
+    if _disk_cache is None:
+        _disk_cache = LLMDiskCache()
+    return _disk_cache
+
+
+def _cache_text(text: str) -> str:
+    """Normalizacja tekstu do klucza cache (wielkość liter, ogonki, białe znaki)."""
+    return " ".join(_norm(text).split())
+
+
+def _llm_messages(text: str, req: _LLMRequest, known: Known = ()):
+    content = text
+    if known:
+        context = ", ".join(f"{f}={v}" for f, v in known)
+        content = f"{text}\n\nZnane dane: {context}"
+    return [
+        {"role": "system", "content": req.system},
+        {"role": "user", "content": content},
+    ]
+
+
+# Skąd przyszła ostatnia odpowiedź LLM w tym wątku: "llm" (zapytanie do API)
+# lub "cache" (L1/L2). Trafienie w lru_cache nie wykonuje funkcji, więc
+# wartość ustawiana przed wywołaniem to "cache", a zapytanie ją nadpisuje.
+_llm_origin = threading.local()
+
+
+# Cache dla LLM: L1 = lru_cache w procesie, L2 = trwały cache na dysku
 @lru_cache(maxsize=100)
-def _cached_llm_call(text: str, model: str) -> str:
+def _cached_llm_call(
+    text: str, model: str, missing: Tuple[str, ...] = FIELDS, known: Known = ()
+) -> str:
     """
     Cached call do LLM. Gdy brak klienta/klucza – zwraca pusty string.
+    missing/known: prompt częściowy (tylko brakujące pola, znane jako kontekst).
     """
     client = _get_openai_client()
     if client is None:
         return ""
 
-    system_prompt = (
-        "Jesteś asystentem do ekstrakcji danych dla predyktora czasu półmaratonu.\n\n"
-        "Wydobądź następujące informacje z tekstu użytkownika:\n"
-        "- gender: \"male\" lub \"female\" (wymagane)\n"
-        "- age: liczba całkowita, wiek w latach (wymagane)\n"
-        "- time_5km_seconds: czas na 5km w SEKUNDACH jako liczba całkowita (wymagane)\n\n"
-        "Zwróć TYLKO poprawny JSON:\n"
-        "{\"gender\": \"male\"|\"female\"|null, \"age\": int|null, \"time_5km_seconds\": int|null}\n\n"
-        "Przykłady:\n"
-        "Input: \"M 30 lat, 5km 24:30\"\n"
-        "Output: {\"gender\": \"male\", \"age\": 30, \"time_5km_seconds\": 1470}\n\n"
-        "Input: \"Kobieta 28 lat, 5k w 27 minut\"\n"
-        "Output: {\"gender\": \"female\", \"age\": 28, \"time_5km_seconds\": 1620}"
-    )
+    req = _llm_request(missing)
+    disk = _get_disk_cache()
+    key = make_key(_cache_text(text), model, _cache_scope(req, known))
+    if disk is not None:
+        with metrics.span("llm_cache"):
+            hit = disk.get(key)
+        if hit:
+            return hit
 
     try:
-        resp = client.chat.completions.create(  # type: ignore
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": text},
-            ],
-            temperature=0.1,
-            max_tokens=150,
-        )
-        return resp.choices[0].message.content or ""
+        with metrics.span("llm_call"):
+            resp = client.chat.completions.create(  # type: ignore
+                model=model,
+                messages=_llm_messages(text, req, known),
+                temperature=0.1,
+                max_tokens=req.max_tokens,
+            )
+        content = resp.choices[0].message.content or ""
     except Exception:
         return ""
 
+    _llm_origin.value = "llm"
+    if content and disk is not None:
+        disk.set(key, content)
+    return content
+
+
+def _validate_llm_fields(data: Dict[str, Any]) -> Dict[str, Optional[int | str]]:
+    """Pola z obiektu JSON od LLM z walidacją zakresów (braki = None)."""
+    out: Dict[str, Optional[int | str]] = {
+        "gender": None,
+        "age": None,
+        "time_5km_seconds": None,
+    }
+
+    # gender
+    g = str(data.get("gender") or "").lower()
+    if g in {"male", "m", "man", "men", "mezczyzna"}:
+        out["gender"] = "male"
+    elif g in {"female", "f", "woman", "kobieta"}:
+        out["gender"] = "female"
+
+    # age
+    try:
+        out["age"] = _accept_age(int(data.get("age")))
+    except Exception:
+        pass
+
+    # time
+    try:
+        t5 = int(data.get("time_5km_seconds"))
+        out["time_5km_seconds"] = _accept_5k_range(t5)
+    except Exception:
+        pass
+
+    return out
+
+
+def _parse_llm_response(response_text: str) -> Dict[str, Optional[int | str]]:
+    """JSON z odpowiedzi LLM -> pola z walidacją zakresów (braki = None)."""
+    # Wyciągnij JSON
+    m = re.search(r"\{.*\}", response_text, re.DOTALL)
+    if not m:
+        return {"gender": None, "age": None, "time_5km_seconds": None}
+
+    return _validate_llm_fields(json.loads(m.group()))
+
 
 @observe(name="llm_data_extraction")
-def extract_user_data(text: str) -> Dict[str, Optional[int | str]]:
+def extract_user_data(
+    text: str,
+    missing: Optional[Iterable[str]] = None,
+    known: Optional[Dict[str, Any]] = None,
+    trace: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Optional[int | str]]:
     """
     Ekstrakcja z użyciem LLM (gdy dostępny). Zawiera walidację zakresów.
     Zwraca puste pola, jeśli LLM niedostępny/błąd – aby fallback mógł działać.
+
+    missing: pytaj tylko o te pola (krótszy prompt i max_tokens), known: pola
+    już znane, przekazywane modelowi jako kontekst. Domyślnie – wszystkie pola.
+    trace: opcjonalny dict, do którego trafia trace["origin"] = "llm"/"cache".
     """
     out: Dict[str, Optional[int | str]] = {
         "gender": None,
@@ -207,78 +307,340 @@ def extract_user_data(text: str) -> Dict[str, Optional[int | str]]:
     }
 
     try:
-        try:
-            langfuse_context.update_current_observation(  # type: ignore
-                input=text, metadata={"task": "data_extraction", "input_length": len(text)}
-            )
-        except Exception:
-            pass
+        update_observation(
+            input=text,
+            metadata={
+                "task": "data_extraction",
+                "input_length": len(text),
+                "missing": list(_missing_key(missing)),
+            },
+        )
 
         model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-        response_text = _cached_llm_call(text, model)
+        _llm_origin.value = "cache"
+        response_text = _cached_llm_call(
+            text, model, _missing_key(missing), _known_key(known)
+        )
         if not response_text:
             # brak LLM – wracamy z pustymi polami
             return out
+        out = _parse_llm_response(response_text)
+        origin = _llm_origin.value
+        if trace is not None:
+            trace["origin"] = origin
+
+        update_observation(
+            output=out,
+            metadata={"model": model, "success": all(out.values()), "cached": origin == "cache"},
+        )
 
-        # Wyciągnij JSON
-        m = re.search(r"\{.*\}", response_text, re.DOTALL)
-        if not m:
-            return out
+    except Exception as e:
+        print(f"[llm_extractor] LLM error: {e}")
+        update_observation(
+            output={"error": str(e)}, metadata={"success": False}
+        )
 
-        data = json.loads(m.group())
+    return out
 
-        # gender
-        g = str(data.get("gender") or "").lower()
-        if g in {"male", "m", "man", "men", "mezczyzna"}:
-            out["gender"] = "male"
-        elif g in {"female", "f", "woman", "kobieta"}:
-            out["gender"] = "female"
 
-        # age
-        try:
-            age = int(data.get("age"))
-            if 15 <= age <= 90:
-                out["age"] = age
-        except Exception:
-            pass
+# ----------------------------
+# Ścieżka asynchroniczna (AsyncOpenAI, single-flight, limit równoległości)
+# ----------------------------
 
-        # time
-        try:
-            t5 = int(data.get("time_5km_seconds"))
-            out["time_5km_seconds"] = _accept_5k_range(t5)
-        except Exception:
-            pass
+# Maksymalna liczba równoległych zapytań do OpenAI (per pętla zdarzeń)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+_ASYNC_L1_MAXSIZE = 100
 
-        try:
-            langfuse_context.update_current_observation(  # type: ignore
-                output=out, metadata={"model": model, "success": all(out.values()), "cached": True}
+
+def _make_async_client():
+    """Klient AsyncOpenAI. Zwraca None, jeśli brak klucza/SDK."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    AsyncOpenAI = _openai_class("AsyncOpenAI") if api_key else None
+    if AsyncOpenAI is None:
+        return None
+    try:
+        return AsyncOpenAI(api_key=api_key, timeout=30.0, max_retries=2)  # type: ignore
+    except Exception:
+        return None
+
+
+class _AsyncLLMState:
+    """Stan związany z jedną pętlą zdarzeń (klient httpx i futures nie są przenośne)."""
+
+    def __init__(self):
+        self.client = _make_async_client()
+        self.semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        self.inflight: Dict[Tuple[str, str, str], asyncio.Task] = {}
+
+
+_async_states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _AsyncLLMState]" = (
+    weakref.WeakKeyDictionary()
+)
+
+# L1 dla zakończonych odpowiedzi (odpowiednik lru_cache z ścieżki sync)
+_async_l1: "OrderedDict[Tuple[str, str, str], str]" = OrderedDict()
+_async_l1_lock = threading.Lock()
+
+
+def _get_async_state() -> _AsyncLLMState:
+    loop = asyncio.get_running_loop()
+    state = _async_states.get(loop)
+    if state is None:
+        state = _async_states[loop] = _AsyncLLMState()
+    return state
+
+
+def _async_l1_get(key: Tuple[str, str, str]) -> Optional[str]:
+    with _async_l1_lock:
+        hit = _async_l1.get(key)
+        if hit is not None:
+            _async_l1.move_to_end(key)
+        return hit
+
+
+def _async_l1_set(key: Tuple[str, str, str], value: str) -> None:
+    with _async_l1_lock:
+        _async_l1[key] = value
+        _async_l1.move_to_end(key)
+        while len(_async_l1) > _ASYNC_L1_MAXSIZE:
+            _async_l1.popitem(last=False)
+
+
+async def _async_llm_fetch(
+    state: _AsyncLLMState,
+    text: str,
+    model: str,
+    missing: Tuple[str, ...],
+    known: Known,
+    l1_key: Tuple[str, str, str],
+) -> Tuple[str, str]:
+    """Jedno zapytanie: L2 (dysk) -> OpenAI pod semaforem -> zapis do L1/L2."""
+    req = _llm_request(missing)
+    disk = _get_disk_cache()
+    key = make_key(l1_key[0], model, l1_key[2])
+    if disk is not None:
+        t0 = time.perf_counter()
+        hit = await asyncio.to_thread(disk.get, key)
+        metrics.record("llm_cache", time.perf_counter() - t0)
+        if hit:
+            _async_l1_set(l1_key, hit)
+            return hit, "cache"
+
+    try:
+        async with state.semaphore:
+            t0 = time.perf_counter()
+            resp = await state.client.chat.completions.create(  # type: ignore
+                model=model,
+                messages=_llm_messages(text, req, known),
+                temperature=0.1,
+                max_tokens=req.max_tokens,
             )
-        except Exception:
-            pass
+            metrics.record("llm_call", time.perf_counter() - t0)
+        content = resp.choices[0].message.content or ""
+    except Exception:
+        return "", "llm"
+
+    if content:
+        _async_l1_set(l1_key, content)
+        if disk is not None:
+            await asyncio.to_thread(disk.set, key, content)
+    return content, "llm"
+
+
+async def _async_llm_call(
+    text: str, model: str, missing: Tuple[str, ...] = FIELDS, known: Known = ()
+) -> Tuple[str, str]:
+    """
+    Async odpowiednik _cached_llm_call. Równoległe zapytania o ten sam
+    (znormalizowany) tekst i zestaw braków czekają na jedno zapytanie w locie
+    zamiast wysyłać własne. Gdy brak klienta/klucza – zwraca pusty string.
+    Zwraca (odpowiedź, "llm"/"cache").
+    """
+    state = _get_async_state()
+    if state.client is None:
+        return "", "llm"
+
+    key = (_cache_text(text), model, _cache_scope(_llm_request(missing), known))
+    hit = _async_l1_get(key)
+    if hit is not None:
+        return hit, "cache"
+
+    task = state.inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(
+            _async_llm_fetch(state, text, model, missing, known, key)
+        )
+        state.inflight[key] = task
+        task.add_done_callback(lambda _t: state.inflight.pop(key, None))
+    # shield: anulowanie jednego czekającego nie przerywa zapytania pozostałym
+    return await asyncio.shield(task)
+
+
+@observe(name="llm_data_extraction_async")
+async def extract_user_data_async(
+    text: str,
+    missing: Optional[Iterable[str]] = None,
+    known: Optional[Dict[str, Any]] = None,
+    trace: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Optional[int | str]]:
+    """
+    Async wersja extract_user_data (AsyncOpenAI). Ta sama walidacja zakresów,
+    te same prompty częściowe i te same puste pola, gdy LLM niedostępny/błąd.
+    """
+    out: Dict[str, Optional[int | str]] = {
+        "gender": None,
+        "age": None,
+        "time_5km_seconds": None,
+    }
+
+    try:
+        model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+        response_text, origin = await _async_llm_call(
+            text, model, _missing_key(missing), _known_key(known)
+        )
+        if not response_text:
+            return out
+        out = _parse_llm_response(response_text)
+        if trace is not None:
+            trace["origin"] = origin
+
+        update_observation(
+            input=text, output=out, metadata={"model": model, "success": all(out.values())}
+        )
 
     except Exception as e:
-        print(f"[llm_extractor] LLM error: {e}")
-        try:
-            langfuse_context.update_current_observation(  # type: ignore
-                output={"error": str(e)}, metadata={"success": False}
-            )
-        except Exception:
-            pass
+        print(f"[llm_extractor] LLM error (async): {e}")
 
     return out
 
 
-def extract_user_data_auto(text: str) -> Dict[str, Optional[int | str]]:
+# Pętla zdarzeń w wątku tła dla wywołań synchronicznych (np. z sesji Streamlit).
+# Wszystkie wątki trafiają do jednej pętli, więc single-flight działa między sesjami.
+_bg_loop: Optional[asyncio.AbstractEventLoop] = None
+_bg_loop_lock = threading.Lock()
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _bg_loop
+    with _bg_loop_lock:
+        if _bg_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name="llm-async-loop", daemon=True
+            ).start()
+            _bg_loop = loop
+    return _bg_loop
+
+
+def _async_llm_available() -> bool:
+    return bool(os.getenv("OPENAI_API_KEY")) and _openai_class("AsyncOpenAI") is not None
+
+
+def extract_user_data_sync(
+    text: str,
+    missing: Optional[Iterable[str]] = None,
+    known: Optional[Dict[str, Any]] = None,
+    timeout: float = 120.0,
+    trace: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Optional[int | str]]:
+    """
+    Synchroniczny wrapper na extract_user_data_async (pętla w wątku tła).
+    Jak extract_user_data nigdy nie rzuca: timeout/błąd = puste pola.
+    """
+    future = asyncio.run_coroutine_threadsafe(
+        extract_user_data_async(text, missing, known, trace=trace), _background_loop()
+    )
+    try:
+        return future.result(timeout)
+    except FutureTimeoutError:
+        # zapytanie współdzielone z innymi (single-flight) jest pod shield - trwa dalej
+        future.cancel()
+        print(f"[llm_extractor] LLM timeout po {timeout:.0f} s (sync)")
+    except Exception as e:
+        print(f"[llm_extractor] LLM error (sync): {e}")
+    return {f: None for f in FIELDS}
+
+
+class ExtractionResult(NamedTuple):
+    """
+    Wynik ekstrakcji warstwowej:
+      fields  - gender / age / time_5km_seconds (jak extract_user_data_auto)
+      sources - warstwa, która dała pole: "regex" / "llm" / "cache" / None
+      timings - czas warstw w sekundach ("regex", "llm" jeśli wołany)
+    """
+
+    fields: Dict[str, Optional[int | str]]
+    sources: Dict[str, Optional[str]]
+    timings: Dict[str, float]
+
+    @property
+    def complete(self) -> bool:
+        return all(self.fields.get(f) for f in FIELDS)
+
+    @property
+    def regex_only(self) -> bool:
+        """Wszystkie pola z REGEX - bez zapytania do LLM."""
+        return all(s == "regex" for s in self.sources.values())
+
+    @property
+    def llm_used(self) -> bool:
+        return "llm" in self.timings
+
+
+def extract_user_data_detailed(text: str) -> ExtractionResult:
     """
     Warstwa 1: szybki REGEX.
-    Warstwa 2: LLM tylko dla braków (jeśli dostępny).
+    Warstwa 2: LLM tylko dla braków (jeśli dostępny). Domyślnie prompt pyta
+    wyłącznie o brakujące pola, a znalezione przez REGEX idą jako kontekst
+    (LLM_PARTIAL_PROMPTS=0 przywraca pełną ekstrakcję).
+
+    Zwraca pola razem z informacją, skąd pochodzi każde z nich i ile
+    trwała każda warstwa (UI, metryki i trace nie muszą liczyć tego ponownie).
     """
+    t_start = time.perf_counter()
     quick = _preparse_quick(text)
+    timings = {"regex": round(time.perf_counter() - t_start, 6)}
+    metrics.record("regex", timings["regex"])
+    sources: Dict[str, Optional[str]] = {f: "regex" if quick[f] else None for f in FIELDS}
     if all(quick.values()):
-        return quick
+        metrics.record("extract", time.perf_counter() - t_start)
+        metrics.inc("extractions_total")
+        metrics.inc("extractions_regex_only")
+        return ExtractionResult(quick, sources, timings)
+
+    missing: Optional[Tuple[str, ...]] = None
+    known: Optional[Dict[str, Any]] = None
+    if os.getenv("LLM_PARTIAL_PROMPTS", "1") != "0":
+        missing = tuple(f for f in FIELDS if not quick[f])
+        known = quick
+
+    trace: Dict[str, Any] = {}
+    t0 = time.perf_counter()
+    if _async_llm_available():
+        llm = extract_user_data_sync(text, missing, known, trace=trace)
+    else:
+        llm = extract_user_data(text, missing, known, trace=trace)
+    timings["llm"] = round(time.perf_counter() - t0, 6)
+
+    fields = _merge_layers(quick, llm)
+    for f in FIELDS:
+        if sources[f] is None and fields[f]:
+            sources[f] = trace.get("origin", "llm")
+    metrics.record("extract", time.perf_counter() - t_start)
+    metrics.inc("extractions_total")
+    metrics.inc("extractions_llm")
+    return ExtractionResult(fields, sources, timings)
+
+
+def extract_user_data_auto(text: str) -> Dict[str, Optional[int | str]]:
+    """Same pola z extract_user_data_detailed (REGEX, a LLM tylko dla braków)."""
+    return extract_user_data_detailed(text).fields
 
-    llm = extract_user_data(text)
 
+def _merge_layers(
+    quick: Dict[str, Optional[int | str]], llm: Dict[str, Optional[int | str]]
+) -> Dict[str, Optional[int | str]]:
+    """REGEX ma pierwszeństwo, LLM uzupełnia tylko braki."""
     return {
         "gender": quick["gender"] or llm.get("gender"),
         "age": quick["age"] or llm.get("age"),
@@ -286,7 +648,143 @@ def extract_user_data_auto(text: str) -> Dict[str, Optional[int | str]]:
     }
 
 
+# ----------------------------
+# Ekstrakcja wsadowa (import arkuszy z wieloma opisami)
+# ----------------------------
+
+# Liczba opisów w jednym zapytaniu do LLM
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "20"))
+
+_BATCH_SYSTEM_PROMPT = (
+    "Jesteś asystentem do ekstrakcji danych dla predyktora czasu półmaratonu.\n\n"
+    "Dostaniesz tablicę JSON obiektów {\"id\": int, \"text\": str} - opisy różnych biegaczy.\n"
+    "Dla KAŻDEGO obiektu wydobądź:\n"
+    "- gender: \"male\" lub \"female\"\n"
+    "- age: liczba całkowita, wiek w latach\n"
+    "- time_5km_seconds: czas na 5km w SEKUNDACH jako liczba całkowita\n\n"
+    "Zwróć TYLKO tablicę JSON, jeden obiekt na każde id (brak danych = null):\n"
+    "[{\"id\": int, \"gender\": \"male\"|\"female\"|null, \"age\": int|null, "
+    "\"time_5km_seconds\": int|null}, ...]\n\n"
+    "Przykład:\n"
+    "Input: [{\"id\": 0, \"text\": \"M 30 lat, 5km 24:30\"}, "
+    "{\"id\": 1, \"text\": \"Kobieta 28 lat, 5k w 27 minut\"}]\n"
+    "Output: [{\"id\": 0, \"gender\": \"male\", \"age\": 30, \"time_5km_seconds\": 1470}, "
+    "{\"id\": 1, \"gender\": \"female\", \"age\": 28, \"time_5km_seconds\": 1620}]"
+)
+
+# Limit odpowiedzi: ~40 tokenów na obiekt + zapas na nawiasy
+_BATCH_TOKENS_PER_ITEM = 40
+
+
+def _llm_batch_call(client, texts: List[str], model: str) -> Dict[int, Dict[str, Optional[int | str]]]:
+    """
+    Jedno zapytanie dla wielu opisów. Zwraca {indeks w texts: pola} tylko dla
+    obiektów, które dało się odczytać; reszta idzie do fallbacku per opis.
+    """
+    payload = json.dumps(
+        [{"id": i, "text": t} for i, t in enumerate(texts)], ensure_ascii=False
+    )
+    try:
+        resp = client.chat.completions.create(  # type: ignore
+            model=model,
+            messages=[
+                {"role": "system", "content": _BATCH_SYSTEM_PROMPT},
+                {"role": "user", "content": payload},
+            ],
+            temperature=0.1,
+            max_tokens=_BATCH_TOKENS_PER_ITEM * len(texts) + 50,
+        )
+        content = resp.choices[0].message.content or ""
+        m = re.search(r"\[.*\]", content, re.DOTALL)
+        items = json.loads(m.group()) if m else []
+    except Exception as e:
+        print(f"[llm_extractor] batch LLM error: {e}")
+        return {}
+
+    parsed: Dict[int, Dict[str, Optional[int | str]]] = {}
+    if not isinstance(items, list):
+        return parsed
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            idx = int(item.get("id"))
+        except Exception:
+            continue
+        if 0 <= idx < len(texts) and idx not in parsed:
+            parsed[idx] = _validate_llm_fields(item)
+    return parsed
+
+
+@observe(name="llm_data_extraction_batch")
+def extract_user_data_batch(
+    texts: Iterable[str], chunk_size: Optional[int] = None
+) -> List[Dict[str, Optional[int | str]]]:
+    """
+    Ekstrakcja dla wielu opisów naraz (np. import arkusza od trenera).
+
+    1. REGEX dla wszystkich opisów.
+    2. Nierozwiązane opisy (bez duplikatów) pakowane po chunk_size do
+       jednego zapytania zwracającego tablicę JSON.
+    3. Pojedyncze extract_user_data tylko dla obiektów, których nie dało
+       się odczytać z odpowiedzi wsadowej.
+
+    Zwraca listę wyników w kolejności wejścia (format jak extract_user_data_auto).
+    """
+    texts = list(texts)
+    results = [_preparse_quick(t) for t in texts]
+
+    # opisy różniące się tylko wielkością liter/spacjami/ogonkami idą raz
+    pending: Dict[str, List[int]] = {}
+    for i, quick in enumerate(results):
+        if not all(quick.values()):
+            pending.setdefault(_cache_text(texts[i]), []).append(i)
+
+    client = _get_openai_client()
+    if not pending or client is None:
+        return results
+
+    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    size = max(1, chunk_size or LLM_BATCH_SIZE)
+    groups = list(pending.values())
+    failed: List[List[int]] = []
+
+    for start in range(0, len(groups), size):
+        chunk = groups[start:start + size]
+        parsed = _llm_batch_call(client, [texts[g[0]] for g in chunk], model)
+        for j, group in enumerate(chunk):
+            llm = parsed.get(j)
+            if llm is None:
+                failed.append(group)
+                continue
+            for i in group:
+                results[i] = _merge_layers(results[i], llm)
+
+    for group in failed:
+        quick = results[group[0]]
+        missing = tuple(f for f in FIELDS if not quick[f])
+        llm = extract_user_data(texts[group[0]], missing, quick)
+        for i in group:
+            results[i] = _merge_layers(results[i], llm)
+
+    update_observation(
+        metadata={
+            "items": len(texts),
+            "llm_items": sum(len(g) for g in groups),
+            "llm_batches": -(-len(groups) // size),
+            "fallback_items": len(failed),
+        }
+    )
+
+    return results
+
+
 def clear_llm_cache():
     """Wyczyść cache LLM (użyj np. po zmianie modelu)."""
     _cached_llm_call.cache_clear()
+    with _async_l1_lock:
+        _async_l1.clear()
+    disk = _get_disk_cache()
+    if disk is not None:
+        disk.clear()
     print("✅ LLM cache wyczyszczony")
@@ -0,0 +1,420 @@
+# utils/metrics.py
+from __future__ import annotations
+
+import json
+import os
+import re
+import socket
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional
+
+# ── Latencja etapów pipeline'u ──────────────────────────────────────────────
+# Spany na zegarze monotonicznym (perf_counter_ns) wokół etapów:
+#   regex, llm_cache, llm_call, extract, features, inference, format, predict
+# Każdy etap ma histogram log-liniowy w stylu HDR: 2^SUB_BITS kubełków na
+# oktawę (środek kubełka: błąd względny percentyla < 1/2^(SUB_BITS+1) ≈ 1,6%),
+# stała pamięć, rejestracja O(1). PIPELINE_METRICS=0 wyłącza - span() zwraca wtedy
+# współdzielony obiekt no-op (koszt: jedno wywołanie funkcji).
+
+_SUB_BITS = 5
+_SUB = 1 << _SUB_BITS          # dokładne wartości 0..63 µs, potem _SUB kubełków na oktawę
+_N_BUCKETS = 40 * _SUB         # do ~2^44 µs - z zapasem
+
+# Kolejność etapów w UI / raportach
+STAGES = [
+    "regex",
+    "llm_cache",
+    "llm_call",
+    "extract",
+    "features",
+    "inference",
+    "format",
+    "predict",
+]
+
+_enabled = os.getenv("PIPELINE_METRICS", "1") != "0"
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(value: bool) -> None:
+    global _enabled
+    _enabled = bool(value)
+
+
+def _bucket(us: int) -> int:
+    if us < 2 * _SUB:
+        return max(us, 0)
+    # oktawa [2^k, 2^(k+1)) dzielona na _SUB kubełków szerokości 2^shift
+    shift = us.bit_length() - _SUB_BITS - 1
+    return min((shift << _SUB_BITS) + (us >> shift), _N_BUCKETS - 1)
+
+
+def _bucket_value(index: int) -> float:
+    """Środek kubełka w µs (wartość raportowana dla percentyla)."""
+    if index < 2 * _SUB:
+        return float(index)
+    shift = (index >> _SUB_BITS) - 1
+    low = (index - (shift << _SUB_BITS)) << shift
+    return low + ((1 << shift) - 1) / 2
+
+
+class Histogram:
+    """Histogram czasów w µs (percentyle z dokładnością ~1,6%)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counts: List[int] = [0] * _N_BUCKETS
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def record_us(self, us: int) -> None:
+        index = _bucket(us)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total_us += us
+            if us > self.max_us:
+                self.max_us = us
+
+    def percentile(self, q: float) -> float:
+        """Percentyl q (0-100) w µs."""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = max(1, int(round(q / 100 * self.count)))
+            seen = 0
+            for index, n in enumerate(self._counts):
+                seen += n
+                if seen >= rank:
+                    return min(_bucket_value(index), float(self.max_us))
+        return float(self.max_us)
+
+    def summary(self) -> Dict[str, float]:
+        """count, mean/p50/p95/p99/max w ms."""
+        count = self.count
+        return {
+            "count": count,
+            "mean_ms": round(self.total_us / count / 1000, 3) if count else 0.0,
+            "p50_ms": round(self.percentile(50) / 1000, 3),
+            "p95_ms": round(self.percentile(95) / 1000, 3),
+            "p99_ms": round(self.percentile(99) / 1000, 3),
+            "max_ms": round(self.max_us / 1000, 3),
+        }
+
+
+_histograms: Dict[str, Histogram] = {}
+_registry_lock = threading.Lock()
+
+
+def histogram(stage: str) -> Histogram:
+    h = _histograms.get(stage)
+    if h is None:
+        with _registry_lock:
+            h = _histograms.setdefault(stage, Histogram())
+    return h
+
+
+def record(stage: str, seconds: float) -> None:
+    """Zapis czasu zmierzonego poza span() (np. już policzone timings)."""
+    if _enabled:
+        histogram(stage).record_us(int(seconds * 1_000_000))
+
+
+class _Span:
+    __slots__ = ("_hist", "_t0")
+
+    def __init__(self, hist: Histogram) -> None:
+        self._hist = hist
+
+    def __enter__(self) -> "_Span":
+        self._t0 = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._hist.record_us((time.perf_counter_ns() - self._t0) // 1000)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(stage: str):
+    """with span("regex"): ...  - czas bloku trafia do histogramu etapu."""
+    if not _enabled:
+        return _NO_SPAN
+    return _Span(histogram(stage))
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    """Podsumowanie wszystkich etapów (kolejność zapisu)."""
+    with _registry_lock:
+        items = list(_histograms.items())
+    return {stage: h.summary() for stage, h in items}
+
+
+def reset() -> None:
+    with _registry_lock:
+        _histograms.clear()
+
+
+def render_text(prefix: str = "halfmarathon_stage_latency") -> str:
+    """Format tekstowy Prometheus (summary) dla endpointu /metrics."""
+    lines = [
+        f"# HELP {prefix}_seconds Latencja etapów pipeline'u predykcji.",
+        f"# TYPE {prefix}_seconds summary",
+    ]
+    with _registry_lock:
+        items = list(_histograms.items())
+    for stage, h in items:
+        for q in (0.5, 0.95, 0.99):
+            value = h.percentile(q * 100) / 1_000_000
+            lines.append(f'{prefix}_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+        lines.append(f'{prefix}_seconds_sum{{stage="{stage}"}} {h.total_us / 1_000_000:.6f}')
+        lines.append(f'{prefix}_seconds_count{{stage="{stage}"}} {h.count}')
+    return "\n".join(lines) + "\n"
+
+
+def stage_table() -> List[Dict[str, float]]:
+    """Wiersze do tabeli w UI (etap + podsumowanie), w kolejności STAGES."""
+    snap = snapshot()
+    stages = [s for s in STAGES if s in snap] + [s for s in snap if s not in STAGES]
+    return [dict(stage=s, **snap[s]) for s in stages]
+
+
+
+# ── Liczniki użycia (cały proces, wszystkie sesje) ──────────────────────────
+# Każdy wątek zwiększa własny shard (zwykły dict, bez blokad i bez
+# rywalizacji); odczyt sumuje shardy. Gdy wątek się kończy (Streamlit: nowy
+# wątek na każdy rerun), jego shard jest doliczany do _base i usuwany, więc
+# lista shardów nie rośnie. Nazwy liczników: COUNTERS.
+# Opcjonalny flush co METRICS_FLUSH_INTERVAL s do METRICS_FLUSH_DIR
+# (metrics_<host>_<pid>.json lub .prom; host, bo kontenery na wspólnym
+# wolumenie mają zwykle ten sam pid) - pliki wszystkich workerów można
+# zsumować (aggregate_dir, bez plików nieodświeżanych dłużej niż
+# STALE_FLUSHES interwałów - martwe workery) albo zebrać textfile collectorem.
+
+STALE_FLUSHES = 10
+
+COUNTERS = [
+    "extractions_total",
+    "extractions_regex_only",
+    "extractions_llm",
+    "predictions_total",
+    "predictions_ml",
+    "predictions_fallback",
+]
+
+_shards: List[Dict[str, int]] = []
+_base: Dict[str, int] = {}  # liczniki zakończonych wątków
+_shards_lock = threading.Lock()
+_local = threading.local()
+
+
+class _ShardOwner:
+    """Obiekt w threading.local wątku - zwalniany razem z wątkiem."""
+
+    __slots__ = ("shard", "__weakref__")
+
+    def __init__(self, shard: Dict[str, int]) -> None:
+        self.shard = shard
+
+
+def _retire(shard: Dict[str, int]) -> None:
+    # wątek zakończony: nikt już nie pisze do sharda
+    with _shards_lock:
+        for name, value in shard.items():
+            _base[name] = _base.get(name, 0) + value
+        try:
+            _shards.remove(shard)
+        except ValueError:
+            pass
+
+
+def _shard() -> Dict[str, int]:
+    owner = getattr(_local, "owner", None)
+    if owner is None:
+        owner = _ShardOwner({})
+        with _shards_lock:  # tylko raz na wątek
+            _shards.append(owner.shard)
+        weakref.finalize(owner, _retire, owner.shard)
+        _local.owner = owner
+    return owner.shard
+
+
+def inc(name: str, n: int = 1) -> None:
+    """Zwiększ licznik procesu (wątkowo bezpieczne, bez blokady na ścieżce gorącej)."""
+    shard = _shard()
+    shard[name] = shard.get(name, 0) + n
+
+
+def counters() -> Dict[str, int]:
+    """Suma wszystkich shardów (COUNTERS zawsze obecne, także z zerem)."""
+    with _shards_lock:
+        shards = [_base.copy()] + [s.copy() for s in _shards]
+    total = dict.fromkeys(COUNTERS, 0)
+    for shard in shards:
+        for name, value in shard.items():
+            total[name] = total.get(name, 0) + value
+    return total
+
+
+def reset_counters() -> None:
+    with _shards_lock:
+        _base.clear()
+        for shard in _shards:
+            shard.clear()
+
+
+def rates(values: Optional[Dict[str, int]] = None) -> Dict[str, float]:
+    """Udział REGEX-only w ekstrakcjach i fallbacku w predykcjach (0-1)."""
+    c = values if values is not None else counters()
+    extractions = c.get("extractions_total", 0)
+    predictions = c.get("predictions_total", 0)
+    return {
+        "regex_hit_rate": c.get("extractions_regex_only", 0) / extractions if extractions else 0.0,
+        "fallback_rate": c.get("predictions_fallback", 0) / predictions if predictions else 0.0,
+    }
+
+
+def render_counters_text(prefix: str = "halfmarathon", labels: str = "") -> str:
+    """Liczniki w formacie tekstowym Prometheus."""
+    lines = []
+    for name, value in counters().items():
+        metric = f"{prefix}_{name}" if name.endswith("_total") else f"{prefix}_{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{{{labels}}} {value}" if labels else f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path: str, content: str) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+class MetricsFlusher:
+    """Wątek tła zapisujący liczniki (i latencje) procesu do pliku."""
+
+    def __init__(
+        self,
+        directory: str,
+        interval: float = 30.0,
+        fmt: str = "json",
+    ):
+        if fmt not in {"json", "prometheus"}:
+            raise ValueError(f"Nieznany format metryk: {fmt}")
+        self.directory = directory
+        self.interval = interval
+        self.fmt = fmt
+        ext = "json" if fmt == "json" else "prom"
+        host = re.sub(r"[^\w.-]+", "_", socket.gethostname())
+        self.path = os.path.join(directory, f"metrics_{host}_{os.getpid()}.{ext}")
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def flush_once(self) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        if self.fmt == "json":
+            content = json.dumps(
+                {
+                    "pid": os.getpid(),
+                    "host": socket.gethostname(),
+                    "timestamp": time.time(),
+                    "counters": counters(),
+                    "stages": snapshot(),
+                },
+                ensure_ascii=False,
+            )
+        else:
+            labels = f'worker="{socket.gethostname()}:{os.getpid()}"'
+            content = render_counters_text(labels=labels) + render_text()
+        _write_atomic(self.path, content)
+        return self.path
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush_once()
+            except Exception as e:
+                print(f"⚠️ Zapis metryk nieudany ({self.path}): {e}")
+
+    def start(self) -> "MetricsFlusher":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="metrics-flush", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, flush: bool = True) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if flush:
+            self.flush_once()
+
+
+_flusher: Optional[MetricsFlusher] = None
+
+
+def maybe_start_flusher() -> Optional[MetricsFlusher]:
+    """Start flushera, gdy ustawiono METRICS_FLUSH_DIR (raz na proces)."""
+    global _flusher
+    directory = os.getenv("METRICS_FLUSH_DIR")
+    if not directory:
+        return None
+    with _registry_lock:
+        if _flusher is None:
+            _flusher = MetricsFlusher(
+                directory,
+                interval=float(os.getenv("METRICS_FLUSH_INTERVAL", "30")),
+                fmt=os.getenv("METRICS_FLUSH_FORMAT", "json"),
+            ).start()
+    return _flusher
+
+
+def aggregate_dir(
+    directory: Optional[str] = None, max_age: Optional[float] = None
+) -> Dict[str, int]:
+    """
+    Suma liczników z plików metrics_*.json żywych workerów.
+    max_age [s]: starsze pliki są pomijane (domyślnie STALE_FLUSHES x
+    METRICS_FLUSH_INTERVAL).
+    """
+    directory = directory or os.getenv("METRICS_FLUSH_DIR")
+    if max_age is None:
+        max_age = STALE_FLUSHES * float(os.getenv("METRICS_FLUSH_INTERVAL", "30"))
+    total = dict.fromkeys(COUNTERS, 0)
+    if not directory or not os.path.isdir(directory):
+        return total
+    now = time.time()
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith("metrics_") and name.endswith(".json")):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            stamp = float(data.get("timestamp") or os.path.getmtime(path))
+        except Exception:
+            continue  # plik w trakcie podmiany / uszkodzony - pomiń
+        if now - stamp > max_age:
+            continue  # worker nie żyje (albo nie flushuje) - pomiń
+        for key, value in (data.get("counters") or {}).items():
+            total[key] = total.get(key, 0) + int(value)
+    return total
@@ -1,16 +1,58 @@
 from __future__ import annotations
 
+import copy
 import hashlib
+import json
 import os
 import math
 import pickle
 import logging
-from typing import Optional, Dict, Any
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Optional, Dict, Any, Iterable, List, Mapping
 
-import pandas as pd
+import numpy as np
+
+# pandas i boto3 importowane dopiero, gdy są potrzebne (DataFrame z cechami,
+# pobieranie ze Spaces) - fallback heurystyczny startuje bez nich
+if TYPE_CHECKING:  # pragma: no cover
+    import pandas as pd
+
+from . import metrics, prediction_table
+from .artifact_cache import ArtifactCache
+from . import tree_engine
+from .tree_engine import CompiledTreeEnsemble, SharedTreeModel, compile_model
+
+HALF_MARATHON_KM = 21.0975
+
+_CONFIDENCE_TEXT = {
+    "high": "Wysoka (model ML)",
+    "medium": "Średnia (heurystyka)",
+    "low": "Niska (brak danych)",
+}
+
+# Komunikaty walidacji - wspólne dla predict() i predict_batch()
+_ERR_GENDER = "Brak lub niepoprawna płeć. Wymagane: 'male' lub 'female'."
+_ERR_AGE = "Brak lub niepoprawny wiek. Wymagana liczba całkowita."
+_ERR_TIME = "Brak lub niepoprawny czas 5km. Wymagana liczba sekund (int)."
+_ERR_TIME_RANGE = "Czas 5km poza sensownym zakresem (9-60 minut)."
+
+# Lokalizacja modelu w Spaces; pobrane kopie lądują w model_cache/objects/
+# (utils/artifact_cache.py), CACHE_MODEL_PATH to domyślny MODEL_PATH
+SPACES_MODEL_KEY = "models/halfmarathon_model_latest.pkl"
+SPACES_METADATA_KEY = "models/model_metadata_latest.pkl"
+# SHA-256 każdego pliku wersji (DataLoader.publish); zastępuje MODEL_SHA256
+SPACES_MANIFEST_KEY = "models/manifest_latest.json"
+CACHE_MODEL_PATH = "model_cache/halfmarathon_model_latest.pkl"
+# Start w trakcie DataLoader.publish (kopie *_latest jeszcze nie wszystkie):
+# manifest i model mogą być z różnych wersji - ponów pobranie po tych przerwach [s]
+MANIFEST_RETRY_DELAYS = (0.5, 1.5)
+
+# Skompilowane drzewa vs model.predict: powyżej tylu wierszy wielowątkowy
+# predyktor XGBoost (C++) jest szybszy od traversalu w NumPy
+ENGINE_MAX_BATCH = int(os.getenv("TREE_ENGINE_MAX_BATCH", "64"))
 
-from botocore.config import Config
-import boto3
 
 def _sha256_file(path: str) -> Optional[str]:
     try:
@@ -36,23 +78,87 @@ def _try_load_model(path: str):
             return None
 
 
-def _download_from_spaces(bucket, key, dest_path, endpoint, access_key, secret_key) -> bool:
+def _spaces_client(endpoint, access_key, secret_key, max_pool_connections: int = 10):
+    """Jeden klient (pula połączeń) współdzielony przez wątki pobierające."""
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client(
+        "s3",
+        region_name=os.getenv("DO_SPACES_REGION", "fra1"),
+        endpoint_url=endpoint,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        config=Config(
+            signature_version="s3v4",
+            s3={"addressing_style": "virtual"},
+            max_pool_connections=max_pool_connections,
+        ),
+    )
+
+def _manifest_sha256(manifest_path: Optional[str], key: str) -> Optional[str]:
+    """Oczekiwany SHA-256 klucza z manifestu publikacji (None = brak wpisu/pliku)."""
+    if not manifest_path:
+        return None
     try:
-        s3 = boto3.client(
-            "s3",
-            region_name=os.getenv("DO_SPACES_REGION", "fra1"),
-            endpoint_url=endpoint,
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            config=Config(signature_version="s3v4", s3={"addressing_style": "virtual"}),
-        )
-        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-        s3.download_file(bucket, key, dest_path)
-        print(f"✅ Model pobrany z Spaces: s3://{bucket}/{key}")
-        return True
-    except Exception as e:
-        print(f"⚠️ Nie udało się pobrać modelu z Spaces: {e}")
-        return False
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            entry = json.load(f).get("files", {}).get(key)
+        return entry.get("sha256") if isinstance(entry, dict) else None
+    except Exception:
+        return None
+
+
+def _int_column(values: Any) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Kolumna -> (int64[], maska poprawności) z semantyką int(v) jak w predict().
+    Typowe tablice liczbowe konwertowane wektorowo, reszta element po elemencie.
+    """
+    arr = np.asarray(values)
+    if arr.dtype.kind in "iub":
+        return arr.astype(np.int64), np.ones(arr.shape, dtype=bool)
+    if arr.dtype.kind == "f":
+        ok = np.isfinite(arr)
+        return np.where(ok, np.trunc(arr), 0).astype(np.int64), ok
+
+    # np.asarray zamienia listy mieszane (np. [30, "x"]) na stringi - bierzemy oryginały
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = list(values)
+    out = np.zeros(arr.shape, dtype=np.int64)
+    ok = np.zeros(arr.shape, dtype=bool)
+    for i, v in enumerate(arr.tolist()):
+        try:
+            out[i] = int(v)
+            ok[i] = True
+        except Exception:
+            pass
+    return out, ok
+
+
+def _batch_columns(records: Any, gender: Any, age: Any, time_5km_seconds: Any):
+    """Sprowadza wejście predict_batch() do trzech kolumn tej samej długości."""
+    # DataFrame/Series na wejściu oznacza, że pandas jest już zaimportowany
+    pd = sys.modules.get("pandas")
+    if records is not None:
+        if isinstance(records, Mapping) or (pd is not None and isinstance(records, pd.DataFrame)):
+            gender = records.get("gender")
+            age = records.get("age")
+            time_5km_seconds = records.get("time_5km_seconds")
+        else:
+            rows = list(records)
+            gender = [r.get("gender") for r in rows]
+            age = [r.get("age") for r in rows]
+            time_5km_seconds = [r.get("time_5km_seconds") for r in rows]
+
+    columns = [gender, age, time_5km_seconds]
+    lengths = {len(c) for c in columns if c is not None}
+    if len(lengths) > 1:
+        raise ValueError(f"Kolumny wejściowe mają różne długości: {sorted(lengths)}")
+    n = lengths.pop() if lengths else 0
+    return [
+        c.to_numpy() if pd is not None and isinstance(c, pd.Series) else (c if c is not None else [None] * n)
+        for c in columns
+    ]
+
 
 class HalfMarathonPredictor:
     """
@@ -61,37 +167,82 @@ class HalfMarathonPredictor:
     - Jeśli nie ma modelu, używa fallback heurystycznego
     """
 
-    def __init__(self):
+    def __init__(self, background: Optional[bool] = None):
+        """
+        background=True (lub MODEL_ASYNC_LOAD=1): konstruktor wraca od razu
+        w trybie fallback, a model ML jest pobierany, weryfikowany i
+        rozgrzewany w wątku tła, po czym podmieniany atomowo (load_status()).
+        """
+        self._init_state()
+        if background is None:
+            background = os.getenv("MODEL_ASYNC_LOAD", "0") == "1"
+
+        if not background:
+            self._load_model()
+            self._prune_caches()
+            self._loaded.set()
+            return
+
+        self.load_state = "loading"
+        self._load_thread = threading.Thread(
+            target=self._background_load, name="model-loader", daemon=True
+        )
+        self._load_thread.start()
+
+    def _init_state(self) -> None:
+        self._swap_lock = threading.RLock()
+        self._loaded = threading.Event()
+        self._load_thread: Optional[threading.Thread] = None
+        self.load_state = "idle"  # idle -> loading -> ready | fallback | failed
+        self.load_error: Optional[str] = None
+        self.load_timings: Dict[str, float] = {}
+
         self.model = None
         self.feature_order = None  # ← zapamiętana kolejność cech
+        self.engine: Optional[CompiledTreeEnsemble] = None
+        self._engine_model = None  # model, z którego skompilowano engine
+        self.model_sha256: Optional[str] = None
+        self.table: Optional[np.ndarray] = None  # tablica predykcji (PREDICTION_TABLE=1)
+        self.table_path: Optional[str] = None
+        self._table_model = None
         self.model_metadata = {
             "name": "HalfMarathonPredictor",
             "version": "1.0",
             "source": "fallback",
         }
 
+    def _timed(self, step: str, started: float) -> None:
+        self.load_timings[step] = round(
+            self.load_timings.get(step, 0.0) + time.perf_counter() - started, 4
+        )
+
+    def _load_model(self) -> None:
+        """Synchroniczne ładowanie: plik lokalny -> Spaces -> fallback."""
+        t_total = time.perf_counter()
+        try:
+            self._load_model_sources()
+        finally:
+            self._timed("total", t_total)
+        self.load_state = "ready" if self.model is not None else "fallback"
+
+    def _load_model_sources(self) -> None:
         # 1) Próba załadowania lokalnego modelu
-        model_path = os.getenv("MODEL_PATH", "model_cache/halfmarathon_model_latest.pkl")
+        model_path = os.getenv("MODEL_PATH", CACHE_MODEL_PATH)
         metadata_path = model_path.replace(".pkl", "_metadata.pkl")
 
         if os.path.isfile(model_path):
-            m = _try_load_model(model_path)
-            if m is not None:
-                self.model = m
-
-                # Załaduj metadata jeśli istnieje
-                if os.path.isfile(metadata_path):
-                    meta = _try_load_model(metadata_path)
-                    if meta and isinstance(meta, dict):
-                        self.model_metadata.update(meta)
-                        self.feature_order = meta.get("features")
-
+            t0 = time.perf_counter()
+            sha256 = _sha256_file(model_path)
+            self._timed("verify", t0)
+            if self._load_files(model_path, metadata_path, sha256):
                 self.model_metadata.update(
                     {"version": "ml-local", "source": model_path}
                 )
                 print(f"✅ Model załadowany lokalnie: {model_path}")
                 if self.feature_order:
                     print(f"   Features: {self.feature_order}")
+                self._compile_engine()
+                self._load_table()
                 return
 
         # 2) Próba pobrania z Digital Ocean Spaces
@@ -102,67 +253,391 @@ class HalfMarathonPredictor:
 
         if bucket and access_key and secret_key:
             endpoint = f"https://{region}.digitaloceanspaces.com"
-            model_key = "models/halfmarathon_model_latest.pkl"
-            metadata_key = "models/model_metadata_latest.pkl"
-            cache_path = "model_cache/halfmarathon_model_latest.pkl"
-            cache_meta_path = "model_cache/model_metadata_latest.pkl"
-
-            ok = _download_from_spaces(
-                bucket=bucket,
-                key=model_key,
-                dest_path=cache_path,
-                endpoint=endpoint,
-                access_key=access_key,
-                secret_key=secret_key,
-            )
+            model_key = SPACES_MODEL_KEY
 
-            # Pobierz też metadata (nie blokujące)
-            _download_from_spaces(
-                bucket=bucket,
-                key=metadata_key,
-                dest_path=cache_meta_path,
-                endpoint=endpoint,
-                access_key=access_key,
-                secret_key=secret_key,
-            )
+            cache = ArtifactCache(_spaces_client(endpoint, access_key, secret_key), bucket)
+            # Niezgodność checksum może oznaczać publikację w toku - ponów kilka razy
+            for delay in (*MANIFEST_RETRY_DELAYS, None):
+                verified = self._fetch_verified(cache, model_key)
+                if verified is not False or delay is None:
+                    break
+                print(f"⚠️ Manifest nie pasuje do modelu - ponawiam pobranie za {delay}s")
+                time.sleep(delay)
 
-            if ok and os.path.isfile(cache_path):
-                # Weryfikacja checksumy (opcjonalna)
-                checksum_ok = True
-                model_sha_env = os.getenv("MODEL_SHA256")
-                if model_sha_env:
-                    actual = _sha256_file(cache_path)
-                    if actual and actual.lower() != model_sha_env.lower():
-                        logging.warning(
-                            "Model checksum mismatch: expected %s, got %s",
-                            model_sha_env,
-                            actual,
-                        )
-                        checksum_ok = False
-
-                if checksum_ok:
-                    m = _try_load_model(cache_path)
-                    if m is not None:
-                        self.model = m
-
-                        # Załaduj metadata jeśli pobrano
-                        if os.path.isfile(cache_meta_path):
-                            meta = _try_load_model(cache_meta_path)
-                            if meta and isinstance(meta, dict):
-                                self.model_metadata.update(meta)
-                                self.feature_order = meta.get("features")
-
-                        self.model_metadata.update(
-                            {"version": "ml-spaces", "source": f"s3://{bucket}/{model_key}"}
-                        )
-                        print("✅ Model załadowany z Spaces")
-                        if self.feature_order:
-                            print(f"   Features: {self.feature_order}")
-                        return
+            if verified:
+                cache_path, cache_meta_path, actual = verified
+                if self._load_files(cache_path, cache_meta_path, actual):
+                    self.model_metadata.update(
+                        {"version": "ml-spaces", "source": f"s3://{bucket}/{model_key}"}
+                    )
+                    print("✅ Model załadowany z Spaces")
+                    if self.feature_order:
+                        print(f"   Features: {self.feature_order}")
+                    self._compile_engine()
+                    self._load_table()
+                    return
 
         # 3) Fallback - algorytm heurystyczny
         print("⚠️ Model ML niedostępny - używam fallback heurystycznego")
 
+    def _fetch_verified(self, cache: ArtifactCache, model_key: str):
+        """
+        Model + metadata + manifest ze Spaces i weryfikacja SHA-256.
+        Zwraca (ścieżka modelu, ścieżka metadata, sha256 modelu), None gdy modelu brak,
+        False przy niezgodności checksum.
+        """
+        # Model + metadata równolegle, jeden klient; niezmienione = 304 z cache
+        t0 = time.perf_counter()
+        paths = cache.fetch_many([model_key, SPACES_METADATA_KEY, SPACES_MANIFEST_KEY])
+        cache_path = paths.get(model_key)
+        cache_meta_path = paths.get(SPACES_METADATA_KEY)
+        manifest_path = paths.get(SPACES_MANIFEST_KEY)
+        self._timed("download", t0)
+
+        if not cache_path or not os.path.isfile(cache_path):
+            return None
+
+        # Weryfikacja checksum: manifest publikacji, ewentualnie MODEL_SHA256
+        checksum_ok = True
+        t0 = time.perf_counter()
+        expected = {
+            cache_path: _manifest_sha256(manifest_path, model_key)
+            or os.getenv("MODEL_SHA256"),
+        }
+        if cache_meta_path:
+            expected[cache_meta_path] = _manifest_sha256(manifest_path, SPACES_METADATA_KEY)
+        hashes = {path: _sha256_file(path) for path in expected}
+        self._timed("verify", t0)
+        for path, sha in expected.items():
+            if sha and hashes[path] and hashes[path].lower() != sha.lower():
+                logging.warning(
+                    "Checksum mismatch (%s): expected %s, got %s",
+                    path,
+                    sha,
+                    hashes[path],
+                )
+                checksum_ok = False
+
+        if not checksum_ok:
+            return False
+        return cache_path, cache_meta_path, hashes[cache_path]
+
+    def _load_files(
+        self, model_path: str, metadata_path: Optional[str], sha256: Optional[str]
+    ) -> bool:
+        """
+        Model + metadata z plików. W trybie MODEL_SHARED=1 zamiast pickle
+        najpierw współdzielone tablice drzew z model_cache/ (mmap, klucz =
+        SHA-256 modelu + cechy) - kolejne procesy na hoście nie deserializują
+        boostera i dzielą te same strony pamięci.
+        """
+        meta = None
+        if metadata_path and os.path.isfile(metadata_path):
+            meta = _try_load_model(metadata_path)
+        meta = meta if isinstance(meta, dict) else {}
+        feature_order = meta.get("features")
+
+        m = None
+        if self._shared_mode() and sha256:
+            t0 = time.perf_counter()
+            engine = CompiledTreeEnsemble.load(
+                tree_engine.shared_dir(self._shared_key(sha256, feature_order)), sha256
+            )
+            self._timed("shared", t0)
+            if engine is not None:
+                m = SharedTreeModel(engine)
+                print(f"✅ Współdzielone drzewa (mmap): {engine.n_trees} drzew")
+
+        if m is None:
+            t0 = time.perf_counter()
+            m = _try_load_model(model_path)
+            self._timed("unpickle", t0)
+            if m is None:
+                return False
+
+        self.model = m
+        self.model_metadata.update(meta)
+        self.feature_order = feature_order
+        self.model_sha256 = sha256
+        return True
+
+    @staticmethod
+    def _shared_mode() -> bool:
+        return os.getenv("MODEL_SHARED", "0") == "1" and os.getenv("TREE_ENGINE", "1") != "0"
+
+    @staticmethod
+    def _shared_key(sha256: str, feature_order: Optional[list]) -> str:
+        return prediction_table.table_key(sha256, feature_order)
+
+    # ----------------------------
+    # Ładowanie w tle + atomowa podmiana
+    # ----------------------------
+
+    _SWAPPED_ATTRS = (
+        "feature_order",
+        "model_metadata",
+        "model_sha256",
+        "engine",
+        "_engine_model",
+        "table",
+        "table_path",
+        "_table_model",
+        "model",  # ostatni: dopiero on przełącza predykcje na ML
+    )
+
+    def _background_load(self) -> None:
+        """Wątek tła: pełne ładowanie na osobnej instancji, rozgrzewka, podmiana."""
+        t_total = time.perf_counter()
+        staged = self.__class__.__new__(self.__class__)
+        staged._init_state()
+        try:
+            staged._load_model()
+            if staged.model is not None:
+                staged._warm_up()
+                self._install(staged)
+            with self._swap_lock:
+                self.load_timings.update(staged.load_timings)
+                self.load_state = staged.load_state
+        except Exception as e:
+            print(f"⚠️ Ładowanie modelu w tle nieudane: {e} - zostaje fallback")
+            with self._swap_lock:
+                self.load_timings.update(staged.load_timings)
+                self.load_error = str(e)
+                self.load_state = "failed"
+        finally:
+            self._timed("background_total", t_total)
+            self._loaded.set()
+
+    def _warm_up(self) -> None:
+        """
+        Pierwsza predykcja (leniwe inicjalizacje XGBoost); musi przejść przez ML.
+        Bezpośrednio przez _predict_ml - bez liczników użycia i spanu "predict",
+        bo to nie ruch użytkowników.
+        """
+        t0 = time.perf_counter()
+        try:
+            warm = self._predict_ml(1470, 30, "male")
+        except Exception as e:
+            raise RuntimeError(f"rozgrzewka nie przeszła przez model ML: {e}")
+        self._timed("warmup", t0)
+        if not (warm and math.isfinite(warm) and warm > 0):
+            raise RuntimeError("rozgrzewka nie przeszła przez model ML")
+
+    def reload_from(
+        self,
+        model_path: str,
+        metadata_path: Optional[str] = None,
+        source: Optional[str] = None,
+        expected_sha256: Optional[str] = None,
+    ) -> bool:
+        """
+        Hot reload: załaduj model z pliku na osobnej instancji, zweryfikuj
+        SHA-256, rozgrzej i dopiero wtedy podmień atomowo. Przy błędzie
+        działający model zostaje bez zmian (zwraca False).
+        """
+        staged = self.__class__.__new__(self.__class__)
+        staged._init_state()
+        t_total = time.perf_counter()
+        try:
+            t0 = time.perf_counter()
+            actual = _sha256_file(model_path)
+            staged._timed("verify", t0)
+            if expected_sha256 and (actual or "").lower() != expected_sha256.lower():
+                raise ValueError(
+                    f"checksum mismatch: expected {expected_sha256}, got {actual}"
+                )
+
+            if not staged._load_files(model_path, metadata_path, actual):
+                raise ValueError(f"nie można wczytać {model_path}")
+            staged.model_metadata.update(
+                {"version": "ml-reload", "source": source or model_path}
+            )
+
+            staged._compile_engine()
+            staged._load_table()
+            staged._warm_up()
+        except Exception as e:
+            print(f"⚠️ Hot reload modelu odrzucony: {e}")
+            with self._swap_lock:
+                self.load_error = str(e)
+            return False
+
+        staged._timed("total", t_total)
+        self._install(staged)
+        with self._swap_lock:
+            self.load_timings = dict(staged.load_timings)
+            self.load_state = "ready"
+            self.load_error = None
+        return True
+
+    def _install(self, staged: "HalfMarathonPredictor") -> None:
+        """Atomowa podmiana modelu (predykcje widzą stary albo nowy komplet)."""
+        with self._swap_lock:
+            for attr in self._SWAPPED_ATTRS:
+                setattr(self, attr, getattr(staged, attr))
+        print(f"🔄 Model ML aktywny ({self.model_metadata.get('version')})")
+        self._prune_caches()
+
+    def _prune_caches(self) -> None:
+        """
+        Po aktywacji modelu: tablice predykcji i współdzielone drzewa innych
+        wersji w model_cache/ nie są już potrzebne (nie przy staged - odrzucony
+        hot reload nie może skasować plików działającego modelu).
+        """
+        if self.model is None or not self.model_sha256:
+            return
+        key = self._shared_key(self.model_sha256, self.feature_order)
+        if os.getenv("PREDICTION_TABLE", "0") == "1":
+            prediction_table.prune_tables(key)
+        if self._shared_mode():
+            tree_engine.prune_shared(key)
+
+    def _snapshot(self) -> "HalfMarathonPredictor":
+        """Spójna kopia stanu modelu na czas jednej predykcji."""
+        with self._swap_lock:
+            return copy.copy(self)
+
+    def wait_until_loaded(self, timeout: Optional[float] = None) -> bool:
+        """Czekaj na koniec ładowania (True gdy zakończone)."""
+        return self._loaded.wait(timeout)
+
+    def load_status(self) -> Dict[str, Any]:
+        """Stan ładowania: state, mode (ml/fallback), czasy etapów [s], błąd."""
+        with self._swap_lock:
+            return {
+                "state": self.load_state,
+                "mode": "ml" if self.model is not None else "fallback",
+                "shared": isinstance(self.model, SharedTreeModel),
+                "model_version": self.model_metadata.get("version"),
+                "model_sha256": self.model_sha256,
+                "timings": dict(self.load_timings),
+                "error": self.load_error,
+            }
+
+    def _compile_engine(self) -> None:
+        """
+        Spłaszczenie drzew modelu do tablic NumPy (utils/tree_engine.py).
+        Engine jest używany tylko, jeśli na siatce wejść daje wyniki
+        identyczne z model.predict. TREE_ENGINE=0 wyłącza.
+        """
+        self.engine = None
+        self._engine_model = None
+        if isinstance(self.model, SharedTreeModel):
+            # tablice z model_cache/ zweryfikował proces, który je zapisał
+            self.engine = self.model.engine
+            self._engine_model = self.model
+            return
+        if self.model is None or os.getenv("TREE_ENGINE", "1") == "0":
+            return
+
+        t0 = time.perf_counter()
+        try:
+            self._compile_engine_checked()
+        finally:
+            self._timed("compile", t0)
+
+    def _compile_engine_checked(self) -> None:
+        engine = compile_model(self.model)
+        if engine is None:
+            return
+        if self.feature_order and engine.feature_names and list(engine.feature_names) != list(self.feature_order):
+            print("⚠️ Kolejność cech modelu różna od metadata - zostaje model.predict")
+            return
+
+        # Siatka kontrolna: obie płcie, pełny zakres wieku i czasów 5 km
+        g, a, t = np.meshgrid([0, 1], np.arange(15, 91, 5), np.arange(540, 3601, 60), indexing="ij")
+        t5, age, gender_encoded = t.ravel(), a.ravel(), g.ravel()
+        try:
+            if self.feature_order:
+                expected = self.model.predict(self._feature_frame(t5, age, gender_encoded))
+            else:
+                expected = self.model.predict(self._basic_matrix(t5, age, gender_encoded, engine.n_features))
+            got = engine.predict(self._engine_matrix(t5, age, gender_encoded, engine))
+            equal = np.array_equal(np.asarray(expected, dtype=np.float32).reshape(-1), got)
+        except Exception as e:
+            print(f"⚠️ Weryfikacja skompilowanych drzew nieudana: {e}")
+            return
+        if not equal:
+            print("⚠️ Skompilowane drzewa różnią się od model.predict - zostaje model.predict")
+            return
+
+        self.engine = engine
+        self._engine_model = self.model
+        print(f"⚡ Skompilowane drzewa: {engine.n_trees} drzew, głębokość {engine.max_depth}")
+        if self._shared_mode() and self.model_sha256:
+            self._share_engine(engine)
+
+    def _share_engine(self, engine: CompiledTreeEnsemble) -> None:
+        """Pierwszy proces zapisuje tablice do model_cache/, kolejne tylko je mapują."""
+        directory = tree_engine.shared_dir(self._shared_key(self.model_sha256, self.feature_order))
+        try:
+            engine.save(directory, self.model_sha256)
+        except Exception as e:
+            print(f"⚠️ Nie udało się zapisać współdzielonych drzew ({directory}): {e}")
+            return
+        shared = CompiledTreeEnsemble.load(directory, self.model_sha256)
+        if shared is not None:
+            self.engine = shared  # strony z page cache zamiast prywatnej kopii
+
+    def _active_engine(self) -> Optional[CompiledTreeEnsemble]:
+        """Engine tylko dla modelu, z którego powstał (np. po podmianie self.model - brak)."""
+        if self.engine is not None and self.model is self._engine_model:
+            return self.engine
+        return None
+
+    def _load_table(self) -> None:
+        """
+        Tryb tablicy (PREDICTION_TABLE=1): predykcje dla całej dziedziny
+        wejść liczone raz i trzymane w model_cache/ jako .npy (memory-mapped).
+        Plik jest powiązany z SHA-256 modelu - nowy model = nowa tablica.
+        """
+        self.table = None
+        self.table_path = None
+        self._table_model = None
+        if self.model is None or not self.model_sha256:
+            return
+        if os.getenv("PREDICTION_TABLE", "0") != "1":
+            return
+
+        t0 = time.perf_counter()
+        try:
+            self._load_table_cached()
+        finally:
+            self._timed("table", t0)
+
+    def _load_table_cached(self) -> None:
+        key = prediction_table.table_key(self.model_sha256, self.feature_order)
+        path = prediction_table.table_path(key)
+        table = prediction_table.load_table(path)
+        if table is None:
+            try:
+                built = prediction_table.build_table(
+                    self._predict_ml_batch, self._predict_fallback_array
+                )
+            except Exception as e:
+                print(f"⚠️ Nie udało się zbudować tablicy predykcji: {e}")
+                return
+            try:
+                prediction_table.save_table(built, path)
+                table = prediction_table.load_table(path)
+            except Exception as e:
+                print(f"⚠️ Nie udało się zapisać tablicy predykcji ({path}): {e}")
+            if table is None:
+                table = built  # tylko w pamięci tego procesu
+            print(f"✅ Tablica predykcji zbudowana: {path}")
+        else:
+            print(f"✅ Tablica predykcji załadowana: {path}")
+
+        self.table = table
+        self.table_path = path
+        self._table_model = self.model
+
+    def _active_table(self) -> Optional[np.ndarray]:
+        """Tablica tylko dla modelu, z którego powstała."""
+        if self.table is not None and self.model is self._table_model:
+            return self.table
+        return None
+
     def predict(self, extracted: Dict[str, Any]) -> Dict[str, Any]:
         """
         Predykcja czasu półmaratonu.
@@ -195,7 +670,7 @@ class HalfMarathonPredictor:
         if gender not in {"male", "female"}:
             return {
                 "success": False,
-                "error": "Brak lub niepoprawna płeć. Wymagane: 'male' lub 'female'.",
+                "error": _ERR_GENDER,
                 "hint": "Podaj płeć: M/K, mężczyzna/kobieta, male/female",
             }
 
@@ -204,7 +679,7 @@ class HalfMarathonPredictor:
         except Exception:
             return {
                 "success": False,
-                "error": "Brak lub niepoprawny wiek. Wymagana liczba całkowita.",
+                "error": _ERR_AGE,
                 "hint": "Podaj wiek: liczba od 15 do 90 lat",
             }
 
@@ -213,7 +688,7 @@ class HalfMarathonPredictor:
         except Exception:
             return {
                 "success": False,
-                "error": "Brak lub niepoprawny czas 5km. Wymagana liczba sekund (int).",
+                "error": _ERR_TIME,
                 "hint": "Podaj czas 5km w formacie MM:SS (np. 24:30)",
             }
 
@@ -222,17 +697,32 @@ class HalfMarathonPredictor:
             return {"success": False, "error": f"Wiek {age} poza zakresem 15-90 lat."}
 
         if not (9 * 60 <= t5 <= 60 * 60):
-            return {
-                "success": False,
-                "error": "Czas 5km poza sensownym zakresem (9-60 minut).",
-            }
+            return {"success": False, "error": _ERR_TIME_RANGE}
+
+        with metrics.span("predict"):
+            result = self._snapshot()._predict_valid(t5, age, gender)
+        metrics.inc("predictions_total")
+        metrics.inc(f"predictions_{result['details']['mode']}")
+        return result
+
+    def _predict_valid(self, t5: int, age: int, gender: str) -> Dict[str, Any]:
+        """Predykcja dla zwalidowanych danych (wołana na migawce stanu)."""
+        # Tryb tablicy: odczyt O(1) zamiast modelu
+        table = self._active_table()
+        if table is not None:
+            value = int(prediction_table.lookup(table, int(gender == "male"), age, t5))
+            if value >= 0:
+                return self._format_prediction(value, mode="ml", confidence="high")
+            return self._format_prediction(-value, mode="fallback", confidence="medium")
 
         # Predykcja modelem ML (jeśli dostępny)
         if self.model is not None:
             try:
                 pred = self._predict_ml(t5, age, gender)
                 if pred and math.isfinite(pred) and pred > 0:
-                    return self._format_prediction(pred, mode="ml", confidence="high")
+                    return self._format_prediction(
+                        int(round(pred)), mode="ml", confidence="high"
+                    )
             except Exception as e:
                 print(f"⚠️ Błąd predykcji ML: {e}, przełączam na fallback")
 
@@ -240,26 +730,218 @@ class HalfMarathonPredictor:
         pred = self._predict_fallback(t5, age, gender)
         return self._format_prediction(pred, mode="fallback", confidence="medium")
 
+    def predict_batch(
+        self,
+        records: Iterable[Mapping[str, Any]] | pd.DataFrame | Mapping[str, Any] | None = None,
+        *,
+        gender: Any = None,
+        age: Any = None,
+        time_5km_seconds: Any = None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        Wektorowa predykcja dla wielu biegaczy (np. cała lista startowa).
+
+        Input (jedno z):
+            - lista dictów jak w predict()
+            - pd.DataFrame lub dict kolumn: gender, age, time_5km_seconds
+            - tablice NumPy: predict_batch(gender=..., age=..., time_5km_seconds=...)
+
+        Output (kolumny, jedna pozycja na wiersz wejścia):
+            {
+                'success': bool[],
+                'prediction_seconds': int64[] (0 dla błędnych wierszy),
+                'average_pace_min_per_km': float[] (nan dla błędnych wierszy),
+                'mode': 'ml'/'fallback'/None,
+                'confidence': str/None,
+                'error': str/None
+            }
+
+        Walidacja i fallback działają per wiersz jak w predict(),
+        ale model ML wołany jest raz dla całej macierzy cech.
+        """
+        genders, ages, times = _batch_columns(records, gender, age, time_5km_seconds)
+        n = len(genders)
+
+        g = np.array(
+            [v.strip().lower() if isinstance(v, str) else "" for v in genders],
+            dtype=object,
+        )
+        age_arr, age_ok = _int_column(ages)
+        t5_arr, t5_ok = _int_column(times)
+
+        gender_ok = (g == "male") | (g == "female")
+        age_in = age_ok & (age_arr >= 15) & (age_arr <= 90)
+        t5_in = t5_ok & (t5_arr >= 9 * 60) & (t5_arr <= 60 * 60)
+        valid = gender_ok & age_in & t5_in
+
+        # Komunikaty w tej samej kolejności co w predict() (ostatnie przypisanie wygrywa)
+        error = np.full(n, None, dtype=object)
+        error[t5_ok & ~t5_in] = _ERR_TIME_RANGE
+        bad_age = age_ok & ~age_in
+        error[bad_age] = [f"Wiek {a} poza zakresem 15-90 lat." for a in age_arr[bad_age]]
+        error[~t5_ok] = _ERR_TIME
+        error[~age_ok] = _ERR_AGE
+        error[~gender_ok] = _ERR_GENDER
+
+        seconds = np.zeros(n, dtype=np.int64)
+        mode = np.full(n, None, dtype=object)
+        confidence = np.full(n, None, dtype=object)
+
+        idx = np.flatnonzero(valid)
+        if idx.size:
+            t5_v, age_v, g_v = t5_arr[idx], age_arr[idx], g[idx]
+            sec_v, ml_ok = self._snapshot()._predict_rows(t5_v, age_v, g_v)
+
+            seconds[idx] = sec_v
+            mode[idx] = np.where(ml_ok, "ml", "fallback")
+            n_ml = int(ml_ok.sum())
+            metrics.inc("predictions_total", int(idx.size))
+            metrics.inc("predictions_ml", n_ml)
+            metrics.inc("predictions_fallback", int(idx.size) - n_ml)
+            confidence[idx] = np.where(
+                ml_ok, _CONFIDENCE_TEXT["high"], _CONFIDENCE_TEXT["medium"]
+            )
+
+        pace = np.full(n, np.nan)
+        pace[valid] = np.round(seconds[valid] / HALF_MARATHON_KM / 60, 2)
+
+        return {
+            "success": valid,
+            "prediction_seconds": seconds,
+            "average_pace_min_per_km": pace,
+            "mode": mode,
+            "confidence": confidence,
+            "error": error,
+        }
+
+    def predict_many(
+        self, records: Iterable[Mapping[str, Any]] | pd.DataFrame | Mapping[str, Any]
+    ) -> List[Dict[str, Any]]:
+        """
+        predict_batch() z wynikiem per wiersz w formacie predict()
+        (lista dictów, np. dla API HTTP). Jedna migawka modelu dla całej listy.
+        """
+        snap = self._snapshot()
+        batch = snap.predict_batch(records)
+        results: List[Dict[str, Any]] = []
+        for ok, sec, mode, error in zip(
+            batch["success"], batch["prediction_seconds"], batch["mode"], batch["error"]
+        ):
+            if not ok:
+                results.append({"success": False, "error": error})
+                continue
+            results.append(
+                snap._format_prediction(
+                    int(sec), mode=mode, confidence="high" if mode == "ml" else "medium"
+                )
+            )
+        return results
+
+    def _predict_rows(
+        self, t5_v: np.ndarray, age_v: np.ndarray, g_v: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Tablica lub model ML dla poprawnych wierszy + fallback tam, gdzie ML zawiódł."""
+        table = self._active_table()
+        if table is not None:
+            looked_up = prediction_table.lookup(
+                table, (g_v == "male").astype(np.intp), age_v, t5_v
+            ).astype(np.int64)
+            return np.abs(looked_up), looked_up >= 0
+
+        pred = np.full(t5_v.size, np.nan)
+        if self.model is not None:
+            try:
+                ml = self._predict_ml_batch(
+                    t5_v, age_v, (g_v == "male").astype(np.int64)
+                )
+                if ml is not None and ml.shape == pred.shape:
+                    pred = ml
+            except Exception as e:
+                print(f"⚠️ Błąd predykcji ML (batch): {e}, przełączam na fallback")
+
+        ml_ok = np.isfinite(pred) & (pred > 0)
+        sec_v = np.rint(np.where(ml_ok, pred, 0)).astype(np.int64)
+        fb = ~ml_ok
+        if fb.any():
+            sec_v[fb] = self._predict_fallback_array(t5_v[fb], age_v[fb], g_v[fb])
+        return sec_v, ml_ok
+
+    @staticmethod
+    def _feature_values(
+        t5: np.ndarray, age: np.ndarray, gender_encoded: np.ndarray
+    ) -> Dict[str, Any]:
+        pace_5k = t5 / 5
+        return {
+            "Płeć_encoded": gender_encoded,
+            "Wiek": age,
+            "5 km Czas_seconds": t5,
+            "5 km Tempo": pace_5k,
+            "10 km Tempo": pace_5k * 1.05,  # estymacja
+            "15 km Tempo": pace_5k * 1.08,  # estymacja
+            "Tempo Stabilność": 0.03,       # średnia wartość
+        }
+
+    def _feature_frame(
+        self, t5: np.ndarray, age: np.ndarray, gender_encoded: np.ndarray
+    ) -> pd.DataFrame:
+        """Macierz cech (N wierszy) w kolejności feature_order."""
+        import pandas as pd
+
+        feature_values = self._feature_values(t5, age, gender_encoded)
+        n = len(t5)
+        return pd.DataFrame(
+            {
+                feat: np.broadcast_to(feature_values.get(feat, 0), (n,))
+                for feat in self.feature_order
+            }
+        )
+
+    @staticmethod
+    def _basic_matrix(
+        t5: np.ndarray, age: np.ndarray, gender_encoded: np.ndarray, n_features: int
+    ) -> np.ndarray:
+        """Stary układ cech bez feature_order: [płeć, wiek, czas 5 km(, tempo 5 km)]."""
+        columns = [gender_encoded, age, t5, t5 / 5][:n_features]
+        return np.column_stack(columns)
+
+    def _engine_matrix(
+        self,
+        t5: np.ndarray,
+        age: np.ndarray,
+        gender_encoded: np.ndarray,
+        engine: CompiledTreeEnsemble,
+    ) -> np.ndarray:
+        """Te same cechy co _feature_frame / _basic_matrix, ale jako float32 bez pandas."""
+        if not self.feature_order:
+            return self._basic_matrix(t5, age, gender_encoded, engine.n_features).astype(np.float32)
+        feature_values = self._feature_values(t5, age, gender_encoded)
+        X = np.empty((len(t5), len(self.feature_order)), dtype=np.float32)
+        for j, feat in enumerate(self.feature_order):
+            X[:, j] = feature_values.get(feat, 0)
+        return X
+
     def _predict_ml(self, t5: int, age: int, gender: str) -> float | None:
         """Predykcja za pomocą modelu ML - z uwzględnieniem feature_order"""
         gender_encoded = 1 if gender == "male" else 0
         pace_5k = t5 / 5
 
+        engine = self._active_engine()
+        if engine is not None:
+            with metrics.span("features"):
+                X = self._engine_matrix(
+                    np.array([t5]), np.array([age]), np.array([gender_encoded]), engine
+                )
+            with metrics.span("inference"):
+                return float(engine.predict(X)[0])
+
         # Użyj feature_order jeśli dostępne
         if self.feature_order:
-            feature_values = {
-                "Płeć_encoded": gender_encoded,
-                "Wiek": age,
-                "5 km Czas_seconds": t5,
-                "5 km Tempo": pace_5k,
-                "10 km Tempo": pace_5k * 1.05,  # estymacja
-                "15 km Tempo": pace_5k * 1.08,  # estymacja
-                "Tempo Stabilność": 0.03,       # średnia wartość
-            }
-            X = pd.DataFrame(
-                [{feat: feature_values.get(feat, 0) for feat in self.feature_order}]
-            )
-            return float(self.model.predict(X)[0])
+            with metrics.span("features"):
+                X = self._feature_frame(
+                    np.array([t5]), np.array([age]), np.array([gender_encoded])
+                )
+            with metrics.span("inference"):
+                return float(self.model.predict(X)[0])
 
         # Fallback do starej logiki (próba różnych kombinacji)
         try:
@@ -272,6 +954,33 @@ class HalfMarathonPredictor:
             except Exception:
                 return None
 
+    def _predict_ml_batch(
+        self, t5: np.ndarray, age: np.ndarray, gender_encoded: np.ndarray
+    ) -> np.ndarray | None:
+        """Jedno wywołanie model.predict (lub skompilowanych drzew) dla całej macierzy cech."""
+        engine = self._active_engine()
+        if engine is not None and len(t5) <= ENGINE_MAX_BATCH:
+            with metrics.span("features"):
+                X = self._engine_matrix(t5, age, gender_encoded, engine)
+            with metrics.span("inference"):
+                return engine.predict(X).astype(float)
+
+        if self.feature_order:
+            with metrics.span("features"):
+                X = self._feature_frame(t5, age, gender_encoded)
+            with metrics.span("inference"):
+                return np.asarray(self.model.predict(X), dtype=float).reshape(-1)
+
+        try:
+            X = np.column_stack([gender_encoded, age, t5, t5 / 5])
+            return np.asarray(self.model.predict(X), dtype=float).reshape(-1)
+        except Exception:
+            try:
+                X = np.column_stack([gender_encoded, age, t5])
+                return np.asarray(self.model.predict(X), dtype=float).reshape(-1)
+            except Exception:
+                return None
+
     def _predict_fallback(self, t5: int, age: int, gender: str) -> int:
         """
         Heurystyczna predykcja oparta na współczynnikach.
@@ -302,38 +1011,62 @@ class HalfMarathonPredictor:
 
         return int(round(base))
 
+    def _predict_fallback_array(self, t5: Any, age: Any, gender: Any) -> np.ndarray:
+        """
+        Wektorowa wersja _predict_fallback dla całych tablic.
+        Te same operacje zmiennoprzecinkowe w tej samej kolejności,
+        więc wynik jest bit w bit zgodny z wersją skalarną.
+        """
+        t5 = np.asarray(t5, dtype=np.int64)
+        age = np.asarray(age, dtype=np.int64)
+
+        # Bazowy współczynnik + korekta płci
+        base = 4.46 * t5
+        base = np.where(np.asarray(gender) == "female", base * 1.03, base)
+
+        # Korekta wieku (te same przedziały co w wersji skalarnej)
+        factor = np.select(
+            [age < 20, age <= 35, age <= 50, age <= 65],
+            [
+                1 + 0.005 * (20 - age),
+                1.0,
+                1 + 0.003 * (age - 35),
+                1 + 0.003 * 15 + 0.005 * (age - 50),
+            ],
+            default=1 + 0.003 * 15 + 0.005 * 15 + 0.01 * (age - 65),
+        )
+        base = base * factor
+
+        # Ograniczenia (1h-4h), round-half-even jak round()
+        base = np.minimum(np.maximum(base, 60 * 60), 4 * 60 * 60)
+        return np.rint(base).astype(np.int64)
+
     def _format_prediction(
         self, total_seconds: int, mode: str, confidence: str = "medium"
     ) -> Dict[str, Any]:
         """Formatowanie wyniku predykcji"""
-        hours = total_seconds // 3600
-        minutes = (total_seconds % 3600) // 60
-        seconds = total_seconds % 60
-
-        # Tempo średnie (min/km)
-        half_marathon_km = 21.0975
-        avg_pace_sec_per_km = total_seconds / half_marathon_km
-        avg_pace_min_per_km = avg_pace_sec_per_km / 60
-
-        confidence_text = {
-            "high": "Wysoka (model ML)",
-            "medium": "Średnia (heurystyka)",
-            "low": "Niska (brak danych)",
-        }
+        with metrics.span("format"):
+            hours = total_seconds // 3600
+            minutes = (total_seconds % 3600) // 60
+            seconds = total_seconds % 60
 
-        return {
-            "success": True,
-            "prediction_seconds": total_seconds,
-            "formatted_time": f"{hours}:{minutes:02d}:{seconds:02d}",
-            "hours": hours,
-            "minutes": minutes,
-            "seconds": seconds,
-            "average_pace_min_per_km": round(avg_pace_min_per_km, 2),
-            "confidence": confidence_text.get(confidence, "medium"),
-            "details": {
-                "mode": mode,
-                "model_version": self.model_metadata.get("version"),
-                "model_source": self.model_metadata.get("source"),
-                "features_used": self.feature_order if self.feature_order else "basic",
-            },
-        }
+            # Tempo średnie (min/km)
+            avg_pace_sec_per_km = total_seconds / HALF_MARATHON_KM
+            avg_pace_min_per_km = avg_pace_sec_per_km / 60
+
+            return {
+                "success": True,
+                "prediction_seconds": total_seconds,
+                "formatted_time": f"{hours}:{minutes:02d}:{seconds:02d}",
+                "hours": hours,
+                "minutes": minutes,
+                "seconds": seconds,
+                "average_pace_min_per_km": round(avg_pace_min_per_km, 2),
+                "confidence": _CONFIDENCE_TEXT.get(confidence, "medium"),
+                "details": {
+                    "mode": mode,
+                    "model_version": self.model_metadata.get("version"),
+                    "model_source": self.model_metadata.get("source"),
+                    "features_used": self.feature_order if self.feature_order else "basic",
+                },
+            }
@@ -0,0 +1,169 @@
+# utils/model_watcher.py
+from __future__ import annotations
+
+import os
+import threading
+from typing import Any, Optional
+
+from .artifact_cache import ArtifactCache
+from .model_predictor import (
+    SPACES_MANIFEST_KEY,
+    SPACES_METADATA_KEY,
+    SPACES_MODEL_KEY,
+    HalfMarathonPredictor,
+    _manifest_sha256,
+    _sha256_file,
+    _spaces_client,
+    _try_load_model,
+)
+
+# ── Hot reload modelu ze Spaces ──────────────────────────────────────────────
+# Co MODEL_WATCH_INTERVAL sekund tani head_object na modelu w Spaces. Gdy
+# zmieni się ETag: pobranie do cache artefaktów (model_cache/objects/<sha256>,
+# nie nadpisuje działającego pliku), weryfikacja SHA-256 (manifest publikacji,
+# metadata 'model_sha256' lub MODEL_SHA256), rozgrzewka
+# i atomowa podmiana w predyktorze (HalfMarathonPredictor.reload_from).
+
+DEFAULT_INTERVAL = 300.0
+
+
+class ModelWatcher:
+    """Wątek tła pilnujący nowej wersji modelu w Spaces."""
+
+    def __init__(
+        self,
+        predictor: HalfMarathonPredictor,
+        interval: Optional[float] = None,
+        client: Any = None,
+        bucket: Optional[str] = None,
+        model_key: str = SPACES_MODEL_KEY,
+        metadata_key: str = SPACES_METADATA_KEY,
+        manifest_key: str = SPACES_MANIFEST_KEY,
+    ):
+        self.predictor = predictor
+        self.interval = float(
+            interval if interval is not None
+            else os.getenv("MODEL_WATCH_INTERVAL", DEFAULT_INTERVAL)
+        )
+        self.bucket = bucket or os.getenv("DO_SPACES_BUCKET")
+        self.model_key = model_key
+        self.metadata_key = metadata_key
+        self.manifest_key = manifest_key
+        self._client = client
+        self._cache: Optional[ArtifactCache] = None
+        self.current_etag: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self.reloads = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _s3(self):
+        if self._client is None:
+            region = os.getenv("DO_SPACES_REGION", "fra1")
+            self._client = _spaces_client(
+                f"https://{region}.digitaloceanspaces.com",
+                os.getenv("DO_SPACES_KEY"),
+                os.getenv("DO_SPACES_SECRET"),
+            )
+        return self._client
+
+    def _artifacts(self) -> ArtifactCache:
+        if self._cache is None:
+            self._cache = ArtifactCache(self._s3(), self.bucket)
+        return self._cache
+
+    def _head_etag(self) -> str:
+        head = self._s3().head_object(Bucket=self.bucket, Key=self.model_key)
+        return f"{head.get('ETag')}|{head.get('LastModified')}"
+
+    def check_once(self) -> bool:
+        """Jedno sprawdzenie; True gdy nowy model został podmieniony."""
+        try:
+            etag = self._head_etag()
+        except Exception as e:
+            self.last_error = f"head_object: {e}"
+            print(f"⚠️ Model watcher: {self.last_error}")
+            return False
+
+        if etag == self.current_etag:
+            return False
+        # także pierwszy odczyt: _reload porówna treść (SHA-256) z działającym
+        # modelem - ta sama wersja nie jest podmieniana, inna (opublikowana po
+        # starcie albo inna niż lokalny MODEL_PATH) jest ładowana
+        return self._reload(etag)
+
+    def _reload(self, etag: str) -> bool:
+        cache = self._artifacts()
+        # IfMatch: plik musi być dokładnie tą wersją, którą zobaczył head_object
+        model_path = cache.fetch(self.model_key, if_match=etag.split("|", 1)[0])
+        if model_path is None:
+            self.last_error = f"pobranie {self.model_key} nieudane"
+            return False
+        if self.predictor.model is not None and _sha256_file(model_path) == self.predictor.model_sha256:
+            # ten sam model co działający (np. pierwsze sprawdzenie po starcie)
+            self.current_etag = etag
+            return False
+
+        meta_path = cache.fetch(self.metadata_key)  # metadata opcjonalne, jak przy starcie
+        # manifest zapisywany jako ostatni: jeśli jeszcze stary, mismatch i ponowna
+        # próba przy następnym sprawdzeniu (current_etag bez zmian)
+        manifest_path = cache.fetch(self.manifest_key)
+
+        meta_expected = _manifest_sha256(manifest_path, self.metadata_key)
+        if meta_path and meta_expected and _sha256_file(meta_path) != meta_expected:
+            self.last_error = f"checksum mismatch: {self.metadata_key}"
+            print(f"⚠️ Model watcher: {self.last_error}")
+            return False
+
+        meta = _try_load_model(meta_path) if meta_path else None
+        expected = _manifest_sha256(manifest_path, self.model_key)
+        if expected is None and isinstance(meta, dict):
+            expected = meta.get("model_sha256")
+        expected = expected or os.getenv("MODEL_SHA256")
+
+        ok = self.predictor.reload_from(
+            model_path,
+            meta_path,
+            source=f"s3://{self.bucket}/{self.model_key}",
+            expected_sha256=expected,
+        )
+        if not ok:
+            self.last_error = self.predictor.load_status().get("error")
+            return False
+
+        self.current_etag = etag
+        self.last_error = None
+        self.reloads += 1
+        print(f"✅ Model watcher: nowa wersja modelu aktywna ({etag.split('|', 1)[0]})")
+        return True
+
+    def _run(self) -> None:
+        # ładowanie w tle (MODEL_ASYNC_LOAD) musi się skończyć przed pierwszym porównaniem
+        self.predictor.wait_until_loaded()
+        while not self._stop.is_set():
+            self.check_once()
+            self._stop.wait(self.interval)
+
+    def start(self) -> "ModelWatcher":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="model-watcher", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def maybe_start_watcher(predictor: HalfMarathonPredictor) -> Optional[ModelWatcher]:
+    """Start watchera, gdy MODEL_WATCH=1 i skonfigurowane Spaces."""
+    if os.getenv("MODEL_WATCH", "0") != "1":
+        return None
+    if not (os.getenv("DO_SPACES_BUCKET") and os.getenv("DO_SPACES_KEY") and os.getenv("DO_SPACES_SECRET")):
+        print("⚠️ MODEL_WATCH=1, ale brak konfiguracji Spaces - watcher wyłączony")
+        return None
+    return ModelWatcher(predictor).start()
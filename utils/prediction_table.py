@@ -0,0 +1,132 @@
+# utils/prediction_table.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+from .artifact_cache import PRUNE_GRACE_S
+
+# ── Tablica predykcji dla całej (skończonej) dziedziny wejść ────────────────
+# predict() akceptuje tylko: płeć {female, male} x wiek 15..90 x czas 5 km
+# 540..3600 s (liczby całkowite) = 2 x 76 x 3061 ≈ 465 tys. punktów. Model
+# liczony jest raz dla wszystkich, a predykcja to odczyt table[g, wiek, czas].
+#
+# Wartości (int32, sekundy):
+#   >= 0 -> predykcja modelu ML (już zaokrąglona)
+#   <  0 -> model nie dał sensownego wyniku; -wartość = fallback heurystyczny
+
+AGE_MIN, AGE_MAX = 15, 90
+T5_MIN, T5_MAX = 9 * 60, 60 * 60
+GENDERS = ("female", "male")  # indeks == Płeć_encoded
+TABLE_SHAPE = (len(GENDERS), AGE_MAX - AGE_MIN + 1, T5_MAX - T5_MIN + 1)
+
+DEFAULT_DIR = "model_cache"
+
+
+def table_key(model_sha256: str, feature_order: Optional[Sequence[str]] = None) -> str:
+    """Klucz tablicy: SHA-256 pliku modelu + kolejność cech (zmiana = nowa tablica)."""
+    raw = model_sha256 + "\x1f" + json.dumps(list(feature_order or []), ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def table_path(key: str, directory: Optional[str] = None) -> str:
+    directory = directory or os.getenv("PREDICTION_TABLE_DIR", DEFAULT_DIR)
+    return os.path.join(directory, f"prediction_table_{key}.npy")
+
+
+def prune_tables(keep_key: str, directory: Optional[str] = None) -> None:
+    """
+    Usuń tablice innych wersji modelu (jak ArtifactCache._prune). Świeże
+    (PRUNE_GRACE_S) zostają - mógł je właśnie zapisać worker z nowszym
+    modelem. Proces, który ma starą tablicę zmapowaną, czyta dalej (Linux).
+    """
+    keep = os.path.basename(table_path(keep_key, directory))
+    directory = os.path.dirname(table_path(keep_key, directory))
+    now = time.time()
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        if not (name.startswith("prediction_table_") and name.endswith(".npy")) or name == keep:
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) > PRUNE_GRACE_S:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def build_table(
+    predict_ml: Callable[[np.ndarray, np.ndarray, np.ndarray], Optional[np.ndarray]],
+    predict_fallback: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray],
+) -> np.ndarray:
+    """
+    Liczy tablicę dla całej dziedziny, jedna płeć na wywołanie modelu.
+    predict_ml(t5, age, gender_encoded) -> float[] (jak _predict_ml_batch),
+    predict_fallback(t5, age, gender) -> int[] (jak _predict_fallback_array).
+    """
+    _, n_age, n_t5 = TABLE_SHAPE
+    age, t5 = np.meshgrid(
+        np.arange(AGE_MIN, AGE_MAX + 1), np.arange(T5_MIN, T5_MAX + 1), indexing="ij"
+    )
+    age, t5 = age.ravel(), t5.ravel()
+
+    table = np.empty(TABLE_SHAPE, dtype=np.int32)
+    for g, gender in enumerate(GENDERS):
+        pred = predict_ml(t5, age, np.full(t5.shape, g, dtype=np.int64))
+        if pred is None:
+            pred = np.full(t5.shape, np.nan)
+        pred = np.asarray(pred, dtype=float).reshape(-1)
+        ok = np.isfinite(pred) & (pred > 0)
+        seconds = np.rint(np.where(ok, pred, 0)).astype(np.int64)
+        if not ok.all():
+            fb = ~ok
+            seconds[fb] = -predict_fallback(t5[fb], age[fb], np.full(fb.sum(), gender))
+        table[g] = seconds.reshape(n_age, n_t5).astype(np.int32)
+    return table
+
+
+def save_table(table: np.ndarray, path: str) -> None:
+    """Zapis atomowy (tmp + os.replace) - równoległe workery nie widzą pół-pliku."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, table)
+    os.replace(tmp, path)
+
+
+def load_table(path: str, mmap: bool = True) -> Optional[np.ndarray]:
+    """Tablica z pliku (domyślnie memory-mapped, współdzielona przez procesy)."""
+    try:
+        table = np.load(path, mmap_mode="r" if mmap else None)
+    except Exception:
+        return None
+    if table.shape != TABLE_SHAPE or table.dtype != np.int32:
+        print(f"⚠️ Niepoprawna tablica predykcji ({path}) - pomijam")
+        return None
+    return table
+
+
+def lookup(table: np.ndarray, gender_encoded, age, t5):
+    """Odczyt O(1) (skalarny lub wektorowy) - wejście już zwalidowane."""
+    return table[gender_encoded, np.subtract(age, AGE_MIN), np.subtract(t5, T5_MIN)]
+
+
+if __name__ == "__main__":
+    # Budowa offline dla bieżącego modelu: python -m utils.prediction_table
+    os.environ["PREDICTION_TABLE"] = "1"
+    from .model_predictor import HalfMarathonPredictor
+
+    predictor = HalfMarathonPredictor()
+    if predictor.table is None:
+        raise SystemExit("❌ Brak modelu ML - tablica nie została zbudowana")
+    print(f"✅ Tablica gotowa: {predictor.table_path}")
@@ -0,0 +1,317 @@
+# utils/tree_engine.py
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import time
+from typing import Any, Optional
+
+import numpy as np
+
+from .artifact_cache import PRUNE_GRACE_S
+
+# ── Skompilowany las drzew (XGBoost) ─────────────────────────────────────────
+# Drzewa boostera spłaszczone do ciągłych tablic NumPy. Predykcja to
+# wektorowe zejście po wszystkich drzewach naraz (max_depth kroków), bez
+# DataFrame/DMatrix i bez narzutu wątków XGBoost na każde wywołanie.
+# Semantyka jak w predyktorze CPU XGBoost: cechy i progi w float32,
+# x < próg -> lewe dziecko, NaN -> default_left, sumowanie liści po kolei
+# w float32 startując od base_score.
+
+# Katalog współdzielonych (memory-mapped) tablic drzew: jeden plik .npy na tablicę
+SHARED_ARRAYS = ("feature", "threshold", "children", "default_left", "roots")
+DEFAULT_SHARED_DIR = "model_cache"
+
+# Wiersze przetwarzane naraz (tablice (N, drzewa) mieszczą się w cache)
+_CHUNK_ROWS = 256
+
+# Cele z tożsamościową funkcją linku (wynik = margines)
+_IDENTITY_OBJECTIVES = {
+    "reg:squarederror",
+    "reg:squaredlogerror",
+    "reg:pseudohubererror",
+    "reg:absoluteerror",
+    "reg:quantileerror",
+}
+
+
+class CompiledTreeEnsemble:
+    """
+    Las drzew regresyjnych w tablicach:
+      feature[i], threshold[i], left[i], right[i], default_left[i], value[i]
+    dla wszystkich węzłów wszystkich drzew (indeksy globalne). Liście
+    wskazują same na siebie, więc pętla po głębokości nie potrzebuje maski.
+    """
+
+    def __init__(
+        self,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        left: np.ndarray,
+        right: np.ndarray,
+        default_left: np.ndarray,
+        value: np.ndarray,
+        roots: np.ndarray,
+        base_score: float,
+        n_features: int,
+        max_depth: int,
+        feature_names: Optional[list] = None,
+        children: Optional[np.ndarray] = None,
+    ):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        # [lewe, prawe] w jednej tablicy: jeden gather na poziom zamiast dwóch + where
+        self.children = children if children is not None else np.stack([left, right], axis=1)
+        self.default_left = default_left
+        self.value = value
+        self.roots = roots
+        self.base_score = np.float32(base_score)
+        self.n_features = n_features
+        self.max_depth = max_depth
+        self.feature_names = feature_names
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    @classmethod
+    def from_xgboost(cls, model: Any) -> "CompiledTreeEnsemble":
+        """
+        Kompilacja z XGBRegressor lub Booster (przez save_raw('json')).
+        ValueError dla modeli, których nie odwzorowujemy 1:1
+        (dart, kategorie, wiele wyjść, nieliniowy link).
+        """
+        booster = model.get_booster() if hasattr(model, "get_booster") else model
+        raw = json.loads(bytes(booster.save_raw(raw_format="json")))
+        learner = raw["learner"]
+
+        gb = learner["gradient_booster"]
+        if gb.get("name") != "gbtree":
+            raise ValueError(f"Nieobsługiwany booster: {gb.get('name')}")
+        objective = learner["objective"]["name"]
+        if objective not in _IDENTITY_OBJECTIVES:
+            raise ValueError(f"Nieobsługiwany cel: {objective}")
+        params = learner["learner_model_param"]
+        if int(params.get("num_target", 1)) != 1 or int(params.get("num_class", 0)) > 1:
+            raise ValueError("Obsługiwane tylko modele z jednym wyjściem")
+
+        trees = gb["model"]["trees"]
+        # predict() sklearn używa best_iteration po early stopping
+        best = getattr(model, "best_iteration", None) if hasattr(model, "get_booster") else None
+        if best is not None:
+            indptr = gb["model"].get("iteration_indptr")
+            trees = trees[: indptr[best + 1]] if indptr else trees[: best + 1]
+
+        feats, thrs, lefts, rights, defaults, roots = [], [], [], [], [], []
+        max_depth = 0
+        offset = 0
+        for tree in trees:
+            if any(int(t) != 0 for t in tree.get("split_type", [])):
+                raise ValueError("Podziały kategoryczne nie są obsługiwane")
+            left = np.asarray(tree["left_children"], dtype=np.int32)
+            right = np.asarray(tree["right_children"], dtype=np.int32)
+            n = len(left)
+            own = np.arange(n, dtype=np.int32)
+            leaf = left == -1
+
+            roots.append(offset)
+            feats.append(np.where(leaf, 0, tree["split_indices"]).astype(np.int32))
+            thrs.append(np.asarray(tree["split_conditions"], dtype=np.float32))
+            lefts.append(np.where(leaf, own, left) + offset)
+            rights.append(np.where(leaf, own, right) + offset)
+            defaults.append(np.asarray(tree["default_left"], dtype=bool))
+            max_depth = max(max_depth, _tree_depth(left, right))
+            offset += n
+
+        if not roots:
+            raise ValueError("Model bez drzew")
+
+        threshold = np.concatenate(thrs)
+        base_score = float(str(params["base_score"]).strip("[]"))
+        names = learner.get("feature_names") or None
+        return cls(
+            feature=np.concatenate(feats),
+            threshold=threshold,
+            left=np.concatenate(lefts).astype(np.int32),
+            right=np.concatenate(rights).astype(np.int32),
+            default_left=np.concatenate(defaults),
+            value=threshold,  # w liściach split_conditions == wartość liścia
+            roots=np.asarray(roots, dtype=np.int32),
+            base_score=base_score,
+            n_features=int(params["num_feature"]),
+            max_depth=max_depth,
+            feature_names=names,
+        )
+
+    def save(self, directory: str, model_sha256: Optional[str] = None) -> None:
+        """
+        Zapis do katalogu: <tablica>.npy + meta.json. Atomowo (katalog tmp +
+        rename) - inne procesy widzą cały komplet albo nic.
+        """
+        if os.path.isdir(directory):
+            return
+        parent = os.path.dirname(directory)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        tmp = f"{directory}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        try:
+            for name in SHARED_ARRAYS:
+                np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+            meta = {
+                "base_score": float(self.base_score),
+                "n_features": self.n_features,
+                "max_depth": self.max_depth,
+                "feature_names": self.feature_names,
+                "model_sha256": model_sha256,
+            }
+            with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.rename(tmp, directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+            # inny proces zdążył pierwszy - jego kopia jest identyczna
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    @classmethod
+    def load(
+        cls, directory: str, model_sha256: Optional[str] = None, mmap: bool = True
+    ) -> Optional["CompiledTreeEnsemble"]:
+        """
+        Odczyt zapisanych tablic przez np.load(mmap_mode='r'): procesy na
+        jednym hoście współdzielą strony pamięci (page cache) zamiast
+        deserializować model każdy osobno. None, gdy brak/niezgodny katalog.
+        """
+        try:
+            with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if model_sha256 and meta.get("model_sha256") != model_sha256:
+                return None
+            arrays = {
+                name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r" if mmap else None)
+                for name in SHARED_ARRAYS
+            }
+        except Exception:
+            return None
+
+        children = arrays["children"]
+        return cls(
+            feature=arrays["feature"],
+            threshold=arrays["threshold"],
+            left=children[:, 0],
+            right=children[:, 1],
+            default_left=arrays["default_left"],
+            value=arrays["threshold"],  # jak w from_xgboost: liście w split_conditions
+            roots=arrays["roots"],
+            base_score=meta["base_score"],
+            n_features=int(meta["n_features"]),
+            max_depth=int(meta["max_depth"]),
+            feature_names=meta.get("feature_names"),
+            children=children,
+        )
+
+    def predict(self, X: Any) -> np.ndarray:
+        """Predykcja dla macierzy (N, n_features) lub jednego wiersza -> float32[N]."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features:
+            raise ValueError(
+                f"Oczekiwano {self.n_features} cech, otrzymano {X.shape[1]}"
+            )
+
+        out = np.empty(X.shape[0], dtype=np.float32)
+        for start in range(0, X.shape[0], _CHUNK_ROWS):
+            chunk = X[start:start + _CHUNK_ROWS]
+            out[start:start + len(chunk)] = self._predict_chunk(chunk)
+        return out
+
+    def _predict_chunk(self, X: np.ndarray) -> np.ndarray:
+        n, n_features = X.shape
+        flat = X.ravel()
+        row_base = (np.arange(n, dtype=np.int32) * n_features)[:, None]
+        has_nan = bool(np.isnan(flat).any())
+
+        node = np.broadcast_to(self.roots, (n, self.n_trees))
+        for _ in range(self.max_depth):
+            x = flat[row_base + self.feature[node]]
+            go_right = x >= self.threshold[node]
+            if has_nan:
+                missing = np.isnan(x)
+                go_right[missing] = ~self.default_left[node[missing]]
+            node = self.children[node, go_right.view(np.int8)]
+
+        # sumowanie sekwencyjne (cumsum) w float32 - jak w XGBoost, drzewo po drzewie
+        acc = np.empty((n, self.n_trees + 1), dtype=np.float32)
+        acc[:, 0] = self.base_score
+        acc[:, 1:] = self.value[node]
+        return np.cumsum(acc, axis=1, dtype=np.float32)[:, -1]
+
+
+class SharedTreeModel:
+    """
+    Zamiennik modelu XGBoost oparty wyłącznie na współdzielonych tablicach
+    (tryb MODEL_SHARED=1) - proces nie odpakowuje pickle z boosterem.
+    predict() przyjmuje macierz/DataFrame w kolejności cech modelu.
+    """
+
+    def __init__(self, engine: CompiledTreeEnsemble):
+        self.engine = engine
+
+    def predict(self, X: Any) -> np.ndarray:
+        return self.engine.predict(np.asarray(X, dtype=np.float32))
+
+
+def shared_dir(key: str, directory: Optional[str] = None) -> str:
+    directory = directory or os.getenv("MODEL_SHARED_DIR", DEFAULT_SHARED_DIR)
+    return os.path.join(directory, f"shared_model_{key}")
+
+
+def prune_shared(keep_key: str, directory: Optional[str] = None) -> None:
+    """Usuń katalogi shared_model_* innych wersji modelu starsze niż PRUNE_GRACE_S."""
+    keep = shared_dir(keep_key, directory)
+    parent = os.path.dirname(keep)
+    now = time.time()
+    try:
+        names = os.listdir(parent)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(parent, name)
+        # katalogi .tmp należą do zapisu w toku (save sprząta je sam)
+        if not name.startswith("shared_model_") or name.endswith(".tmp") or path == keep:
+            continue
+        try:
+            if os.path.isdir(path) and now - os.path.getmtime(path) > PRUNE_GRACE_S:
+                shutil.rmtree(path)
+        except OSError:
+            pass
+
+
+def _tree_depth(left: np.ndarray, right: np.ndarray) -> int:
+    """Głębokość drzewa (liczba podziałów na najdłuższej ścieżce)."""
+    depth = 0
+    level = np.array([0])
+    while True:
+        level = level[left[level] != -1]
+        if level.size == 0:
+            return depth
+        level = np.concatenate([left[level], right[level]])
+        depth += 1
+
+
+def compile_model(model: Any) -> Optional[CompiledTreeEnsemble]:
+    """CompiledTreeEnsemble dla modeli XGBoost, None dla pozostałych."""
+    if not (hasattr(model, "get_booster") or hasattr(model, "save_raw")):
+        return None
+    try:
+        return CompiledTreeEnsemble.from_xgboost(model)
+    except Exception as e:
+        print(f"⚠️ Kompilacja drzew niemożliwa ({e}) - zostaje model.predict")
+        return None